@@ -0,0 +1,81 @@
+from ..runner.singleflight import SingleFlight
+
+from datetime import datetime, timedelta
+from threading import Lock
+
+# Contributors of a repo are refreshed (with the commits made since the last refresh) once
+# they're older than this.
+CONTRIBUTORS_UPDATE_INTERVAL_HOURS = 1
+
+
+class ContributorSet(object):
+    '''
+    Contributors of a repo (lowercased logins). `logins` is a frozen set which is replaced on
+    every change, so that readers never need the lock (or a copy).
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.logins = frozenset()
+        self.refreshed_at = None      # UTC time of the last refresh (if any)
+
+    def is_stale(self, now=None):
+        now = datetime.utcnow() if now is None else now
+        interval = timedelta(hours=CONTRIBUTORS_UPDATE_INTERVAL_HOURS)
+        return self.refreshed_at is None or now - self.refreshed_at >= interval
+
+    def update(self, logins, refreshed_at=None):
+        with self.lock:
+            self.logins = self.logins.union(login.lower() for login in logins)
+            if refreshed_at is not None:
+                self.refreshed_at = refreshed_at
+
+
+class ContributorRegistry(object):
+    '''
+    Process-wide contributors of the repos (shared by all the installations and their API
+    providers). Repos are fetched in full the first time they're needed, and after that, they're
+    refreshed only with the authors of the commits made since their last refresh. Concurrent
+    refreshes of a repo share the same fetch.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = Lock()
+        self.repos = {}
+        self.refreshes = SingleFlight()
+
+    def get(self, repo):
+        with self.lock:
+            contributors = self.repos.get(repo.lower())
+            if contributors is None:
+                contributors = self.repos[repo.lower()] = ContributorSet()
+            return contributors
+
+    def refresh(self, repo, fetch_all, fetch_since, force=False):
+        '''
+        Refresh the contributors of a repo (if they're stale, or if `force` is set) and get them.
+        `fetch_all()` gets all the contributors, and `fetch_since(since)` gets the ones who've
+        made commits since the given UTC time.
+        '''
+
+        contributors = self.get(repo)
+
+        def refresh():
+            if not (force or contributors.is_stale()):
+                return
+            start, since = datetime.utcnow(), contributors.refreshed_at
+            logins = fetch_all() if since is None else fetch_since(since)
+            contributors.update(logins, refreshed_at=start)
+
+        if force or contributors.is_stale():
+            self.refreshes.do(repo.lower(), refresh)
+        return contributors.logins
+
+    def add(self, repo, login):
+        self.get(repo).update([login])
+
+
+CONTRIBUTORS = ContributorRegistry()
@@ -1,21 +1,62 @@
+from ..runner.retry import PermanentError, TransientError
+from datetime import datetime
+from graphql import GRAPHQL_URL, MAX_BATCH, build_issues_query, parse_issue_states
 from interface import APIProvider
+from mutations import COMMENT_SEPARATOR, MutationBuffer, combine_comments, use_label_endpoints
+from urllib import quote
 
+import json
 import re
 
+PAGE_PATTERN = re.compile(r'([?&]page=)(\d+)')
+
+
+def parse_links(header):
+    '''Parse the `Link` header of a paginated response into a dict of `rel` to URLs.'''
+
+    return dict((rel, url) for url, rel in re.findall(r'<([^>]*)>;\s*rel="([^"]*)"', header))
+
+
+def page_number(url):
+    match = PAGE_PATTERN.search(url or '')
+    return int(match.group(2)) if match else None
+
+
 class GithubAPIProvider(APIProvider):
     base_url = 'https://api.github.com/repos/%s/%s'
     issue_url = base_url + '/issues/%s'
     branch_url = base_url + '/branches/%s'
     comments_post_url = issue_url + '/comments'
+    comments_since_url = comments_post_url + '?since=%s&per_page=100'
+    issues_since_url = base_url + '/issues?state=all&since=%s&per_page=100'
     comments_patch_url = base_url + '/issues/comments/%s'
     labels_url = issue_url + '/labels'
+    label_url = labels_url + '/%s'
     assignees_url = issue_url + '/assignees'
     diff_url = 'https://github.com/%s/%s/pull/%s.diff'
-    contributors_url = base_url + '/contributors?per_page=500'
+    contributors_url = base_url + '/contributors?per_page=100'
+    commits_since_url = base_url + '/commits?since=%s&per_page=100'
+    user_commits_url = base_url + '/commits?author=%s&per_page=1'
+    graphql_url = GRAPHQL_URL
 
-    def __init__(self, config, payload, store, api_json_request):
+    def __init__(self, config, payload, store, api_json_request, buffered=False):
         super(GithubAPIProvider, self).__init__(config, payload, store)
-        self._request = api_json_request
+        self._json_request = api_json_request
+        # Label, assignee (and comment) changes are collected here. If the provider is `buffered`,
+        # then they're made only when `flush_mutations` is called (once the handlers are done).
+        self.buffer = MutationBuffer()
+        self.buffered = buffered
+        self.own_issue = (self.owner, self.repo, self.number)
+        # (owner, repo) -> {number: state} for the issues/PRs whose states we've fetched (the
+        # state is `None` if the issue/PR couldn't be fetched).
+        self.issue_states = {}
+        # If enabled, then the comments posted (by the handlers which allow it) to the payload's
+        # issue/PR are combined into one comment when the changes are flushed.
+        self.merge_comments = buffered and bool(config['merge_comments'])
+        # Results of the mutations made for this payload, and the start times of the ones
+        # which may (or may not) have gone through (see `_mutate`).
+        self.mutations = {}
+        self.uncertain = {}
 
     def get_branch_head(self, owner=None, repo=None, branch='master'):
         '''Get the latest revision of the given branch in a repo.'''
@@ -32,11 +73,18 @@ class GithubAPIProvider(APIProvider):
         url = self.comments_patch_url % (self.owner, self.repo, id_)
         self._request('PATCH', url, {'body': comment})
 
+    def delete_comment(self, id_):
+        '''Delete the comment associated with an ID.'''
+
+        url = self.comments_patch_url % (self.owner, self.repo, id_)
+        self._request('DELETE', url)
+
     def set_assignees(self, assignees=[]):
         '''Set the given list of assignees to the associated issue/PR'''
 
-        url = self.assignees_url % (self.owner, self.repo, self.number)
-        self._request('POST', url, {'assignees': assignees})
+        self.buffer.add_assignees((self.owner, self.repo, self.number), assignees)
+        if not self.buffered:
+            self.flush_mutations()
 
     def get_labels(self):
         '''
@@ -56,13 +104,85 @@ class GithubAPIProvider(APIProvider):
         Clears all labels by default (i.e., empty list).
         '''
 
+        key = (self.owner, self.repo, self.number)
+        self.buffer.discard(key, labels=self.buffer.get(key).labels.keys())
         self.labels = self._handle_labels('PUT', labels=labels)
 
+    def update_labels(self, add=[], remove=[]):
+        '''
+        Add/remove labels to/from the associated issue/PR. The changes are made with the
+        add/remove endpoints when they need fewer calls than replacing all the labels.
+        '''
+
+        key = (self.owner, self.repo, self.number)
+        self.buffer.update_labels(key, add=add, remove=remove)
+        if key == self.own_issue and self.labels is not None:
+            self.labels = self.buffer.apply_labels(key, self.labels)
+        if not self.buffered:
+            self.flush_mutations()
+
+    def flush_mutations(self):
+        '''
+        Make the pending label, assignee and comment changes (a few calls per issue/PR).
+        Changes are forgotten as soon as they're made, so this can be retried if it fails.
+        '''
+
+        for key in self.buffer.pending():
+            owner, repo, number = key
+            changes = self.buffer.get(key)
+            add, remove = changes.label_changes()
+            if not use_label_endpoints(add, remove):
+                url = self.labels_url % key
+                current = map(lambda obj: obj['name'].lower(), self._request('GET', url))
+                labels = filter(lambda label: label not in remove, current)
+                labels += filter(lambda label: label not in labels, add)
+                self._request('PUT', url, labels)
+                self.buffer.discard(key, labels=add + remove)
+                add, remove = [], []
+
+            if add:
+                self._request('POST', self.labels_url % key, add)
+                self.buffer.discard(key, labels=add)
+
+            for label in remove:
+                url = self.label_url % (owner, repo, number, quote(label.encode('utf-8'), safe=''))
+                try:
+                    self._request('DELETE', url)
+                except PermanentError as err:
+                    if err.code != 404:     # the label isn't there
+                        raise
+                self.buffer.discard(key, labels=[label])
+
+            if changes.assignees:
+                url = self.assignees_url % key
+                self._request('POST', url, {'assignees': changes.assignees})
+                self.buffer.discard(key, assignees=changes.assignees)
+
+            for comments in combine_comments(changes.comments):
+                self._post_comment(COMMENT_SEPARATOR.join(comments))
+                self.buffer.discard(key, comments=comments)
+
     def post_comment(self, comment):
         '''Post a comment to the associated issue/PR.'''
 
+        key = (self.owner, self.repo, self.number)
+        if self.merge_comments and self.comment_source and key == self.own_issue:
+            priority, mergeable = self.comment_source
+            if mergeable:
+                self.buffer.add_comment(key, comment, priority)
+                return
+
+        return self._post_comment(comment)
+
+    def _post_comment(self, comment):
         url = self.comments_post_url % (self.owner, self.repo, self.number)
-        self._request('POST', url, {'body': comment})
+
+        def find_comment(since):
+            url = self.comments_since_url % (self.owner, self.repo, self.number, since)
+            matches = filter(lambda c: c['body'] == comment, self._request('GET', url))
+            return matches[-1] if matches else None
+
+        return self._mutate('POST', url, {'body': comment}, find=find_comment)
 
     def get_diff(self):
         '''Get the diff for this pull request.'''
@@ -80,27 +200,58 @@ class GithubAPIProvider(APIProvider):
         return self._request('GET', self.pull_url)
 
     def fetch_contributors(self):
-        '''Recursively traverses through the paginated data to get contributors list.'''
+        '''Get the (top) contributors of the repo.'''
 
-        contributors = []
         url = self.contributors_url % (self.owner, self.repo)
+        return map(lambda v: v['login'].lower(), self._get_all_pages(url))
 
-        while True:
-            headers, data = self._request('GET', url, headers_required=True)
-            contributors.extend(map(lambda v: v['login'].lower(), data))
+    def fetch_new_contributors(self, since):
+        '''Get the users who've made commits since the given (UTC) time.'''
 
-            match = None
-            if headers.get('Link'):
-                match = re.search(r'<(.*)>; rel="next".*<(.*)>; rel="last"', headers['Link'])
-            if not match:
-                break
+        url = self.commits_since_url % (self.owner, self.repo, since.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        # Commits from unknown emails don't have an author.
+        return [c['author']['login'].lower() for c in self._get_all_pages(url) if c.get('author')]
 
-            last_url = match.group(2)
-            if url == last_url:
-                break
-            url = match.group(1)
+    def has_contributed(self, user):
+        '''Check whether the user has authored any commit in the repo.'''
 
-        return contributors
+        url = self.user_commits_url % (self.owner, self.repo, quote(user))
+        return bool(self._request('GET', url))
+
+    def get_issue_states(self, numbers):
+        '''
+        Get the current state of the given issues/PRs in the associated repo. The states are
+        fetched with GraphQL (upto 100 issues/PRs in a query), and they're reused for the rest of
+        this payload. GraphQL queries are paced on their own rate limit (by the manager). The
+        labels of the issues/PRs with more labels than the query fetches are listed with REST.
+        '''
+
+        cached = self.issue_states.setdefault((self.owner, self.repo), {})
+        numbers = map(str, numbers)
+        missing = sorted(set(n for n in numbers if n.isdigit() and n not in cached), key=int)
+        for idx in range(0, len(missing), MAX_BATCH):
+            batch = missing[idx:idx + MAX_BATCH]
+            data = self._request('POST', self.graphql_url, {
+                'query': build_issues_query(batch),
+                'variables': {'owner': self.owner, 'repo': self.repo},
+            })
+            for error in data.get('errors') or []:
+                self.logger.debug('GraphQL error: %s', error.get('message'))
+            rate_limit = (data.get('data') or {}).get('rateLimit')
+            if rate_limit:
+                self.logger.debug('Fetched %s issues/PRs for %s points (%s remaining)',
+                                  len(batch), rate_limit['cost'], rate_limit['remaining'])
+
+            states = parse_issue_states(data)
+            for number in batch:
+                cached[number] = states.get(number)
+                # Issues/PRs with lots of labels have all of them fetched separately.
+                if cached[number] is not None and cached[number]['labels'] is None:
+                    url = (self.labels_url + '?per_page=100') % (self.owner, self.repo, number)
+                    cached[number]['labels'] = map(lambda obj: obj['name'].lower(),
+                                                   self._get_all_pages(url))
+
+        return dict((n, cached[n]) for n in numbers if cached.get(n) is not None)
 
     def close_issue(self):
         '''Close the issue/PR associated with this payload.'''
@@ -112,16 +263,85 @@ class GithubAPIProvider(APIProvider):
     def create_issue(self, title, body, labels=[], assignees=[]):
         '''Create an issue with the given title, body, labels and assignees.'''
 
-        url = self.base_url + '/issues'
-        return self._request('POST', url, {
+        url = (self.base_url + '/issues') % (self.owner, self.repo)
+
+        def find_issue(since):
+            url = self.issues_since_url % (self.owner, self.repo, since)
+            matches = filter(lambda i: (i['title'], i['body']) == (title, body),
+                             self._request('GET', url))
+            return matches[-1] if matches else None
+
+        return self._mutate('POST', url, {
             "title": title,
             "assignees": assignees,
             "labels": labels,
             "body": body
-        })
+        }, find=find_issue)
 
     # Private methods
 
+    def _request(self, method, url, data=None, auth=True, headers_required=False):
+        '''Make an API request, and get the response data (along with its headers, if required).'''
+
+        resp = self._json_request(method, url, data=data, auth=auth)
+        return (resp.headers, resp.data) if headers_required else resp.data
+
+    def _get_all_pages(self, url):
+        '''
+        Get the items from all the pages of a paginated resource. Once we know the last page
+        (from the `Link` header of the first page), the rest of the pages are fetched in parallel.
+        Otherwise, we follow the `next` links.
+        '''
+
+        headers, items = self._request('GET', url, headers_required=True)
+        items = list(items)
+        links = parse_links(headers.get('Link') or '')
+        next_page, last_page = page_number(links.get('next')), page_number(links.get('last'))
+        if next_page is not None and last_page is not None:
+            urls = [PAGE_PATTERN.sub(r'\g<1>%s' % page, links['next'])
+                    for page in range(next_page, last_page + 1)]
+            calls = [lambda url=url: self._request('GET', url) for url in urls]
+            for page in self.run_parallel(*calls):
+                items.extend(page)
+            return items
+
+        while links.get('next'):
+            headers, data = self._request('GET', links['next'], headers_required=True)
+            items.extend(data)
+            links = parse_links(headers.get('Link') or '')
+        return items
+
+    def _mutate(self, method, url, data, find):
+        '''
+        Make a request which shouldn't be repeated (like posting a comment), even if the handler
+        is retried. Mutations which have gone through are remembered (for this payload), and
+        they're not made again. If the request failed in a way that it may have gone through
+        (say, a 502 from Github), then `find` is called with the time of the first attempt
+        to look for the created object before trying again.
+        '''
+
+        key = (method, url, json.dumps(data, sort_keys=True))
+        if key in self.mutations:
+            self.logger.debug('Skipping %s %s (already done for this payload)', method, url)
+            return self.mutations[key]
+
+        if key in self.uncertain:
+            found = find(self.uncertain[key])
+            if found is not None:
+                self.logger.info('%s %s had gone through, not making it again', method, url)
+                self.mutations[key] = found
+                return found
+
+        since = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        try:
+            result = self._request(method, url, data)
+        except TransientError:
+            self.uncertain.setdefault(key, since)
+            raise
+
+        self.mutations[key] = result
+        return result
+
     def _handle_labels(self, method, labels=None):
         url = self.labels_url % (self.owner, self.repo, self.number)
         data = self._request(method=method, url=url, data=labels)
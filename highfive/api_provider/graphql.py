@@ -0,0 +1,75 @@
+GRAPHQL_URL = 'https://api.github.com/graphql'
+# Maximum number of issues/PRs fetched in a single query
+MAX_BATCH = 100
+
+# The connections are kept small, because the cost of a query (in points) depends on the number
+# of nodes it could return.
+ISSUE_FIELDS = '''
+    number
+    state
+    updatedAt
+    labels(first: 30) { nodes { name } pageInfo { hasNextPage } }
+    assignees(first: 10) { nodes { login } }
+    comments(last: 1) { nodes { createdAt } }
+'''
+
+ISSUES_QUERY = '''
+query($owner: String!, $repo: String!) {
+  rateLimit { cost remaining }
+  repository(owner: $owner, name: $repo) {
+%s
+  }
+}
+
+fragment issue on Issue {%s}
+
+fragment pull on PullRequest {%s    headRefOid
+}
+'''
+
+ISSUE_SELECTION = '    i%s: issueOrPullRequest(number: %s) { ...issue ...pull }'
+
+
+def build_issues_query(numbers):
+    '''Build the query for the state of the given issues/PRs (in a repo).'''
+
+    selections = '\n'.join(ISSUE_SELECTION % (number, number) for number in numbers)
+    return ISSUES_QUERY % (selections, ISSUE_FIELDS, ISSUE_FIELDS)
+
+
+def parse_issue_state(node):
+    '''
+    Convert an issue/PR from the query's result into the state we hand out to the handlers.
+    Names are lowercased, and the PRs' `state` can also be 'merged'. The `labels` are `None` if
+    the issue/PR has more labels than the query fetches.
+    '''
+
+    comments = node['comments']['nodes']
+    labels = map(lambda label: label['name'].lower(), node['labels']['nodes'])
+    if node['labels'].get('pageInfo', {}).get('hasNextPage'):
+        labels = None
+    return {
+        'number': str(node['number']),
+        'is_pull': 'headRefOid' in node,
+        'state': node['state'].lower(),
+        'updated_at': node['updatedAt'],
+        'labels': labels,
+        'assignees': map(lambda user: user['login'].lower(), node['assignees']['nodes']),
+        'last_comment_at': comments[-1]['createdAt'] if comments else None,
+        'head_sha': node.get('headRefOid'),
+    }
+
+
+def parse_issue_states(data):
+    '''
+    Get the states of the issues/PRs in a query's result (as a dict of numbers to their states).
+    Issues/PRs which couldn't be fetched (say, they don't exist) are left out.
+    '''
+
+    repository = (data.get('data') or {}).get('repository') or {}
+    states = {}
+    for node in repository.itervalues():
+        if node is not None:
+            state = parse_issue_state(node)
+            states[state['number']] = state
+    return states
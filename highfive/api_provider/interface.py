@@ -1,16 +1,38 @@
 from ..runner.config import get_logger
 from ..runner.request import request_with_requests
+from ..runner.retry import PermanentError
 
-from datetime import datetime
-from dateutil.parser import parse as datetime_parse
+from contributors import CONTRIBUTORS
+from threading import Lock, Thread
 
+import hashlib
 import random
+import sys
 
 DEFAULTS = ['pull_url', 'is_open', 'is_pull', 'creator', 'last_updated', 'number', 'diff',
             'sender', 'owner', 'repo', 'current_label', 'assignee', 'comment']
 LIST_DEFAULTS = ['labels']
-CONTRIBUTORS_STORE_KEY = '__contributors__'
-CONTRIBUTORS_UPDATE_INTERVAL_HOURS = 1
+# Prefix for the store keys of the per-issue/PR index of the comments we've posted.
+COMMENTS_STORE_KEY = '__comments__'
+# Maximum number of threads making the calls in `run_parallel` (including the caller's)
+PARALLEL_CALLS = 4
+
+
+def iter_lines(text):
+    '''Iterate over the lines in some (possibly huge) text, without making a copy of all lines.'''
+
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end < 0:
+            end = len(text)
+        yield text[start:end].rstrip('\r')
+        start = end + 1
+
+
+def format_warning(comment):
+    return ':warning: **Warning!** :warning:\n\n%s' % comment
+
 
 class APIProvider(object):
     '''
@@ -24,6 +46,9 @@ class APIProvider(object):
     '''
 
     imgur_post_url = 'https://api.imgur.com/3/image'
+    # Contributors of the repos (overridden only in the test suite)
+    contributor_registry = CONTRIBUTORS
+    max_parallel = PARALLEL_CALLS
 
     def __init__(self, config, payload, store=None):
         self.name = config.name
@@ -31,6 +56,14 @@ class APIProvider(object):
         self.payload = payload
         self.logger = get_logger(__name__)
         self.store = store
+        # Timers of the installation (set by the manager)
+        self.timers = None
+        # (priority, whether the comments can be merged) of the handler being run (if any)
+        self.comment_source = None
+        # Random choices are seeded again for every handler run (see `seed_choices`), so that
+        # a retried handler words its comments the same way (and they aren't posted again).
+        self.choice_seed = random.random()
+        self.chooser = random.Random(self.choice_seed)
 
         for attr in DEFAULTS:
             setattr(self, attr, None)
@@ -95,7 +128,7 @@ class APIProvider(object):
     def get_page_content(self, url):
         '''Get the contents from a given URL.'''
 
-        resp = request_with_requests('GET', url)
+        resp = request_with_requests('GET', url, parse_json=False)
         return resp.data
 
     def get_screenshots_for_build(self, build_url):
@@ -146,7 +179,12 @@ class APIProvider(object):
         so that we can override it during testing.
         '''
 
-        return random.choice(values)
+        return self.chooser.choice(values)
+
+    def seed_choices(self, name):
+        '''Seed the random choices for a run of the given handler (all its runs get the same).'''
+
+        self.chooser.seed('%s %s' % (self.choice_seed, name))
 
     def get_branch_head(self, branch):
         raise NotImplementedError
@@ -154,6 +192,9 @@ class APIProvider(object):
     def edit_comment(self, _id, comment):
         raise NotImplementedError
 
+    def delete_comment(self, _id):
+        raise NotImplementedError
+
     def set_assignees(self, assignees):
         raise NotImplementedError
 
@@ -172,45 +213,93 @@ class APIProvider(object):
     def fetch_contributors(self):
         raise NotImplementedError
 
+    def fetch_new_contributors(self, since):
+        '''Get the users who've made commits since the given (UTC) time.'''
+
+        return self.fetch_contributors()
+
+    def has_contributed(self, user):
+        return False
+
     def get_pull(self):
         raise NotImplementedError
 
     def close_issue(self):
         raise NotImplementedError
 
+    def get_issue_states(self, numbers):
+        '''
+        Get the current state of the given issues/PRs in the associated repo, as a dict of their
+        numbers to their states (see `graphql.parse_issue_state`). Issues/PRs whose state couldn't
+        be fetched are left out.
+        '''
+
+        raise NotImplementedError
+
     # Default methods depending on the overriddable methods.
 
-    def get_contributors(self, fetch=False):
+    def run_parallel(self, *calls):
         '''
-        If `fetch` is disabled and if store exists, then this gets the contributors list from the
-        store. Otherwise, this calls the overriddable method, gets the list, writes to the store
-        (if it exists) and returns the list.
+        Make independent calls (functions taking no arguments) concurrently, and get their
+        results (in order). If some of them fail, then the first error is raised once all of
+        them are done. The calls are shared by at most `max_parallel` threads (the current
+        thread being one of them). Note that the installation manager still caps the number
+        of requests in flight.
         '''
 
-        now = datetime.now()
+        results, errors = [None] * len(calls), []
+        pending, lock = iter(enumerate(calls)), Lock()
+
+        def run():
+            while True:
+                with lock:
+                    idx, call = next(pending, (None, None))
+                if call is None:
+                    return
+                try:
+                    results[idx] = call()
+                except Exception:
+                    errors.append((idx, sys.exc_info()))
+
+        count = min(self.max_parallel, len(calls)) - 1
+        threads = [Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        run()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            _idx, (exc_type, exc_value, traceback) = min(errors)
+            raise exc_type, exc_value, traceback
+        return results
 
-        if self.store:
-            contributors = self.store.get_object(CONTRIBUTORS_STORE_KEY)
-            if contributors:
-                # Force fetch if last updated time is long back.
-                timestamp = contributors.get('last_update_time', str(now))
-                last_update = datetime_parse(timestamp)
-                if (now - last_update).seconds >= CONTRIBUTORS_UPDATE_INTERVAL_HOURS * 3600:
-                    fetch = True
+    def get_contributors(self, fetch=False):
+        '''
+        Get the contributors of the associated repo (as a set of lowercased logins). These are
+        shared by all the installations (in this process), and they're refreshed with the recent
+        commits once they're outdated (or right away, if `fetch` is enabled).
+        '''
 
-            if contributors.get('list') and not fetch:
-                return contributors['list']
+        return self.contributor_registry.refresh('%s/%s' % (self.owner, self.repo),
+                                                 self.fetch_contributors,
+                                                 self.fetch_new_contributors, force=fetch)
 
-        self.logger.info('Updating contributors list...')
-        contributors = {
-            'last_update_time': str(now),
-            'list': self.fetch_contributors()
-        }
+    def is_contributor(self, user):
+        '''
+        Check whether a user has contributed to the associated repo. The contributors list we get
+        from Github has only the top contributors, so if the user isn't there, then we look for
+        their commits (and remember them if we find any).
+        '''
 
-        if self.store:
-            self.store.write_object(CONTRIBUTORS_STORE_KEY, data=contributors)
+        user = user.lower()
+        if user in self.get_contributors():
+            return True
 
-        return contributors['list']
+        if self.has_contributed(user):
+            self.contributor_registry.add('%s/%s' % (self.owner, self.repo), user)
+            return True
+        return False
 
     def update_labels(self, add=[], remove=[]):
         '''
@@ -230,7 +319,7 @@ class APIProvider(object):
         '''Generator over the added lines in the commit diff.'''
 
         diff = self.get_diff()
-        for line in diff.splitlines():
+        for line in iter_lines(diff):
             if line.startswith('+') and not line.startswith('+++'):
                 yield line
 
@@ -238,7 +327,7 @@ class APIProvider(object):
         '''Generator over the changed files in commit diff.'''
 
         diff = self.get_diff()
-        for line in diff.splitlines():
+        for line in iter_lines(diff):
             # Get paths from a line like 'diff --git a/path/to/file b/path/to/file'
             if line.startswith('diff --git '):
                 file_paths = filter(lambda p: p.startswith('a/') or p.startswith('b/'),
@@ -250,5 +339,65 @@ class APIProvider(object):
     def post_warning(self, comment):
         '''Post a warning comment.'''
 
-        comment = ':warning: **Warning!** :warning:\n\n%s' % comment
-        self.post_comment(comment)
+        self.post_comment(format_warning(comment))
+
+    def sync_comment(self, name, comment):
+        '''
+        Post a comment (identified by `name`) to the associated issue/PR, or update the one we've
+        posted earlier (only if its content has changed). The IDs of the comments we've posted
+        are kept in the store, so that re-runs don't post the same comment again. If `comment`
+        is None, then the comment we've posted earlier (if any) is deleted.
+        '''
+
+        key = '%s_%s_%s_%s' % (COMMENTS_STORE_KEY, self.owner, self.repo, self.number)
+        index = self.store.get_object(key) if self.store else {}
+        if comment is None:
+            entry = index.pop(name, None)
+            if entry is None:
+                return
+            try:
+                self.delete_comment(entry['id'])
+            except PermanentError as err:
+                if err.code != 404:
+                    raise
+            if index:
+                self.store.write_object(key, index)
+            else:
+                self.store.remove_object(key)
+            return
+
+        encoded = comment.encode('utf-8') if isinstance(comment, unicode) else comment
+        digest = hashlib.sha1(encoded).hexdigest()
+
+        entry = index.get(name)
+        if entry is not None:
+            if entry['digest'] == digest:
+                self.logger.debug('Comment %r in #%s is up to date', name, self.number)
+                return
+            try:
+                self.edit_comment(entry['id'], comment)
+                entry['digest'] = digest
+                self.store.write_object(key, index)
+                return
+            except PermanentError as err:
+                if err.code != 404:
+                    raise
+                self.logger.info('Comment %r in #%s is gone, posting it again', name, self.number)
+
+        # Indexed comments can't be merged with the others (we need their IDs).
+        source, self.comment_source = self.comment_source, None
+        try:
+            posted = self.post_comment(comment)
+        finally:
+            self.comment_source = source
+
+        if self.store and isinstance(posted, dict) and posted.get('id') is not None:
+            index[name] = {'id': posted['id'], 'digest': digest}
+            self.store.write_object(key, index)
+
+    def forget_comments(self):
+        '''Drop the index of the comments we've posted to the associated issue/PR (if any).'''
+
+        key = '%s_%s_%s_%s' % (COMMENTS_STORE_KEY, self.owner, self.repo, self.number)
+        if self.store and self.store.get_object(key):
+            self.store.remove_object(key)
@@ -0,0 +1,132 @@
+from threading import Lock
+
+# Number of calls for replacing all the labels of an issue (we need the current labels first).
+REPLACE_CALLS = 2
+# Github doesn't allow comments longer than this (in characters).
+MAX_COMMENT_CHARS = 65536
+# Separator between the comments (of different handlers) in a combined comment.
+COMMENT_SEPARATOR = '\n\n---\n\n'
+
+
+class PendingChanges(object):
+    '''Label, assignee and comment changes waiting to be made on an issue/PR.'''
+
+    __slots__ = ['labels', 'assignees', 'comments']
+
+    def __init__(self):
+        # label -> whether it should be added (True) or removed (False)
+        self.labels = {}
+        self.assignees = []
+        # (priority, order, comment) tuples
+        self.comments = []
+
+    def is_empty(self):
+        return not (self.labels or self.assignees or self.comments)
+
+    def label_changes(self):
+        '''Get the labels to be added and removed (sorted, for predictable requests).'''
+
+        add = sorted(label for label, added in self.labels.iteritems() if added)
+        remove = sorted(label for label, added in self.labels.iteritems() if not added)
+        return add, remove
+
+
+class MutationBuffer(object):
+    '''
+    Collects the label, assignee and comment changes made by the handlers of a payload, so that
+    they can be made with a few calls per issue/PR (once the handlers are done) instead of a
+    round-trip for every change. Issues/PRs are identified by `(owner, repo, number)` tuples.
+
+    Changes made later override the earlier ones (adding a label which an earlier handler has
+    removed cancels the removal), and assignees are accumulated (since Github's endpoint only
+    adds them). Comments are combined (in the order of their priority) into as few comments as
+    possible.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.issues = {}
+
+    def update_labels(self, key, add=[], remove=[]):
+        to_lower = lambda label: label.lower()      # str.lower doesn't work for unicode
+        with self.lock:
+            changes = self.issues.setdefault(key, PendingChanges())
+            for label in map(to_lower, add):
+                changes.labels[label] = True
+            for label in map(to_lower, remove):
+                changes.labels[label] = False
+
+    def add_assignees(self, key, assignees):
+        with self.lock:
+            changes = self.issues.setdefault(key, PendingChanges())
+            for assignee in assignees:
+                if assignee not in changes.assignees:
+                    changes.assignees.append(assignee)
+
+    def add_comment(self, key, comment, priority):
+        with self.lock:
+            changes = self.issues.setdefault(key, PendingChanges())
+            changes.comments.append((priority, len(changes.comments), comment))
+
+    def apply_labels(self, key, labels):
+        '''Get the given labels of an issue/PR, with the pending changes applied.'''
+
+        with self.lock:
+            changes = self.issues.get(key)
+            if changes is None:
+                return list(labels)
+            add, remove = changes.label_changes()
+        labels = filter(lambda label: label not in remove, labels)
+        return labels + filter(lambda label: label not in labels, add)
+
+    def pending(self):
+        '''Get the issues/PRs which have changes waiting to be made.'''
+
+        with self.lock:
+            return sorted(key for key, changes in self.issues.iteritems()
+                          if not changes.is_empty())
+
+    def get(self, key):
+        with self.lock:
+            return self.issues.get(key, PendingChanges())
+
+    def discard(self, key, labels=[], assignees=[], comments=[]):
+        '''Forget the changes which have been made (so that they're not made again on retries).'''
+
+        with self.lock:
+            changes = self.issues.get(key)
+            if changes is None:
+                return
+            for label in labels:
+                changes.labels.pop(label, None)
+            changes.assignees = filter(lambda a: a not in assignees, changes.assignees)
+            changes.comments = filter(lambda c: c[2] not in comments, changes.comments)
+            if changes.is_empty():
+                self.issues.pop(key)
+
+
+def use_label_endpoints(add, remove):
+    '''
+    Whether the add/remove endpoints are cheaper than replacing the labels. Adding is a single
+    call for any number of labels, but each label has to be removed separately.
+    '''
+
+    return (1 if add else 0) + len(remove) <= REPLACE_CALLS
+
+
+def combine_comments(comments, limit=MAX_COMMENT_CHARS):
+    '''
+    Combine the `(priority, order, comment)` tuples into as few comments as possible (in that
+    order), without going over Github's limit. Returns lists of the comments to be combined.
+    '''
+
+    groups, size = [], 0
+    for _priority, _order, comment in sorted(comments):
+        extra = len(COMMENT_SEPARATOR) + len(comment)
+        if groups and size + extra <= limit:
+            groups[-1].append(comment)
+            size += extra
+        else:
+            groups.append([comment])
+            size = len(comment)
+    return groups
@@ -1,3 +1,4 @@
+from ..runner.routing import get_router
 from event_handler import EventHandler
 from modifier import Modifier
 
@@ -7,8 +8,78 @@ import os
 import os.path as path
 
 __HANDLERS = {}
+__ROUTES = {}
+__COALESCING = {}
 
-def get_handlers_for(event, cached=False, wrap_config=True):
+def _is_active_for(handler_config, repo):
+    '''Check whether a handler (with the given config) will handle payloads from this repo.'''
+
+    if not handler_config.get('active'):
+        return False
+
+    allowed_repos = handler_config.get('allowed_repos', [])
+    return not allowed_repos or get_router(allowed_repos).matches(repo)
+
+
+def _get_route(event, repo):
+    '''Get the (cached) list of loaded handlers for an event, which are active for a repo.'''
+
+    global __HANDLERS, __ROUTES
+    route = __ROUTES.get((event, repo))
+    if route is None:
+        route = filter(lambda c: len(c) != 3 or _is_active_for(c[1], repo),
+                       __HANDLERS.get(event, []))
+        __ROUTES[(event, repo)] = route
+    return route
+
+
+def _reacts_to(handler, action):
+    '''Check whether a handler class overrides the method for an action.'''
+
+    if handler.handle_payload.im_func is not EventHandler.handle_payload.im_func:
+        return True
+
+    method = handler.actions.get(action)
+    return (method is not None and
+            getattr(handler, method).im_func is not getattr(EventHandler, method).im_func)
+
+
+def get_timed_handlers(event):
+    '''Get the names of the (loaded) handlers for an event, which react to ticks.'''
+
+    global __HANDLERS
+    return [components[2].__name__ for components in __HANDLERS.get(event, [])
+            if len(components) == 3 and _reacts_to(components[2], '__tick')]
+
+
+def get_coalescing(event, repo, earlier_action, later_action):
+    '''
+    Get how a payload for an issue/PR should be coalesced with a later payload for the same
+    issue/PR - 'supersede' (drop the earlier one), 'cancel' (drop both), or `None` (handle both).
+    All the active handlers which react to either of the actions should agree on it.
+    '''
+
+    global __COALESCING
+    key = (event, repo, earlier_action, later_action)
+    if key in __COALESCING:
+        return __COALESCING[key]
+
+    rules = set()
+    for components in _get_route(event, repo):
+        if len(components) != 3:        # can't tell what a wrapped handler does
+            rules.add(None)
+            break
+
+        handler = components[2]
+        if _reacts_to(handler, earlier_action) or _reacts_to(handler, later_action):
+            rules.add(handler.coalesce.get((earlier_action, later_action)))
+
+    rule = rules.pop() if len(rules) == 1 else None
+    __COALESCING[key] = rule
+    return rule
+
+
+def get_handlers_for(event, cached=False, wrap_config=True, repo=None):
     '''
     Get the handlers corresponding to an event.
 
@@ -21,11 +92,15 @@ def get_handlers_for(event, cached=False, wrap_config=True):
 
     If `wrap_config` is enabled, then the loader returns the handler wrapped in a lambda,
     so that the caller doesn't have to worry about the handler config by themselves.
+
+    If `repo` ("owner/repo") is specified along with `cached`, then the inactive handlers and the
+    handlers which don't allow that repo are skipped (so that they're not even initialized).
     '''
 
     if cached:
         global __HANDLERS
-        for components in __HANDLERS.get(event, []):
+        handlers = __HANDLERS.get(event, []) if repo is None else _get_route(event, repo)
+        for components in handlers:
             if wrap_config and len(components) == 3:
                 handler_dir, handler_config, handler = components
                 yield (handler_dir, lambda api: handler(api, handler_config))
@@ -70,7 +145,9 @@ def load_handlers_using(config):
     '''
 
     count = 0
-    global __HANDLERS
+    global __HANDLERS, __ROUTES, __COALESCING
+    __ROUTES.clear()
+    __COALESCING.clear()
 
     for event in config.enabled_events:
         __HANDLERS[event] = []
@@ -1,9 +1,13 @@
+from ..api_provider.interface import format_warning
 from ..runner.config import get_logger
+from ..runner.routing import get_config_router, get_router
+from ..runner.timers import SCAN_KEY
 
-from copy import deepcopy
-
-import random
 import re
+import time
+
+# Seconds after which the due timers of a failed tick are fired again
+TICK_RETRY_SECS = 300
 
 class EventHandler(object):
     '''
@@ -34,6 +38,32 @@ class EventHandler(object):
         '__tick'      : 'on_next_tick',
     }
 
+    # Handlers run concurrently for different issues/PRs. Handlers which maintain installation-wide
+    # state (i.e., state that's not specific to an issue/PR) should set this, so that they hold the
+    # installation's lock while they're run (and so, they're run one payload at a time).
+    serial = False
+
+    # When a payload for an issue/PR is followed by another payload (of the same event) for that
+    # issue/PR, the earlier one can be coalesced with the later one before it's dispatched. This maps
+    # the pairs of actions `(earlier, later)` to either 'supersede' (the earlier payload is dropped)
+    # or 'cancel' (both are dropped), if that's okay with the handler. Label actions are paired
+    # only for the same label. Payloads are coalesced only if all the handlers reacting to either
+    # action agree.
+    coalesce = {}
+
+    # If `merge_comments` is enabled in the global config, then the comments posted by the handlers
+    # (for an issue/PR) while handling a payload are combined into one comment. Handlers whose
+    # comments should be posted on their own can unset `mergeable_comments`. Comments are ordered by
+    # `comment_priority` (lower comes first) in the combined comment. Comments posted with
+    # `sync_comment` are never merged (they're edited in place later, so they need their own IDs).
+    mergeable_comments = True
+    comment_priority = 100
+
+    # Keys of the timers which are due (for ticks). This is `None` if the handler should go through
+    # all of its data (i.e., when it hasn't registered its timers yet, or if there's no timer
+    # service at all).
+    due = None
+
     def __init__(self, api, config):
         self.name = self.__class__.__name__
         self.api = api
@@ -72,18 +102,8 @@ class EventHandler(object):
             self.logger.error("There's no owner/repo info in payload. Bleh?")
             return None
 
-        result = None
         string = '%s/%s' % (self.api.owner, self.api.repo)
-        for pattern in config:
-            if re.search(pattern.lower(), string):
-                if not result:
-                    result = deepcopy(config[pattern])
-                elif isinstance(result, list):
-                    result.extend(config[pattern])
-                elif isinstance(result, dict):
-                    result.update(config[pattern])
-
-        return result
+        return get_config_router(config).subconfig(config, string)
 
     def join_names(self, names):
         ''' Join multiple words in human-readable form'''
@@ -97,6 +117,18 @@ class EventHandler(object):
             return '%s and %s' % (', '.join(names), last)
         return ''
 
+    def sync_comment(self, comment, kind='', warning=False):
+        '''
+        Post a comment (of some kind) from this handler to the issue/PR. When the handler runs again
+        for the issue/PR, the comment is edited instead (if its content has changed), or deleted
+        (if `comment` is None). These comments are always posted on their own (even if comments
+        are being merged).
+        '''
+
+        if warning and comment is not None:
+            comment = format_warning(comment)
+        self.api.sync_comment('%s:%s' % (self.name, kind), comment)
+
     # Wrapper methods over `InstallationStore` methods. This way, the handlers don't have to worry
     # about keys for their data.
 
@@ -127,6 +159,33 @@ class EventHandler(object):
         key = self.name if key is None else '%s_%s' % (self.name, key)
         self.api.store.write_object(key, data)
 
+    def wake_at(self, deadline, key=''):
+        '''
+        Ask for a tick (for the given key) at the given deadline (datetime or UNIX timestamp).
+        Scheduling a key again replaces its previous deadline. Once it's due, the key will be in
+        `self.due` during the tick.
+        '''
+
+        if self.api.timers is not None:
+            self.api.timers.schedule(self.name, key, deadline)
+
+    def _rearm_due(self):
+        '''
+        Arm the due timers again (after a while), because they've already been removed from the
+        timer service by the time the tick runs. Otherwise, a failed tick would leave the handler
+        waiting for an unrelated payload.
+        '''
+
+        deadline = time.time() + TICK_RETRY_SECS
+        for key in [SCAN_KEY] if self.due is None else self.due:
+            self.wake_at(deadline, key=key)
+
+    def cancel_wake(self, key=''):
+        '''Cancel the timer for the given key (if any).'''
+
+        if self.api.timers is not None:
+            self.api.timers.cancel(self.name, key)
+
     # Methods corresponding to the actions
 
     def on_issue_assign(self):
@@ -159,7 +218,8 @@ class EventHandler(object):
     def on_next_tick(self):
         '''
         Since the handlers aren't aware of date/time, this event is for those handlers that depend
-        on "time" - it's externally called by the daemon thread every now and then in a loop.
+        on "time" - it's called by the daemon thread whenever the timers registered by the handler
+        (using `wake_at`) are due. `self.due` has the keys of the due timers.
         '''
         pass
 
@@ -177,14 +237,37 @@ class EventHandler(object):
         if not self.config.get('active'):       # pre-check whether the handler is active
             return
 
+        # Ticks from the timer service are meant only for the handlers with due timers.
+        is_tick = self.api.payload.get('action') == '__tick'
+        if is_tick and 'timers' in self.api.payload:
+            if self.name not in self.api.payload['timers']:
+                return
+            self.due = self.api.payload['timers'][self.name]
+
+        try:
+            self._handle_action()
+        except Exception:
+            if is_tick:
+                self._rearm_due()
+            raise
+
+    def _handle_action(self):
+        '''Run the method for the action (if the handler's meant for this repo), and clean up.'''
+
         # Check if the handler can only be used in specific patterns of repos.
         allowed_repos = self.config.get('allowed_repos', [])
         this_repo = '%s/%s' % (self.api.owner, self.api.repo)
-        if allowed_repos and not any(re.search(pat, this_repo) for pat in allowed_repos):
+        if allowed_repos and not get_router(allowed_repos).matches(this_repo):
             return
 
-        method = self.actions.get(self.api.payload['action'])
+        action = self.api.payload['action']
+        method = self.actions.get(action)
         if method is not None:
             self.reset()
-            getattr(self, method)()
+            self.api.seed_choices(self.name)
+            self.api.comment_source = (self.comment_priority, self.mergeable_comments)
+            try:
+                getattr(self, method)()
+            finally:
+                self.api.comment_source = None
             self.cleanup()
@@ -16,6 +16,9 @@ class ServoLogChecker(EventHandler):
     the comment.
     '''
 
+    # Log excerpts (and screenshots) are big enough to be posted on their own.
+    mergeable_comments = False
+
     def _check_css_failures(self, build_url):
         data = self.api.get_screenshots_for_build(build_url)
         # Image data is the key because, there could be
@@ -1,6 +1,6 @@
 from ... import EventHandler, Modifier
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.parser import parse as datetime_parse
 
 import json, os, re
@@ -22,6 +22,8 @@ class EasyIssueAssigner(EventHandler):
     (if required) and unassigns them from the issue.
     '''
 
+    serial = True
+
     def __init__(self, api, config):
         super(EasyIssueAssigner, self).__init__(api, config)
         self.__init_store_data()
@@ -169,45 +171,106 @@ class EasyIssueAssigner(EventHandler):
         if not config:
             return
 
-        for number, issue in self.data['issues'].iteritems():
-            status = issue['status']
-            last_active = issue['last_active']
-            if not last_active:
-                continue
+        numbers = self.data['issues'].keys() if self.due is None else \
+                  filter(lambda number: number in self.data['issues'], self.due)
+        # The current state of all the issues is fetched in one go (we may have missed some events).
+        states = self.api.get_issue_states(numbers)
+        for number in numbers:
+            if self._sync_issue(number, states.get(number), config):
+                self._check_issue(number, config)
+            self._schedule(number, config)
 
-            last_active = datetime_parse(last_active)
-            now = datetime.now(last_active.tzinfo)
-            if (now - last_active).days <= config['grace_period_days']:
-                self.logger.debug('Issue #%s is stil in grace period', number)
-                continue
-            elif status == 'pull':      # PR handler will take care of this
-                continue
 
-            self.logger.info("Issue #%s has had its time. Something's gonna happen.", number)
-            assignee = issue['assignee']
-            self.data['issues'][number]['last_active'] = str(now)
+    def _sync_issue(self, number, state, config):
+        '''
+        Update the stored data of an issue with its current state (if we have it). Returns whether
+        we're still tracking the issue.
+        '''
 
-            with Modifier(self.api, number=number):
-                if status == 'assigned':
-                    self.logger.info('Pinging %r in issue #%s', assignee, number)
-                    if assignee == self.anonymous_name:
-                        comment = self.api.rand_choice(config['unknown_ping'])
-                        self.api.post_comment(comment)
-                    else:
-                        comment = self.api.rand_choice(config['known_ping']).format(assignee=assignee)
-                        self.api.post_comment(comment)
-                    self.data['issues'][number]['status'] = 'commented'
-
-                elif status == 'commented':
-                    self.logger.info('Unassigning issue #%s after grace period', number)
-                    self.api.update_labels(remove=[config['assign_label']])
-                    self.api.post_comment(self.api.rand_choice(config['issue_unassign']))
-                    self.data['issues'][number] = default()
+        if state is None:
+            return True
+
+        if state['state'] != 'open':
+            self.logger.info('Issue #%s has been closed. Removing related data...', number)
+            self.data['issues'].pop(number)
+            return False
+
+        issue = self.data['issues'][number]
+        if issue['status'] is not None and config['assign_label'] not in state['labels']:
+            self.logger.debug('Issue #%s has been unassigned. Setting issue to default data...',
+                              number)
+            self.data['issues'][number] = default()
+            return True
+
+        last_comment = state['last_comment_at']
+        if last_comment and issue['last_active'] and \
+           datetime_parse(last_comment) > datetime_parse(issue['last_active']):
+            issue['last_active'] = last_comment
+        return True
+
+
+    def _check_issue(self, number, config):
+        issue = self.data['issues'][number]
+        status = issue['status']
+        last_active = issue['last_active']
+        if not last_active:
+            return
+
+        last_active = datetime_parse(last_active)
+        now = datetime.now(last_active.tzinfo)
+        if (now - last_active).days <= config['grace_period_days']:
+            self.logger.debug('Issue #%s is stil in grace period', number)
+            return
+        elif status == 'pull':      # PR handler will take care of this
+            return
+
+        self.logger.info("Issue #%s has had its time. Something's gonna happen.", number)
+        assignee = issue['assignee']
+        self.data['issues'][number]['last_active'] = str(now)
+
+        with Modifier(self.api, number=number):
+            if status == 'assigned':
+                self.logger.info('Pinging %r in issue #%s', assignee, number)
+                if assignee == self.anonymous_name:
+                    comment = self.api.rand_choice(config['unknown_ping'])
+                    self.api.post_comment(comment)
+                else:
+                    comment = self.api.rand_choice(config['known_ping']).format(assignee=assignee)
+                    self.api.post_comment(comment)
+                self.data['issues'][number]['status'] = 'commented'
+
+            elif status == 'commented':
+                self.logger.info('Unassigning issue #%s after grace period', number)
+                self.api.update_labels(remove=[config['assign_label']])
+                self.api.post_comment(self.api.rand_choice(config['issue_unassign']))
+                self.data['issues'][number] = default()
+
+
+    def _schedule(self, number, config):
+        '''Wake up once the issue's grace period is over (if there's something to do by then).'''
+
+        if self.api.timers is None:     # no timer service (ticks go through everything)
+            return
+
+        issue = self.data['issues'].get(number)
+        if not (config and issue and issue['last_active'] and issue['status'] != 'pull'):
+            self.cancel_wake(key=number)
+            return
+
+        grace_period = timedelta(days=config['grace_period_days'] + 1)
+        self.wake_at(datetime_parse(str(issue['last_active'])) + grace_period, key=number)
 
 
     def cleanup(self):
         if self.data != self.old_data:
             self.write_object(self.data)
+            # Reschedule the issues which have changed (ticks take care of their own issues).
+            if self.api.payload['action'] != '__tick':
+                config = self.get_matched_subconfig()
+                old_issues, issues = self.old_data['issues'], self.data['issues']
+                for number in set(old_issues).union(issues):
+                    if old_issues.get(number) != issues.get(number):
+                        self._schedule(number, config)
 
     # Private methods
 
@@ -3,6 +3,8 @@ from ... import EventHandler
 class LabelNotifier(EventHandler):
     '''Notifies label watchers whenever their labels are added to an issue.'''
 
+    coalesce = {('labeled', 'unlabeled'): 'cancel'}
+
     def on_issue_label_add(self):
         config = self.get_matched_subconfig()
         if not config or self.api.is_pull:      # Ignore if it's a PR.
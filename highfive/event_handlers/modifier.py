@@ -23,11 +23,11 @@ class Modifier(object):
         self.old_attrs = {}
         self.new_attrs = kwargs
 
-        # Store the old values of new attribute keys
+        # Store the old values of new attribute keys (including the `None` values, since an
+        # object shared by others should have all of its attributes when we're done).
         for key in self.new_attrs.iterkeys():
-            old_value = getattr(self.object_, key, None)
-            if old_value is not None:
-                self.old_attrs[key] = old_value
+            if hasattr(self.object_, key):
+                self.old_attrs[key] = getattr(self.object_, key)
 
     def __enter__(self):
         for key, val in self.new_attrs.iteritems():
@@ -37,8 +37,7 @@ class Modifier(object):
     def __exit__(self, type, value, traceback):
         # Restore the old values
         for key in self.new_attrs.iterkeys():
-            old_value = self.old_attrs.get(key)
-            if old_value is not None:
-                setattr(self.object_, key, old_value)
+            if key in self.old_attrs:
+                setattr(self.object_, key, self.old_attrs[key])
             else:
                 delattr(self.object_, key)
@@ -7,9 +7,12 @@ class CommitDiffChecker(EventHandler):
     This checks the PR diff for content and file patterns and posts "warning" comments correspondingly.
     An useful feature is that paths and test paths can be specified in the config, and if some file
     in a path is changed and the test path isn't affected, then this handler adds a warning.
+    The checks are run again when the PR is updated, and the warning is edited (or removed)
+    accordingly.
     '''
 
     messages = set()    # so that we filter duplicates
+    coalesce = {('synchronize', 'synchronize'): 'supersede'}
 
     def _get_messages(self, lines, matches):
         for line in lines:
@@ -49,9 +52,14 @@ class CommitDiffChecker(EventHandler):
 
         self._check_tests(config, paths)
 
+        # If an earlier warning has been fixed by a later push, then it's removed.
+        lines = None
         if self.messages:
             lines = '\n'.join(map(lambda line: ' * %s' % line, self.messages))
-            self.api.post_warning(lines)
+        self.sync_comment(lines, kind='warning', warning=True)
+
+    def on_pr_update(self):
+        self.on_issue_open()
 
     def reset(self):
         self.messages = set()
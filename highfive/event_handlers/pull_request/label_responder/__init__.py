@@ -5,6 +5,7 @@ from time import sleep
 class LabelResponder(EventHandler):
     '''Adds/removes labels whenever a PR is opened/updated/merged/conflicted.'''
 
+    coalesce = {('synchronize', 'synchronize'): 'supersede'}
     labels_to_add = []
     labels_to_remove = []
 
@@ -1,6 +1,6 @@
 from ... import EventHandler, Modifier
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.parser import parse as datetime_parse
 
 def default():
@@ -23,6 +23,12 @@ class OpenPullWatcher(EventHandler):
     are prone to be inactive.
     '''
 
+    serial = True
+    coalesce = {
+        ('synchronize', 'synchronize'): 'supersede',
+        ('labeled', 'unlabeled'): 'cancel',
+    }
+
     def __init__(self, api, config):
         super(OpenPullWatcher, self).__init__(api, config)
         self._load_pr_list()
@@ -146,6 +152,24 @@ class OpenPullWatcher(EventHandler):
         # Since we're identifying PR data based on key, we write only when the PR number exists.
         if self.api.number and self.old_data != self.data:
             self.write_object(self.data, key=self.api.number)
+        if self.api.number and (self.old_data != self.data or self.old_list != self.pr_list):
+            self._schedule(self.api.number)
+
+
+    def _schedule(self, number):
+        '''Wake up once the PR's grace period is over (or never, if we're not tracking it).'''
+
+        if self.api.timers is None:     # no timer service (ticks go through everything)
+            return
+
+        config = self.get_matched_subconfig()
+        last_active = self.data.get('last_active')
+        if not (config and last_active and number in self.pr_list['pulls']):
+            self.cancel_wake(key=number)
+            return
+
+        grace_period = timedelta(days=config['grace_period_days'] + 1)
+        self.wake_at(datetime_parse(str(last_active)) + grace_period, key=number)
 
 
     def _check_pulls(self):
@@ -153,27 +177,60 @@ class OpenPullWatcher(EventHandler):
         if not config:
             return
 
-        for number in self.pr_list['pulls']:
+        numbers = self.pr_list['pulls'] if self.due is None else \
+                  filter(lambda number: number in self.pr_list['pulls'], self.due)
+        numbers = list(numbers)
+        # The current state of all the PRs is fetched in one go (we may have missed some events).
+        states = self.api.get_issue_states(numbers)
+        for number in numbers:
             self.data = self.get_object(key=number)
             self.old_data = deepcopy(self.data)
-            last_active = self.data.get('last_active')
-            if not last_active:
-                continue
+            if self._sync_pull(number, states.get(number)):
+                self._check_pull(number, config)
+            if self.old_data != self.data:
+                self.write_object(self.data, key=number)
+            self._schedule(number)
 
-            last_active = datetime_parse(last_active)
-            now = datetime.now(last_active.tzinfo)
-            if (now - last_active).days <= config['grace_period_days']:
-                self.logger.debug('PR #%s is stil in grace period', number)
-                continue
 
-            self.logger.info("PR #%s has had its time. Something's gonna happen.", number)
-            self.data['last_active'] = str(now)
+    def _sync_pull(self, number, state):
+        '''
+        Update the stored data of a PR with its current state (if we have it). Returns whether
+        we're still tracking the PR.
+        '''
 
-            with Modifier(self.api, number=number):
-                self._handle_indiscipline_pr(config)
+        if state is None:
+            return True
 
-            if self.old_data != self.data:
-                self.write_object(self.data, key=number)
+        if state['state'] != 'open':
+            self.logger.info('PR #%s is %s. Removing JSON...', number, state['state'])
+            self.pr_list['pulls'].remove(number)
+            return False
+
+        self.data['labels'] = state['labels']
+        self.data['assignee'] = state['assignees'][0] if state['assignees'] else None
+        last_active, last_comment = self.data.get('last_active'), state['last_comment_at']
+        if last_comment and last_active and \
+           datetime_parse(last_comment) > datetime_parse(last_active):
+            self.data['last_active'] = last_comment
+        return True
+
+
+    def _check_pull(self, number, config):
+        last_active = self.data.get('last_active')
+        if not last_active:
+            return
+
+        last_active = datetime_parse(last_active)
+        now = datetime.now(last_active.tzinfo)
+        if (now - last_active).days <= config['grace_period_days']:
+            self.logger.debug('PR #%s is stil in grace period', number)
+            return
+
+        self.logger.info("PR #%s has had its time. Something's gonna happen.", number)
+        self.data['last_active'] = str(now)
+
+        with Modifier(self.api, number=number):
+            self._handle_indiscipline_pr(config)
 
 
     def _handle_indiscipline_pr(self, config):
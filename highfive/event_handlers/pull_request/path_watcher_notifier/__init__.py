@@ -5,6 +5,8 @@ import re
 class PathWatcherNotifier(EventHandler):
     '''Checks the paths in PR diff and notifies the watchers of those paths (if any).'''
 
+    comment_priority = 20
+
     def on_issue_open(self):
         config = self.get_matched_subconfig()
         if not (config and self.api.is_pull):
@@ -8,6 +8,9 @@ class ReviewerAssigner(EventHandler):
     the reviewer and welcomes the contributor (if it's a newcomer).
     '''
 
+    # The reviewer ping leads the combined comment (see `EventHandler.comment_priority`).
+    comment_priority = 10
+
     def on_issue_open(self):
         reviewers = self.get_matches_from_config(self.api.config.collaborators)
         if not (reviewers and self.api.is_pull):
@@ -25,19 +28,22 @@ class ReviewerAssigner(EventHandler):
 
             chosen_ones = [reviewers[int(self.api.number) % len(reviewers)]]
 
-        self.api.set_assignees(chosen_ones)
         config = self.get_matched_subconfig()
         if not config:
+            self.api.set_assignees(chosen_ones)
             return
 
         first = [chosen_ones[0]]
         rest = map(lambda s: '@' + s, chosen_ones[1:])
         mention = self.join_names(first + rest)
         comment = self.api.rand_choice(config['reviewer_msg']).format(reviewer=mention)
-        self.api.post_comment(comment)
-
-        foss_folks = self.api.get_contributors()
-        if self.api.creator not in foss_folks:
+        # Assignees are changed along with the other changes (once the handlers are done), but
+        # pinging the reviewer and checking the creator don't depend on each other.
+        self.api.set_assignees(chosen_ones)
+        _, contributed = self.api.run_parallel(
+            lambda: self.api.post_comment(comment),
+            lambda: self.api.is_contributor(self.api.creator))
+        if not contributed:
             msg = self.api.rand_choice(config['newcomer_welcome_msg']).format(reviewer=mention)
             self.api.post_comment(msg)
 
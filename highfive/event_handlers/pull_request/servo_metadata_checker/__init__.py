@@ -5,9 +5,12 @@ import re
 class ServoMetadataChecker(EventHandler):
     '''
     Servo-specific handler to post warnings when PR diff has files added to WPT directory
-    without metadata.
+    without metadata. The check is run again when the PR is updated (and the warning is edited or
+    removed accordingly).
     '''
 
+    coalesce = {('synchronize', 'synchronize'): 'supersede'}
+
     def on_issue_open(self):
         if not (self.api.is_pull):
             return
@@ -21,9 +24,14 @@ class ServoMetadataChecker(EventHandler):
             if '.' in path and not any(re.search(f, path) for f in ignored):
                 offending_dirs |= set(d for d in metadata_dirs if re.search(d, path))
 
+        # If an earlier warning has been fixed by a later push, then it's removed.
+        message = None
         if offending_dirs:
             message = self.config['message'].format(offending_dirs=self.join_names(offending_dirs))
-            self.api.post_warning(message)
+        self.sync_comment(message, kind='warning', warning=True)
+
+    def on_pr_update(self):
+        self.on_issue_open()
 
 
 handler = ServoMetadataChecker
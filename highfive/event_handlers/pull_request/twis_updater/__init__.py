@@ -32,6 +32,8 @@ class TwisUpdater(EventHandler):
     of newcomers to this repo.
     '''
 
+    serial = True
+
     def __init__(self, api, config):
         super(TwisUpdater, self).__init__(api, config)
         self.now = datetime.now()
@@ -57,6 +59,9 @@ class TwisUpdater(EventHandler):
             return
 
         config = self.get_matched_subconfig()
+        if not config:      # ticks don't have a repo, and this repo may not be configured
+            return
+
         self.data['started_from'] = str(self.now)
         day, time = config['notify_day_time'].split()
         day = day[:3]
@@ -90,14 +95,23 @@ class TwisUpdater(EventHandler):
             return
 
         self.data['pulls'].append(self.api.number)
-        contributors = self.api.get_contributors()
-        if self.api.creator not in contributors:
+        if not self.api.is_contributor(self.api.creator):
             self.data['newcomers'].append(self.api.creator)
 
 
     def cleanup(self):
         if self.data != self.old_data:
             self.write_object(self.data)
+        if self.api.timers is None or not self.data.get('post_date'):
+            return
+
+        # A post date that's gone already is due right away, but only if a tick can make the post
+        # (otherwise, every tick would ask for another one).
+        post_date = datetime_parse(self.data['post_date'])
+        is_tick = self.api.payload.get('action') == '__tick'
+        has_repo = self.data.get('owner') and self.data.get('repo')
+        if post_date > datetime.now(post_date.tzinfo) or (has_repo and not is_tick):
+            self.wake_at(post_date)
 
 
     def _prepare_for_update(self):
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from config import get_logger
+from threading import Lock, current_thread
+
+import hashlib
+import json
+import os
+
+# Maximum size (in bytes) of the cached bodies held in memory
+CACHE_BYTES = 32 * 1024 * 1024
+# Maximum size (in bytes) of the cached bodies on disk
+DISK_CACHE_BYTES = 256 * 1024 * 1024
+# Response headers which are cached along with the body (and restored when it's reused)
+CACHED_HEADERS = ['Link']
+
+
+class CachedResponse(object):
+    __slots__ = ['etag', 'last_modified', 'body', 'headers']
+
+    def __init__(self, etag, last_modified, body, headers=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body        # JSON-encoded data
+        self.headers = headers or {}
+
+    @property
+    def data(self):
+        # Decoded every time, so that the callers can't mess with the cached data.
+        return json.loads(self.body)
+
+    def validators(self):
+        '''Get the headers for revalidating this response.'''
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_json(self):
+        return json.dumps({'etag': self.etag, 'last_modified': self.last_modified,
+                           'body': self.body, 'headers': self.headers})
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(data['etag'], data['last_modified'], data['body'], data.get('headers'))
+
+
+class ResponseCache(object):
+    '''
+    Cache for the responses of GET requests, keyed by the installation and the URL. Responses
+    are stored along with their `ETag` (or `Last-Modified`) header, so that the next request for
+    the same URL can be made conditional. If the resource hasn't changed, then Github responds
+    with a `304` (which doesn't count against the rate limit), and the cached body is used (along
+    with the cached `CACHED_HEADERS`, like the `Link` header of a paginated response).
+
+    The bodies are held in memory upto `size` bytes (the least recently used ones are evicted
+    beyond that). If `path` is given, then the bodies are also written to that directory (upto
+    `disk_size` bytes), so that they survive restarts.
+    '''
+
+    def __init__(self, size=CACHE_BYTES, path=None, disk_size=DISK_CACHE_BYTES):
+        self.logger = get_logger(__name__)
+        self.lock = Lock()
+        self.size = size
+        self.entries = OrderedDict()
+        self.used = 0
+        self.path = path
+        self.disk_size = disk_size
+        self.disk_used = 0
+        self.hits = 0
+        self.misses = 0
+
+        if path:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.disk_used = sum(os.path.getsize(os.path.join(path, name))
+                                 for name in os.listdir(path))
+
+    def _file_for(self, key):
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+    def _remember(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.used -= len(old.body)
+        self.entries[key] = entry
+        self.used += len(entry.body)
+        while self.used > self.size and self.entries:
+            _key, evicted = self.entries.popitem(last=False)
+            self.used -= len(evicted.body)
+
+    def get(self, key):
+        '''Get the cached response for a key (if there's one).'''
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = self.entries.pop(key)       # move to the end
+                return entry
+
+        if not self.path:
+            return None
+
+        try:
+            with open(self._file_for(key), 'rb') as fd:
+                entry = CachedResponse.from_json(fd.read())
+        except IOError:
+            return None
+        except Exception as err:
+            self.logger.error('Cannot load the cached response for %s: %s', key, err)
+            return None
+
+        with self.lock:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, etag, last_modified, data, headers=None):
+        '''Cache the data of a response (and its `CACHED_HEADERS`), given its validators.'''
+
+        headers = dict((name, headers[name]) for name in CACHED_HEADERS
+                       if headers and headers.get(name) is not None)
+        entry = CachedResponse(etag, last_modified, json.dumps(data), headers)
+        with self.lock:
+            self._remember(key, entry)
+
+        if self.path:
+            self._write(key, entry)
+
+    def _write(self, key, entry):
+        file_path = self._file_for(key)
+        data = entry.to_json()
+        with self.lock:
+            if os.path.isfile(file_path):
+                self.disk_used -= os.path.getsize(file_path)
+            self.disk_used += len(data)
+            trim = self.disk_used > self.disk_size
+
+        temp_path = '%s.%s.tmp' % (file_path, current_thread().ident)
+        with open(temp_path, 'wb') as fd:
+            fd.write(data)
+        os.rename(temp_path, file_path)
+        if trim:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        '''Remove the oldest files on disk, until we're well within the limit.'''
+
+        files = []
+        for name in os.listdir(self.path):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+            except OSError:     # someone else got to it
+                pass
+
+        files.sort(reverse=True)
+        with self.lock:
+            while files and self.disk_used > self.disk_size * 0.9:
+                _mtime, name, size = files.pop()
+                try:
+                    os.remove(os.path.join(self.path, name))
+                    self.disk_used -= size
+                except OSError:
+                    pass
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'cached': len(self.entries), 'bytes': self.used}
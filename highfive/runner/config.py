@@ -99,6 +99,26 @@ class Configuration(object):
             ('enabled_events', all_events),
             ('allowed_repos', []),
             ('collaborators', {}),
+            ('journal_path', None),
+            ('max_payload_bytes', None),
+            ('worker_processes', 0),
+            ('handler_threads', None),
+            ('scheduler_quantum', None),
+            ('installation_queue_limit', None),
+            ('max_backlog', None),
+            ('installation_idle_ttl', None),
+            ('max_connections', None),
+            ('rate_limit_reserve', None),
+            ('max_inflight_requests', None),
+            ('http_pool_size', None),
+            ('http_connect_timeout', None),
+            ('http_read_timeout', None),
+            ('http_idle_ttl', None),
+            ('response_cache_size', None),
+            ('response_cache_path', None),
+            ('delivery_cache_size', None),
+            ('delivery_filter_path', None),
+            ('merge_comments', False),
         ]
 
         for attr, value in defaults:
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from config import get_logger
+from threading import Lock
+
+import hashlib
+import json
+import math
+import os
+import struct
+
+# Number of recent delivery IDs remembered in memory.
+CACHE_SIZE = 10000
+# Number of delivery IDs a Bloom filter generation holds (at the given false positive rate),
+# before it's replaced by a new generation.
+FILTER_CAPACITY = 1000000
+FILTER_ERROR_RATE = 1e-6
+
+
+class BloomFilter(object):
+    '''Plain Bloom filter (using double hashing over a SHA-256 digest).'''
+
+    def __init__(self, capacity, error_rate):
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _indices(self, key):
+        h1, h2 = struct.unpack('<QQ', hashlib.sha256(key).digest()[:16])
+        return ((h1 + i * h2) % self.num_bits for i in xrange(self.num_hashes))
+
+    def add(self, key):
+        for idx in self._indices(key):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[idx >> 3] & (1 << (idx & 7)) for idx in self._indices(key))
+
+
+class DeliveryFilter(object):
+    '''
+    Remembers the `X-GitHub-Delivery` IDs of the payloads we've already accepted, so that the
+    redeliveries (Github's retries, or the manual ones) can be dropped. Deliveries are checked
+    with `seen`, and they're remembered with `commit` once they've been accepted.
+
+    The recent IDs are kept in an LRU cache. If `filter_path` is given, then all the IDs also go
+    into a Bloom filter which is saved to that file, so that redeliveries are caught even after
+    they've been evicted from the cache (or after a restart). The filter has two generations -
+    once the current one is full, it becomes the previous one (and the oldest one is dropped),
+    so that its false positive rate stays bounded.
+    '''
+
+    def __init__(self, cache_size=CACHE_SIZE, filter_path=None,
+                 filter_capacity=FILTER_CAPACITY, error_rate=FILTER_ERROR_RATE):
+        self.logger = get_logger(__name__)
+        self.lock = Lock()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.filter_path = filter_path
+        self.filter_capacity = filter_capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+        if filter_path:
+            self.filters = [BloomFilter(filter_capacity, error_rate)]
+            if os.path.isfile(filter_path):
+                self._load()
+
+    def _load(self):
+        try:
+            with open(self.filter_path, 'rb') as fd:
+                header = json.loads(fd.readline())
+                filters = []
+                for count in header['counts']:
+                    bloom = BloomFilter(self.filter_capacity, self.error_rate)
+                    if (bloom.num_bits, bloom.num_hashes) != (header['bits'], header['hashes']):
+                        raise ValueError('filter parameters have changed')
+                    bloom.bits = bytearray(fd.read(len(bloom.bits)))
+                    bloom.count = count
+                    filters.append(bloom)
+            self.filters = filters
+        except Exception as err:
+            self.logger.error('Cannot load the delivery filter from %s: %s', self.filter_path, err)
+
+    def save(self):
+        '''Write the Bloom filter to disk (if it's been updated since the last save).'''
+
+        with self.lock:
+            if not (self.filter_path and self.dirty):
+                return
+            header = {
+                'bits': self.filters[0].num_bits,
+                'hashes': self.filters[0].num_hashes,
+                'counts': [bloom.count for bloom in self.filters],
+            }
+            data = [json.dumps(header) + '\n'] + [bytes(bloom.bits) for bloom in self.filters]
+            self.dirty = False
+
+        temp_path = self.filter_path + '.tmp'
+        with open(temp_path, 'wb') as fd:
+            fd.write(''.join(data))
+        os.rename(temp_path, self.filter_path)
+
+    def seen(self, delivery_id):
+        '''Returns whether the delivery has been seen (i.e., committed) before.'''
+
+        key = delivery_id.encode('utf-8') if isinstance(delivery_id, unicode) else delivery_id
+        with self.lock:
+            if key in self.cache:
+                self.cache[key] = self.cache.pop(key)       # move to the end
+                self.hits += 1
+                return True
+
+            if any(key in bloom for bloom in self.filters):
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def commit(self, delivery_id):
+        '''
+        Remember the delivery. This should be done only after its payload has been journaled (or
+        handled), so that Github's redelivery of a payload which we've failed to accept isn't
+        dropped.
+        '''
+
+        key = delivery_id.encode('utf-8') if isinstance(delivery_id, unicode) else delivery_id
+        with self.lock:
+            self.cache[key] = self.cache.pop(key, True)     # move to the end (if it's there)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+            if self.filters and not any(key in bloom for bloom in self.filters):
+                if self.filters[-1].count >= self.filter_capacity:
+                    self.filters = self.filters[-1:] + [BloomFilter(self.filter_capacity,
+                                                                    self.error_rate)]
+                self.filters[-1].add(key)
+                self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'cached': len(self.cache)}
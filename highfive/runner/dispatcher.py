@@ -0,0 +1,99 @@
+from Queue import Queue
+from collections import deque
+from config import get_logger
+from threading import Lock, Thread, Timer
+
+
+class Defer(object):
+    '''
+    Returned by a task to run `task` in the same lane (before anything else) after `delay`
+    seconds.
+    '''
+
+    def __init__(self, delay, task):
+        self.delay = delay
+        self.task = task
+
+
+class Dispatcher(object):
+    '''
+    Bounded thread pool which runs tasks in "lanes". Tasks submitted with the same key are run
+    strictly in order (one at a time), while tasks for different keys can run concurrently.
+    The threads are spawned lazily, and a busy lane goes back to the end of the ready queue after
+    every task, so that it can't hog a thread. If `notify` is given, then it's called after every
+    task.
+
+    A task can put off some work by returning a `Defer`. Its lane is then parked (without holding
+    a thread) until the deferred task is due.
+    '''
+
+    def __init__(self, max_threads, notify=None):
+        self.logger = get_logger(__name__)
+        self.max_threads = max(1, max_threads)
+        self.notify = notify
+        self.threads = []
+        self.lock = Lock()
+        self.lanes = {}
+        self.ready = Queue()
+        self.pending = 0
+
+    def submit(self, key, task):
+        '''Queue a callable in the lane for the given key.'''
+
+        with self.lock:
+            self.pending += 1
+            lane = self.lanes.get(key)
+            if lane is None:
+                self.lanes[key] = deque([task])
+                self.ready.put(key)
+            else:
+                lane.append(task)
+
+            if len(self.threads) < min(self.max_threads, len(self.lanes)):
+                thread = Thread(target=self._work)
+                thread.daemon = True
+                self.threads.append(thread)
+                thread.start()
+
+    def is_idle(self):
+        with self.lock:
+            return self.pending == 0
+
+    def stop(self):
+        '''Stop the threads once they're done with the queued tasks.'''
+
+        with self.lock:
+            for _ in self.threads:
+                self.ready.put(None)
+            self.threads = []
+
+    def _work(self):
+        while True:
+            key = self.ready.get()
+            if key is None:
+                return
+            with self.lock:
+                task = self.lanes[key].popleft()
+
+            result = None
+            try:
+                result = task()
+            except Exception as err:
+                self.logger.exception('Error running task in lane %r: %s', key, err)
+
+            with self.lock:
+                if isinstance(result, Defer):
+                    self.lanes[key].appendleft(result.task)
+                    timer = Timer(result.delay, self.ready.put, [key])
+                    timer.daemon = True
+                    timer.start()
+                    continue
+
+                self.pending -= 1
+                if self.lanes[key]:
+                    self.ready.put(key)
+                else:
+                    self.lanes.pop(key)
+
+            if self.notify:
+                self.notify()
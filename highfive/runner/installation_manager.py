@@ -2,26 +2,78 @@ from .. import event_handlers
 from ..api_provider import GithubAPIProvider
 from Queue import Queue
 from config import get_logger
+from copy import deepcopy
 from datetime import datetime
+from dispatcher import Defer, Dispatcher
 from dateutil.parser import parse as datetime_parse
-from jose import jwt
-from request import request_with_requests
+from ratelimit import RESERVE, RateLimiter
+from request import Response, request_with_requests
+from retry import MAX_RETRIES, RequestError, TransientError, backoff, error_for
+from scheduler import issue_key
+from singleflight import SingleFlight
+from timers import to_timestamp
+from tokens import AppAuth
+from threading import BoundedSemaphore, Lock
 from time import sleep
 
+import sys
 import time
 
+HANDLER_THREADS = 4
+# Maximum number of concurrent requests (to Github) for an installation
+MAX_IN_FLIGHT = 8
+# Lane for the payloads which aren't related to an issue/PR (like ticks).
+INSTALLATION_LANE = '__installation__'
+
+def coalesce_payloads(earlier, later):
+    '''
+    Check whether (and how) two queued payloads for the same issue/PR can be coalesced, based on
+    what the handlers have declared. The items are the usual `(api, event, seq)` tuples.
+    '''
+
+    (api, x_github_event, _seq), (later_api, later_event, _later_seq) = earlier, later
+    if x_github_event != later_event:
+        return None
+
+    # An event needs only one pending tick - the later one takes over the due timers.
+    if api.payload.get('action') == '__tick' and later_api.payload.get('action') == '__tick':
+        timers, later_timers = api.payload.get('timers'), later_api.payload.get('timers')
+        if timers is None or later_timers is None:      # one of them is meant for everyone
+            later_api.payload.pop('timers', None)
+            return 'supersede'
+
+        for name, keys in timers.iteritems():
+            later_keys = later_timers.get(name, [])
+            if keys is None or later_keys is None:
+                later_timers[name] = None
+            else:
+                later_timers[name] = keys + filter(lambda key: key not in keys, later_keys)
+        return 'supersede'
+
+    # Numbers are shared by the repos of an installation.
+    if (api.owner, api.repo) != (later_api.owner, later_api.repo):
+        return None
+
+    # Label actions can be paired only for the same label.
+    if api.current_label != later_api.current_label:
+        return None
+
+    repo = '%s/%s' % (api.owner, api.repo)
+    return event_handlers.get_coalescing(x_github_event, repo, api.payload.get('action'),
+                                         later_api.payload.get('action'))
+
+
 class InstallationManager(object):
     '''
     Manager that takes care of an installation. It's responsible for keeping
     the tokens in sync with Github API servers. It also exposes a `request` function
-    that automatically blocks requests (once the API rate limit is reached), waits
-    until the next window and continues the request.
+    that paces the requests once the installation is running low on its rate limits
+    (and waits for the next window once they're exhausted).
     '''
 
     logger = get_logger(__name__)
     base_url = 'https://api.github.com'
     installation_url = base_url + '/installations/%s/access_tokens'
-    rate_limit_url = base_url + '/rate_limit'
     headers = {
         'Content-Type': 'application/json',
         # integration-specific header
@@ -29,67 +81,85 @@ class InstallationManager(object):
         'Accept-Encoding': 'gzip, deflate'
     }
 
-    def __init__(self, config, installation_id, store, json_request=request_with_requests):
+    def __init__(self, config, installation_id, store, json_request=request_with_requests,
+                 journal=None, scheduler=None, timers=None, cache=None, app_auth=None,
+                 refresher=None):
         self.config = config
         self.installation_id = installation_id
         self.installation_url = self.installation_url % installation_id
         self.store = store
+        self.journal = journal
+        # Cache for the responses of GET requests (shared by all the managers)
+        self.cache = cache
 
         # Objects for mocking in tests
         self.json_request = json_request
 
         # Stuff required for sync'ing token
-        self.remaining = 0
-        self.reset_time = int(time.time()) - 60
         self.next_token_sync = datetime.now()
         self.token = None
-        self.queue = Queue()
+        self.app_auth = app_auth or AppAuth(config)
+        # If there's a refresher, then the token is renewed in the background before it expires
+        # (as long as the installation is making requests).
+        self.refresher = refresher
+        self.renewals = SingleFlight()
+        self.token_synced_at = 0
+        self.last_request = 0
+        reserve = config['rate_limit_reserve']
+        self.rate_limiter = RateLimiter(RESERVE if reserve is None else reserve)
+        # If there's a scheduler, then the payloads are queued there (along with the payloads
+        # of other installations), and the scheduler is notified whenever a handler finishes.
+        self.queue = scheduler.queue_for(installation_id) if scheduler else Queue()
+        self.dispatcher = Dispatcher(config['handler_threads'] or HANDLER_THREADS,
+                                     notify=scheduler.notify if scheduler else None)
+        # Held by the `serial` handlers (which can run in any lane) while they're running.
+        self.serial_lock = Lock()
+        self.in_flight = BoundedSemaphore(config['max_inflight_requests'] or MAX_IN_FLIGHT)
+        # Responses are copied for the callers sharing them, so that they don't see each other's
+        # changes to the data.
+        self.reads = SingleFlight(copy=lambda resp: Response(data=deepcopy(resp.data),
+                                                             code=resp.code, headers=resp.headers))
+        self.timers = timers.view(installation_id) if timers else None
 
     def sync_token(self):
         '''
         Prove your ownership over the integration to Github and request a token.
         This token is used for API requests in the future. It has a lifetime,
-        and should be sync'ed again later.
+        and should be sync'ed again later. Concurrent callers share the same renewal.
+        '''
+
+        def renew_if_expired():
+            now = datetime.now(self.next_token_sync.tzinfo)     # timezone-aware version
+            if now >= self.next_token_sync:
+                self._renew_token()
+
+        now = datetime.now(self.next_token_sync.tzinfo)
+        if now >= self.next_token_sync:
+            self.renewals.do('token', renew_if_expired)
+
+    def refresh_token(self):
         '''
-        now = datetime.now(self.next_token_sync.tzinfo)     # timezone-aware version
-        if now < self.next_token_sync:
+        Renew the token ahead of its expiry (this is called by the refresher). Tokens of the
+        installations which haven't made any requests since their last renewal are left to
+        expire - they'll be renewed whenever they're needed.
+        '''
+
+        if self.last_request < self.token_synced_at:
+            self.logger.debug('Installation %s is idle, letting its token expire',
+                              self.installation_id)
             return
+        self.renewals.do('token', self._renew_token)
 
+    def _renew_token(self):
         self.logger.debug('Getting auth token with JWT from PEM key...')
-        # https://developer.github.com/apps/building-github-apps/authentication-options-for-github-apps/
-        since_epoch = int(time.time())
-        auth_payload = {
-            'iat': since_epoch,
-            'exp': since_epoch + 600,       # 10 mins expiration for JWT
-            'iss': self.config.integration_id,
-        }
-
-        auth = 'Bearer %s' % jwt.encode(auth_payload, self.config.pem_key, 'RS256')
+        auth = 'Bearer %s' % self.app_auth.get_jwt()
         resp = self._request('POST', self.installation_url, auth=auth)
         self.token = resp.data['token']     # installation token (expires in 1 hour)
         self.logger.debug('Token expires on %s', resp.data['expires_at'])
         self.next_token_sync = datetime_parse(resp.data['expires_at'])
-
-    def wait_time(self):
-        '''
-        Returns the wait time (in seconds) for the next request - this is based on the
-        number of requests that can be raised in a given window.
-
-        For example, if the request limit is 60/hour, then the waiting time for
-        each request is 60 seconds. If the bot hasn't made any requests over the
-        first half of an hour, then the wait time will now become 30 seconds.
-        Hence, it's uniform.
-        '''
-
-        now = int(time.time())
-        if now >= self.reset_time:
-            resp = self._request('GET', self.rate_limit_url)
-            self.reset_time = resp.data['rate']['reset']
-            self.remaining = resp.data['rate']['remaining']
-            self.logger.debug('Current time: %s, Remaining requests: %s, Reset time: %s',
-                              now, self.remaining, self.reset_time)
-
-        return (self.reset_time - now) / float(self.remaining)  # (uniform) wait time per request
+        self.token_synced_at = time.time()
+        if self.refresher is not None:
+            self.refresher.schedule(self, to_timestamp(self.next_token_sync))
 
     def _request(self, method, url, data=None, auth=True):
         '''
@@ -101,21 +171,50 @@ class InstallationManager(object):
         By default, all requests are authenticated with the installation token. This can
         be overridden with a different `Authorization` header value, or can be disabled
         entirely (`auth=False`).
+
+        GET requests with the installation token are made conditional if we have a cached
+        response for the URL, and a `304` response is served from the cache.
         '''
 
+        # Headers are built for every request, so that concurrent requests don't step on
+        # each other (or leak the token to another installation).
+        headers = dict(self.headers)
         if auth:
-            self.headers['Authorization'] = ('token %s' % self.token) if auth is True else auth
+            headers['Authorization'] = ('token %s' % self.token) if auth is True else auth
         else:
             self.logger.debug('Making unauthenticated request...')
 
+        cache_key, cached = None, None
+        if self.cache is not None and method == 'GET' and auth is True:
+            cache_key = '%s %s' % (self.installation_id, url)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                headers.update(cached.validators())
+
         self.logger.info('%s: %s (data: %s)', method, url, data)
-        resp = self.json_request(method, url, data=data, headers=self.headers)
-        if resp.code < 200 or resp.code >= 300:
-            self.logger.error('Got a %s response: %r', resp.code, resp.data)
-            raise Exception('Invalid response')
+        try:
+            resp = self.json_request(method, url, data=data, headers=headers)
+        except IOError as err:      # connection failures, timeouts, etc.
+            self.logger.error('Error requesting %s: %s', url, err)
+            raise TransientError(None)
 
-        if auth:
-            self.headers.pop('Authorization')
+        if auth is True:
+            self.rate_limiter.update(url, resp.headers)
+
+        if cached is not None and resp.code == 304:
+            self.logger.debug('Resource at %s has not been modified', url)
+            self.cache.record(hit=True)
+            headers = resp.headers.copy()
+            headers.update(cached.headers)
+            resp = Response(data=cached.data, headers=headers)
+        elif resp.code < 200 or resp.code >= 300:
+            self.logger.error('Got a %s response: %r', resp.code, resp.data)
+            raise error_for(resp)
+        elif cache_key is not None:
+            self.cache.record(hit=False)
+            etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.cache.put(cache_key, etag, last_modified, resp.data, resp.headers)
 
         return resp
 
@@ -123,25 +222,154 @@ class InstallationManager(object):
         '''
         Request method used in all the API calls for an installation. This ensures
         that we always have a valid token for making a request (and hence, we won't
-        fail in auth), and distributes requests uniformly through a window (and hence,
-        we won't gated by rate limits).
+        fail in auth), and paces the requests once we're running low on the rate limit
+        for the requested resource (and hence, we won't be gated by rate limits).
+
+        This is safe to call from multiple threads, but only a few of those requests
+        (`max_inflight_requests`) are in flight at any time. Identical GET requests (same URL
+        and auth) which come in while one of them is in flight share its response.
         '''
-        self.sync_token()
-        interval = self.wait_time()
-        sleep(interval)
-        resp = self._request(method=method, url=url, data=data, auth=auth)
-        self.remaining -= 1
+
+        def make_request():
+            self.sync_token()
+            interval = self.rate_limiter.acquire(url)
+            if interval > 0:
+                self.logger.debug('Running low on rate limit, waiting %.2f seconds...', interval)
+                sleep(interval)
+            with self.in_flight:
+                resp = self._request(method=method, url=url, data=data, auth=auth)
+            self.last_request = time.time()
+            return resp
+
+        if method != 'GET':
+            return make_request()
+
+        resp, shared = self.reads.do((url, auth), make_request)
+        if shared:
+            self.logger.debug('Shared the in-flight response for %s', url)
         return resp
 
+    def is_busy(self):
+        '''Whether this manager has payloads which haven't been handled yet.'''
+
+        return not (self.queue.empty() and self.dispatcher.is_idle())
+
+    def close(self):
+        '''Release the resources held by this manager (its threads and token renewals).'''
+
+        self.dispatcher.stop()
+        if self.refresher is not None:
+            self.refresher.cancel(self.installation_id)
+
+    def memory_usage(self):
+        '''Rough estimate of the memory held by this manager (in bytes).'''
+
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        size += sum(sys.getsizeof(value) for value in self.__dict__.itervalues())
+        with self.dispatcher.lock:
+            size += sum(sys.getsizeof(lane) for lane in self.dispatcher.lanes.itervalues())
+        return size
+
+    def has_capacity(self):
+        '''Whether the dispatcher can take more payloads right now.'''
+
+        return self.dispatcher.pending < self.dispatcher.max_threads
+
     def clear_queue(self):
-        '''Clear this manager's payload queue.'''
+        '''Clear this manager's payload queue by passing the payloads to the dispatcher.'''
 
         while not self.queue.empty():
-            (api, event) = self.queue.get()
-            for _path, handler in event_handlers.get_handlers_for(event, cached=True):
-                handler(api)
+            self.dispatch(*self.queue.get())
+
+    def dispatch(self, api, event, seq):
+        '''
+        Pass a payload to the dispatcher. All the handlers of a payload are run (in order, with
+        the same API provider) in the lane of its issue/PR (numbers are qualified by the repo), so
+        that payloads for the same issue/PR are handled in order, while the others can be handled
+        concurrently. Payloads which aren't related to an issue/PR (like ticks) are run in a common
+        lane. Handlers which work on installation-wide state (`serial` handlers) hold the
+        installation's lock while they run.
+        '''
+
+        repo = '%s/%s' % (api.owner, api.repo)
+        handlers = list(event_handlers.get_handlers_for(event, cached=True,
+                                                        wrap_config=False, repo=repo))
+        if not handlers:
+            self.ack(seq)
+            return
+
+        key = issue_key(api) or INSTALLATION_LANE
+        self.dispatcher.submit(key, self._create_task(api, handlers, seq))
+
+    def _run_handler(self, api, handler_config, handler):
+        if getattr(handler, 'serial', False):
+            with self.serial_lock:
+                handler(api, handler_config).handle_payload()
+        else:
+            handler(api, handler_config).handle_payload()
+
+    def _create_task(self, api, handlers, seq, attempt=0):
+        '''
+        Create the task for running the handlers (in order) for a payload. If a handler fails
+        because of a request which can be retried, then the task is deferred (with backoff) and
+        the rest of the handlers are run once it's retried. `attempt` is the number of times the
+        first handler has been tried already (or the flush, if there are no handlers left).
+        '''
+
+        def run_handlers():
+            for idx, components in enumerate(handlers):
+                handler_config, handler = components[-2:]
+                try:
+                    self._run_handler(api, handler_config, handler)
+                except RequestError as err:
+                    tries = attempt if idx == 0 else 0
+                    if err.retryable and tries < MAX_RETRIES:
+                        delay = backoff(err, tries)
+                        self.logger.warning('%s failed (%s), retrying in %.1f seconds',
+                                            handler.__name__, err, delay)
+                        return Defer(delay, self._create_task(api, handlers[idx:], seq, tries + 1))
+                    self.logger.error('%s failed (%s), giving up', handler.__name__, err)
+                except Exception as err:
+                    self.logger.exception('Error running %s: %s', handler.__name__, err)
+
+            # Label and assignee changes made by the handlers are flushed together at the end.
+            try:
+                api.flush_mutations()
+            except RequestError as err:
+                tries = attempt if not handlers else 0
+                if err.retryable and tries < MAX_RETRIES:
+                    delay = backoff(err, tries)
+                    self.logger.warning('Flushing changes failed (%s), retrying in %.1f seconds',
+                                        err, delay)
+                    return Defer(delay, self._create_task(api, [], seq, tries + 1))
+                self.logger.error('Flushing changes failed (%s), giving up', err)
+            except Exception as err:
+                self.logger.exception('Error flushing changes: %s', err)
+
+            # The index of the comments posted to an issue/PR is dropped once it's closed, so that
+            # the store doesn't keep growing with every issue/PR.
+            # (Handlers could've used a `Modifier` for the number, which drops it on exit.)
+            number = getattr(api, 'number', None)
+            if number is not None and api.payload.get('action') == 'closed':
+                try:
+                    api.forget_comments()
+                except Exception as err:
+                    self.logger.exception('Error dropping the comments of #%s: %s', number, err)
+
+            # Payloads from the journal are acked only after all the handlers are done with it.
+            self.ack(seq)
+
+        return run_handlers
+
+    def ack(self, seq):
+        '''Ack a payload from the journal (if it came from one).'''
+
+        if seq is not None and self.journal:
+            self.journal.ack(self.installation_id, seq)
 
     def create_api_provider_for_payload(self, payload):
+        # Label/assignee changes are buffered until the handlers (in a lane) are done.
         api = GithubAPIProvider(self.config, payload, self.store,
-                                api_json_request=self.request)
+                                api_json_request=self.request, buffered=True)
+        api.timers = self.timers
         return api
@@ -0,0 +1,212 @@
+from Queue import Queue
+from bisect import bisect_right
+from config import get_logger
+from threading import Lock
+
+import json
+import os
+import os.path as path
+
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+SEGMENT_SUFFIX = '.log'
+CURSORS_FILE = 'cursors.json'
+# Key used for acking entries whose installation couldn't be determined.
+UNKNOWN_INSTALLATION = '_'
+
+
+class Journal(object):
+    '''
+    Append-only, on-disk journal for the incoming payloads. The webhook endpoint appends the raw
+    payload (along with its event name) and returns immediately. The daemon consumes the entries,
+    and once an installation manager has handled an entry, it's acked for that installation.
+
+    Entries are written to segment files (named after the sequence number of their first entry),
+    and a new segment is started once the current one crosses `SEGMENT_MAX_BYTES`. A segment is
+    removed once all its entries have been acked. For every installation, a cursor (the sequence
+    number upto which all its entries have been acked) is kept in a cursors file, so that un-acked
+    entries can be replayed after a restart.
+
+    Every record is a header line ("<seq> <event> <length>") followed by the raw payload and
+    a newline.
+    '''
+
+    def __init__(self, journal_path, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.logger = get_logger(__name__)
+        self.journal_path = journal_path
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = Lock()
+        # Entries waiting to be consumed by the daemon - (seq, event, raw_payload)
+        self.pending = Queue()
+        # Number of un-acked entries in each segment (keyed by the segment's start sequence).
+        self.unacked = {}
+        self.cursors = {}
+        # Sequence numbers consumed by the daemon (but not yet acked) for each installation,
+        # and the highest acked sequence number.
+        self.outstanding = {}
+        self.highest_acked = {}
+        self.segments = []
+        self.next_seq = 0
+        # Segment which is currently being written to (and its file object)
+        self.current = None
+        self.fd = None
+
+        if not path.isdir(journal_path):
+            os.makedirs(journal_path)
+
+        cursors_path = path.join(journal_path, CURSORS_FILE)
+        if path.isfile(cursors_path):
+            with open(cursors_path, 'r') as fd:
+                self.cursors = json.load(fd)
+            # Sequence numbers should never go back, even if all the segments have been removed.
+            self.next_seq = max(self.cursors.values() + [-1]) + 1
+
+        for name in os.listdir(journal_path):
+            if name.endswith(SEGMENT_SUFFIX):
+                self.segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+        self.segments.sort()
+
+    def _segment_path(self, start):
+        return path.join(self.journal_path, '%020d%s' % (start, SEGMENT_SUFFIX))
+
+    def _read_segment(self, start):
+        '''Generator over the (seq, event, raw_payload) records in a segment.'''
+
+        with open(self._segment_path(start), 'rb') as fd:
+            while True:
+                header = fd.readline()
+                if not header:
+                    break
+
+                try:
+                    seq, event, length = header.split()
+                    seq, length = int(seq), int(length)
+                except ValueError:
+                    self.logger.error('Corrupted header in segment %s. Skipping the rest...', start)
+                    break
+
+                raw_payload = fd.read(length)
+                if len(raw_payload) < length or fd.read(1) != '\n':
+                    # Last write was interrupted - this entry was never acknowledged.
+                    self.logger.error('Truncated entry %s in segment %s', seq, start)
+                    break
+
+                yield seq, event, raw_payload
+
+    def _is_acked(self, inst_id, seq):
+        return seq <= self.cursors.get(str(inst_id), -1)
+
+    def replay(self, get_installation):
+        '''
+        Scan the existing segments and queue the entries which haven't been acked for their
+        installation. `get_installation` should return the installation ID for a given raw
+        payload (or `None` if it can't be determined).
+        '''
+
+        with self.lock:
+            for start in list(self.segments):
+                count = 0
+                for seq, event, raw_payload in self._read_segment(start):
+                    self.next_seq = max(self.next_seq, seq + 1)
+                    inst_id = get_installation(raw_payload)
+                    inst_id = UNKNOWN_INSTALLATION if inst_id is None else inst_id
+                    if self._is_acked(inst_id, seq):
+                        continue
+
+                    self.pending.put((seq, event, raw_payload))
+                    count += 1
+
+                self.next_seq = max(self.next_seq, start)
+                if count:
+                    self.unacked[start] = count
+                    self.logger.info('Replaying %s entries from segment %s', count, start)
+                else:
+                    self._remove_segment(start)
+
+    def append(self, event, raw_payload):
+        '''Write the raw payload to the journal and queue it for the daemon.'''
+
+        with self.lock:
+            if self.fd is None or self.fd.tell() >= self.segment_max_bytes:
+                self._rotate()
+
+            seq = self.next_seq
+            self.next_seq += 1
+            self.fd.write('%d %s %d\n' % (seq, event, len(raw_payload)))
+            self.fd.write(raw_payload)
+            self.fd.write('\n')
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+
+            self.unacked[self.current] = self.unacked.get(self.current, 0) + 1
+            self.pending.put((seq, event, raw_payload))
+            return seq
+
+    def track(self, inst_id, seq):
+        '''Mark an entry as consumed (i.e., it's now being handled for the given installation).'''
+
+        inst_id = UNKNOWN_INSTALLATION if inst_id is None else inst_id
+        with self.lock:
+            self.outstanding.setdefault(str(inst_id), set()).add(seq)
+
+    def ack(self, inst_id, seq):
+        '''Mark an entry as handled for the given installation.'''
+
+        inst_id = UNKNOWN_INSTALLATION if inst_id is None else inst_id
+        with self.lock:
+            key = str(inst_id)
+            outstanding = self.outstanding.get(key, set())
+            outstanding.discard(seq)
+            highest = self.highest_acked[key] = max(seq, self.highest_acked.get(key, -1))
+            # Cursor can't move past the entries which are still being handled.
+            cursor = min(highest, min(outstanding) - 1) if outstanding else highest
+            if cursor > self.cursors.get(key, -1):
+                self.cursors[key] = cursor
+                self._write_cursors()
+            if not outstanding:
+                self.outstanding.pop(key, None)
+
+            idx = bisect_right(self.segments, seq) - 1
+            if idx < 0:
+                return
+
+            start = self.segments[idx]
+            self.unacked[start] = self.unacked.get(start, 1) - 1
+            # Current segment is still being written to, so it's never removed.
+            if self.unacked[start] <= 0 and start != self.current:
+                self._remove_segment(start)
+
+    def _rotate(self):
+        previous = self.current
+        if self.fd is not None:
+            self.fd.close()
+
+        self.current = self.next_seq
+        self.segments.append(self.current)
+        self.logger.debug('Starting new journal segment at %s', self.current)
+        self.fd = open(self._segment_path(self.current), 'ab')
+
+        # The previous segment may have been fully acked while it was being written.
+        if previous is not None and self.unacked.get(previous, 0) <= 0:
+            self._remove_segment(previous)
+
+    def _remove_segment(self, start):
+        self.logger.debug('Removing acked journal segment %s', start)
+        self.segments.remove(start)
+        self.unacked.pop(start, None)
+        segment_path = self._segment_path(start)
+        if path.isfile(segment_path):
+            os.remove(segment_path)
+
+    def _write_cursors(self):
+        cursors_path = path.join(self.journal_path, CURSORS_FILE)
+        temp_path = cursors_path + '.tmp'
+        with open(temp_path, 'w') as fd:
+            json.dump(self.cursors, fd)
+        os.rename(temp_path, cursors_path)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.fd.close()
+                self.fd = None
+                self.current = None
@@ -0,0 +1,96 @@
+from threading import Lock
+from urlparse import urlparse
+
+import time
+
+# Fraction of a budget that's held in reserve - requests are paced only once we get there.
+RESERVE = 0.1
+
+
+def resource_for(url):
+    '''Get the rate limit budget ("resource" in Github's terms) which covers the given URL.'''
+
+    path = urlparse(url).path
+    if path.startswith('/search/'):
+        return 'search'
+    if path.startswith('/graphql'):
+        return 'graphql'
+    return 'core'
+
+
+class _Bucket(object):
+    __slots__ = ['limit', 'remaining', 'reset']
+
+    def __init__(self):
+        self.limit = None       # unknown until we get a response
+        self.remaining = None
+        self.reset = 0
+
+
+class RateLimiter(object):
+    '''
+    Token bucket for each of Github's rate limit budgets (core, search and GraphQL) of an
+    installation. The buckets are refilled from the `X-RateLimit-*` headers which come with
+    every response, so we never have to ask for the limits.
+
+    Requests are let through right away as long as a budget is above its reserve (`reserve`
+    times its limit). Beyond that, the remaining requests are spread uniformly over what's left
+    of the window, and once the budget runs out, requests wait for the window to reset.
+    '''
+
+    def __init__(self, reserve=RESERVE):
+        self.reserve = reserve
+        self.lock = Lock()
+        self.buckets = {}
+
+    def _bucket(self, resource):
+        bucket = self.buckets.get(resource)
+        if bucket is None:
+            bucket = self.buckets[resource] = _Bucket()
+        return bucket
+
+    def acquire(self, url, now=None):
+        '''Take a token for a request to the given URL. Returns the time (in seconds) to wait.'''
+
+        now = time.time() if now is None else now
+        with self.lock:
+            bucket = self._bucket(resource_for(url))
+            if now >= bucket.reset:
+                # New window (or we haven't heard from Github yet) - the next response will
+                # tell us where we stand.
+                bucket.remaining = None
+            if bucket.remaining is None:
+                return 0
+
+            bucket.remaining -= 1
+            if bucket.remaining >= bucket.limit * self.reserve:
+                return 0
+            if bucket.remaining < 0:
+                return max(0, bucket.reset - now)
+            return max(0, bucket.reset - now) / (bucket.remaining + 1)
+
+    def update(self, url, headers):
+        '''Refill the bucket using the rate limit headers of a response (if it has them).'''
+
+        headers = dict((key.lower(), value) for key, value in headers.items())
+        try:
+            limit = int(headers['x-ratelimit-limit'])
+            remaining = int(headers['x-ratelimit-remaining'])
+            reset = int(headers['x-ratelimit-reset'])
+        except (KeyError, ValueError):
+            return
+
+        resource = headers.get('x-ratelimit-resource') or resource_for(url)
+        with self.lock:
+            bucket = self._bucket(resource)
+            # Responses could arrive out of order - ignore the ones from an older window.
+            if reset < bucket.reset:
+                return
+            bucket.limit, bucket.remaining, bucket.reset = limit, remaining, reset
+
+    def stats(self):
+        '''Get the remaining requests (and the reset time) of each budget.'''
+
+        with self.lock:
+            return dict((resource, {'remaining': bucket.remaining, 'reset': bucket.reset})
+                        for resource, bucket in self.buckets.iteritems())
@@ -0,0 +1,91 @@
+from config import get_logger
+from threading import RLock
+
+import time
+
+# Time (in seconds) after which an idle manager is evicted.
+IDLE_TTL_SECS = 60 * 60
+
+
+class InstallationRegistry(object):
+    '''
+    Thread-safe registry of the installation managers. Managers are created on demand (using the
+    given factory), and they're evicted once they've been idle (i.e., they don't have any pending
+    payloads, and they haven't been asked for) for `ttl` seconds. An evicted installation can
+    be brought back anytime - everything it needs lives in the store.
+    '''
+
+    def __init__(self, factory, ttl=IDLE_TTL_SECS):
+        self.logger = get_logger(__name__)
+        self.factory = factory
+        self.ttl = ttl
+        self.lock = RLock()
+        self.managers = {}
+        self.last_used = {}
+
+    def get(self, inst_id, default=None):
+        with self.lock:
+            manager = self.managers.get(inst_id)
+            if manager is None:
+                return default
+            self.last_used[inst_id] = time.time()
+            return manager
+
+    def get_or_create(self, inst_id):
+        with self.lock:
+            manager = self.managers.get(inst_id)
+            if manager is None:
+                manager = self.managers[inst_id] = self.factory(inst_id)
+            self.last_used[inst_id] = time.time()
+            return manager
+
+    def __getitem__(self, inst_id):
+        manager = self.get(inst_id)
+        if manager is None:
+            raise KeyError(inst_id)
+        return manager
+
+    def __contains__(self, inst_id):
+        with self.lock:
+            return inst_id in self.managers
+
+    def __len__(self):
+        with self.lock:
+            return len(self.managers)
+
+    def values(self):
+        '''Get a snapshot of the managers (which is safe to iterate).'''
+
+        with self.lock:
+            return self.managers.values()
+
+    def clear(self):
+        with self.lock:
+            for manager in self.managers.itervalues():
+                manager.close()
+            self.managers.clear()
+            self.last_used.clear()
+
+    def evict_idle(self, now=None):
+        '''Evict the managers which have been idle for too long. Returns the evicted IDs.'''
+
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            for inst_id, manager in self.managers.items():
+                if now - self.last_used[inst_id] < self.ttl or manager.is_busy():
+                    continue
+                manager.close()
+                self.managers.pop(inst_id)
+                self.last_used.pop(inst_id)
+                evicted.append(inst_id)
+
+        if evicted:
+            self.logger.info('Evicted %s idle installation(s): %s', len(evicted), evicted)
+        return evicted
+
+    def memory_usage(self):
+        '''Get the (estimated) memory held by each manager, in bytes.'''
+
+        return dict((manager.installation_id, manager.memory_usage())
+                    for manager in self.values())
@@ -1,5 +1,22 @@
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from urlparse import urlparse
+
 import json
 import requests
+import time
+
+# Size (in bytes) beyond which a body is considered large (and logged)
+LARGE_BODY_BYTES = 1024 * 1024
+
+# Maximum number of connections kept alive for a host
+POOL_SIZE = 10
+# Timeouts (in seconds) for connecting to a host, and for reading its response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# Time (in seconds) after which the connections to an idle host are closed.
+POOL_IDLE_TTL = 5 * 60
+
 
 class Response(object):
     ''' The response object that should be returned by all "requesting" functions.'''
@@ -15,21 +32,176 @@ class Response(object):
         return isinstance(self.data, dict) or isinstance(self.data, list)
 
 
-def request_with_requests(method, url, data=None, headers={}):
+class SessionPool(object):
+    '''
+    Keep-alive sessions for the hosts we talk to (Github, Imgur, build bots, etc.), so that
+    the requests to a host reuse its connections (instead of going through the TCP and TLS
+    handshakes every time). There's a session for each host, and it's shared by everyone in
+    the process. Sessions which haven't been used for `idle_ttl` seconds are closed by
+    `evict_idle`.
+    '''
+
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, idle_ttl=POOL_IDLE_TTL):
+        self.reset()
+        self.configure(pool_size, connect_timeout, read_timeout, idle_ttl)
+
+    def reset(self):
+        '''
+        Forget all the sessions (in a forked process). They aren't closed, because their sockets
+        still belong to the parent.
+        '''
+
+        self.lock = Lock()
+        self.sessions = {}
+        self.last_used = {}
+        # Requests and connections made by the sessions which have been closed
+        self.retired = [0, 0]
+
+    def configure(self, pool_size=None, connect_timeout=None, read_timeout=None, idle_ttl=None):
+        '''Update the settings (for the sessions which are created from now on).'''
+
+        self.pool_size = pool_size or POOL_SIZE
+        self.timeout = (connect_timeout or CONNECT_TIMEOUT, read_timeout or READ_TIMEOUT)
+        self.idle_ttl = idle_ttl or POOL_IDLE_TTL
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def session_for(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = self._create_session()
+            self.last_used[host] = time.time()
+            return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def _counts(self, session):
+        '''Get the number of requests and connections made by a session.'''
+
+        requests_made, connections = 0, 0
+        for adapter in set(session.adapters.values()):      # the schemes share an adapter
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    connections += pool.num_connections
+        return requests_made, connections
+
+    def evict_idle(self, now=None):
+        '''Close the sessions which haven't been used for a while. Returns the evicted hosts.'''
+
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            for host, last_used in self.last_used.items():
+                if now - last_used < self.idle_ttl:
+                    continue
+                session = self.sessions.pop(host)
+                self.last_used.pop(host)
+                requests_made, connections = self._counts(session)
+                self.retired[0] += requests_made
+                self.retired[1] += connections
+                session.close()
+                evicted.append(host)
+
+        return evicted
+
+    def stats(self):
+        '''
+        Get the number of requests which reused a pooled connection (hits), and the ones which
+        had to make a new connection (misses).
+        '''
+
+        with self.lock:
+            requests_made, connections = self.retired
+            for session in self.sessions.itervalues():
+                counts = self._counts(session)
+                requests_made += counts[0]
+                connections += counts[1]
+            return {'hits': requests_made - connections, 'misses': connections,
+                    'hosts': len(self.sessions)}
+
+
+# Sessions shared by all the requests in this process
+SESSIONS = SessionPool()
+
+
+class BodyStats(object):
+    '''Number of bodies decoded, their size and the time spent on them, for each kind of body.'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = Lock()
+        self.kinds = {}
+
+    def record(self, kind, size, secs):
+        with self.lock:
+            stats = self.kinds.setdefault(kind, {'count': 0, 'large': 0, 'bytes': 0,
+                                                 'max_bytes': 0, 'secs': 0.0})
+            stats['count'] += 1
+            stats['large'] += int(size >= LARGE_BODY_BYTES)
+            stats['bytes'] += size
+            stats['max_bytes'] = max(stats['max_bytes'], size)
+            stats['secs'] += secs
+
+    def stats(self):
+        with self.lock:
+            return dict((kind, dict(stats)) for kind, stats in self.kinds.iteritems())
+
+
+BODY_STATS = BodyStats()
+
+
+def decode_body(body, content_type, encoding=None, parse_json=True):
+    '''
+    Decode a body based on its content type. Only JSON bodies are parsed. Text (diffs, logs,
+    etc.) is decoded as it is, and the others are left as raw bytes. If there's no content type,
+    then we try JSON, and fall back to text. Returns the kind of body along with the data.
+    '''
+
+    mime = content_type.split(';')[0].strip().lower()
+    is_json = mime == 'application/json' or mime.endswith('+json')
+    if parse_json and (is_json or not mime):
+        try:
+            return 'json', json.loads(body)
+        except ValueError:
+            pass
+
+    if not mime or mime.startswith('text/') or is_json or encoding:
+        return 'text', body.decode(encoding or 'utf-8', 'replace')
+    return 'bytes', body
+
+
+def request_with_requests(method, url, data=None, headers={}, parse_json=True):
     '''
     Make a request with the `requests` module to the given `url`
-    with the given `method`, (optional) `data` and `headers`
+    with the given `method`, (optional) `data` and `headers`. JSON responses
+    are parsed (unless `parse_json` is disabled), text responses are decoded,
+    and the rest are left as they are.
     '''
 
     data = json.dumps(data) if data is not None else data
-    req_method = getattr(requests, method.lower())  # hack for getting function
-    resp = req_method(url, data=data, headers=headers)
-    data = resp.text
-
-    try:
-        data = json.loads(data)
-    except Exception:
-        pass
+    resp = SESSIONS.request(method.upper(), url, data=data, headers=headers)
+
+    start = time.time()
+    content_type = resp.headers.get('Content-Type', '')
+    # Without a charset, `requests` falls back to ISO-8859-1 for text (or guesses it from the
+    # body, which is slow for large ones) - we go for UTF-8 instead.
+    encoding = resp.encoding if 'charset' in content_type.lower() else None
+    kind, data = decode_body(resp.content, content_type, encoding, parse_json)
+    BODY_STATS.record(kind, len(resp.content), time.time() - start)
 
     return Response(
         data=data,
@@ -0,0 +1,66 @@
+import random
+import time
+
+# Maximum number of times a handler is retried (after a failed request).
+MAX_RETRIES = 5
+# Base and maximum delays (in seconds) for the exponential backoff
+BACKOFF_BASE_SECS = 2
+BACKOFF_CAP_SECS = 5 * 60
+
+
+class RequestError(Exception):
+    '''Raised for a failed request (`code` is `None` if we didn't get a response at all).'''
+
+    retryable = False
+
+    def __init__(self, code, data=None, retry_after=None):
+        super(RequestError, self).__init__('Invalid response (%s)' % code)
+        self.code = code
+        self.data = data
+        self.retry_after = retry_after
+
+
+class TransientError(RequestError):
+    '''Server errors and network failures - the request may (or may not) have gone through.'''
+
+    retryable = True
+
+
+class RateLimitedError(RequestError):
+    '''We've been rate limited (primary or secondary limits). The request didn't go through.'''
+
+    retryable = True
+
+
+class PermanentError(RequestError):
+    '''Client errors (validation failures, missing permissions, etc.) - retrying won't help.'''
+
+
+def error_for(resp, now=None):
+    '''Classify the error for an unsuccessful response.'''
+
+    now = time.time() if now is None else now
+    if resp.code >= 500:
+        return TransientError(resp.code, resp.data)
+
+    headers = dict((key.lower(), value) for key, value in resp.headers.items())
+    if resp.code in (403, 429):
+        if headers.get('retry-after', '').isdigit():
+            return RateLimitedError(resp.code, resp.data, int(headers['retry-after']))
+        if headers.get('x-ratelimit-remaining') == '0':
+            reset = int(headers.get('x-ratelimit-reset', now))
+            return RateLimitedError(resp.code, resp.data, max(0, reset - now))
+
+    return PermanentError(resp.code, resp.data)
+
+
+def backoff(err, attempt):
+    '''
+    Get the delay (in seconds) before retrying after an error. We honor `Retry-After` (or the
+    rate limit reset) if we have one, or else we go for exponential backoff with full jitter,
+    so that the retries from different installations don't come in waves.
+    '''
+
+    if err.retry_after is not None:
+        return err.retry_after + random.uniform(0, BACKOFF_BASE_SECS)
+    return random.uniform(0, min(BACKOFF_CAP_SECS, BACKOFF_BASE_SECS * 2 ** attempt))
@@ -0,0 +1,87 @@
+from copy import deepcopy
+
+import re
+
+__ROUTERS = {}
+
+
+class RepoRouter(object):
+    '''
+    Compiled matcher for a list of repo patterns (like "allowed_repos" or the keys of a per-repo
+    config). Python's `re` module caches only a hundred patterns (and purges the whole cache once
+    it's full), and we have a lot of patterns across the handlers. So, we compile the patterns
+    once, and remember the decisions (positive and negative) for every "owner/repo" we've seen.
+    '''
+
+    def __init__(self, patterns, ignore_case=False):
+        self.patterns = list(patterns)
+        self.compiled = map(lambda p: re.compile(p.lower() if ignore_case else p), self.patterns)
+        self.decisions = {}
+        self.matched = {}
+        self.merged = {}
+
+    def matches(self, repo):
+        '''Check whether any of the patterns match the given "owner/repo" string.'''
+
+        decision = self.decisions.get(repo)
+        if decision is None:
+            decision = any(regex.search(repo) for regex in self.compiled)
+            self.decisions[repo] = decision
+        return decision
+
+    def matched_patterns(self, repo):
+        '''Get the patterns (in order) which match the given "owner/repo" string.'''
+
+        matched = self.matched.get(repo)
+        if matched is None:
+            matched = [pat for pat, regex in zip(self.patterns, self.compiled) if regex.search(repo)]
+            self.matched[repo] = matched
+        return matched
+
+    def subconfig(self, config, repo):
+        '''
+        Merge the values of a per-repo config (whose keys are the patterns of this router) for the
+        given "owner/repo" string. Lists are extended and dicts are updated in the order of the
+        matches. The merged value is cached for the config object, and a copy is returned, so that
+        the callers are free to modify it.
+        '''
+
+        key = (id(config), repo)
+        cached = self.merged.get(key)
+        # We hold a reference to the config, so its ID can't be reused by some other object.
+        if cached is not None and cached[0] is config:
+            return deepcopy(cached[1])
+
+        result = None
+        for pattern in self.matched_patterns(repo):
+            value = config[pattern]
+            if not result:
+                result = deepcopy(value)
+            elif isinstance(result, list):
+                result.extend(value)
+            elif isinstance(result, dict):
+                result.update(value)
+
+        self.merged[key] = (config, result)
+        return deepcopy(result)
+
+
+def get_router(patterns, ignore_case=False):
+    '''Get the (cached) router for the given list of patterns.'''
+
+    global __ROUTERS
+    key = (tuple(patterns), ignore_case)
+    router = __ROUTERS.get(key)
+    if router is None:
+        router = RepoRouter(key[0], ignore_case)
+        __ROUTERS[key] = router
+    return router
+
+
+def get_config_router(config):
+    '''
+    Get the router for a per-repo config (i.e., a dict whose keys are repo patterns).
+    The keys are matched in lowercase.
+    '''
+
+    return get_router(config.keys(), ignore_case=True)
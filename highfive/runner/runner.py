@@ -1,21 +1,39 @@
-from .. import store
+from .. import event_handlers, store
 from ..store import InstallationStore
+from cache import CACHE_BYTES, DISK_CACHE_BYTES, ResponseCache
 from config import get_logger
-from installation_manager import InstallationManager
+from deliveries import CACHE_SIZE, DeliveryFilter
+from installation_manager import InstallationManager, coalesce_payloads
+from journal import Journal
+from registry import IDLE_TTL_SECS, InstallationRegistry
+from request import BODY_STATS, SESSIONS
+from Queue import Empty
+from routing import get_router
+from scheduler import QUANTUM, QUEUE_LIMIT, Scheduler
+from timers import TimerService
+from tokens import AppAuth, TokenRefresher
 from threading import Thread
-from time import sleep
+from workers import AckForwarder, WorkerPool, shard_for
 
 import hashlib
 import hmac
 import json
-import re
+import os
 import time
 
 WORKER_SLEEP_SECS = 1
+# Interval for logging the scheduler's wait times
+STATS_INTERVAL_SECS = 60
+# Number of pending payloads (for all installations) beyond which new payloads are refused
+MAX_BACKLOG = 10000
+# Time (in seconds) after which Github should retry the refused payloads
+RETRY_AFTER_SECS = 60
+# Github doesn't send payloads larger than 25 MB.
+MAX_PAYLOAD_BYTES = 25 * 1024 * 1024
 
 # Implementation of digest comparison from Django
 # https://github.com/django/django/blob/0ed7d155635da9f79d4dd67e4889087d3673c6da/django/utils/crypto.py#L96-L105
-def compare_digest(val_1, val_2):
+def _compare_digest(val_1, val_2):
     result = 0
     if len(val_1) != len(val_2):
         return False
@@ -25,6 +43,9 @@ def compare_digest(val_1, val_2):
 
     return result == 0
 
+# Use the constant-time comparison from the standard library (written in C) if it's available.
+compare_digest = getattr(hmac, 'compare_digest', _compare_digest)
+
 
 class HandlerError(object):
     '''Enum-like object solely for testing the payload handling result.'''
@@ -40,11 +61,80 @@ class Runner(object):
     Runner that receives incoming payloads from Github, verifies them, and
     passes them to the corresponding installation managers.
     '''
-    def __init__(self, config):
+    def __init__(self, config, inbox=None, done=None):
         self.logger = get_logger(__name__)
-        self.installations = {}
         self.config = config
+        self.installations = InstallationRegistry(self._create_manager,
+                                                  config['installation_idle_ttl'] or IDLE_TTL_SECS)
         self.store = store.from_config(config)
+        # Queue for the payloads sent by the parent (when this runner is a worker). The managers
+        # in a worker ack the payloads to the parent (which takes care of the actual journal).
+        self.inbox = inbox
+        if inbox is not None:
+            self.journal = AckForwarder(done)
+        elif config['journal_path']:
+            self.journal = Journal(config.journal_path)
+        else:
+            self.journal = None
+        self.max_payload_bytes = config['max_payload_bytes'] or MAX_PAYLOAD_BYTES
+        self.router = get_router(config.allowed_repos)
+        self.deliveries = DeliveryFilter(config['delivery_cache_size'] or CACHE_SIZE,
+                                         config['delivery_filter_path'])
+        self.scheduler = Scheduler(config['scheduler_quantum'] or QUANTUM,
+                                   coalesce=coalesce_payloads, on_drop=self._on_drop,
+                                   limit=config['installation_queue_limit'] or QUEUE_LIMIT)
+        self.max_backlog = config['max_backlog'] or MAX_BACKLOG
+        self.timers = TimerService()
+        # Connections are pooled for the whole process (and shared by all the managers).
+        SESSIONS.configure(config['http_pool_size'], config['http_connect_timeout'],
+                           config['http_read_timeout'], config['http_idle_ttl'])
+        self.app_auth = AppAuth(config)
+        self.refresher = TokenRefresher()
+        self.cache = self._create_cache()
+        # If we have multiple worker processes, then the installations are sharded among them.
+        processes = config['worker_processes']
+        self.pool = WorkerPool(self, processes) if processes and inbox is None else None
+
+    def _create_cache(self, shard=None):
+        '''
+        Create the cache for the responses of GET requests. With worker processes, each worker
+        keeps its part of the disk tier in a directory of its own (with its share of the disk
+        limit), because the workers can't see each other's usage. The parent (and a worker, until
+        it knows its shard) doesn't make any requests, so it doesn't use the disk.
+        '''
+
+        path, disk_size = self.config['response_cache_path'], DISK_CACHE_BYTES
+        processes = self.config['worker_processes']
+        if path and processes:
+            path = None if shard is None else os.path.join(path, 'worker-%s' % shard)
+            disk_size //= processes
+        return ResponseCache(self.config['response_cache_size'] or CACHE_BYTES, path, disk_size)
+
+    def verify_signature(self, x_hub_signature, raw_payload):
+        '''
+        Compare the 'X-Hub-Signature' header value against the HMAC obtained from the raw payload
+        using the app's "secret" key. Payloads are always accepted if the secret hasn't been set.
+        '''
+
+        if not self.config.secret:
+            self.logger.warn("Payload's signature can't be verified without secret key!")
+            return True
+
+        hash_func, signature = (x_hub_signature + '=').split('=')[:2]
+        hash_func = getattr(hashlib, hash_func, None)     # This is generally `sha1`
+        if hash_func is None:
+            self.logger.debug('Unknown hash function in signature!')
+            return False
+
+        msg_auth_code = hmac.new(self.config.secret, raw_payload, hash_func)
+        hashed = msg_auth_code.hexdigest()
+
+        if not compare_digest(str(signature), hashed):
+            self.logger.debug('Invalid signature!')
+            return False
+
+        self.logger.info("Payload's signature has been verified!")
+        return True
 
     def verify_payload(self, x_hub_signature, raw_payload):
         '''
@@ -61,34 +151,126 @@ class Runner(object):
         >>> print ''.join(map(chr, random.sample(range(32, 127), 32)))
 
         ... which will generate a 32-byte key in the ASCII range.
+
+        The size and the signature are checked against the raw payload, so that oversized
+        or forged payloads are rejected before we spend any time decoding them.
         '''
 
+        status = self.check_raw_payload(x_hub_signature, raw_payload)
+        if status is not None:
+            return status, None
+
         try:    # All payloads are JSON - other payloads are ignored.
             payload = json.loads(raw_payload)
         except Exception as err:
             self.logger.debug('Cannot decode payload JSON: %s', err)
             return 400, None
 
-        if self.config.secret:
-            hash_func, signature = (x_hub_signature + '=').split('=')[:2]
-            hash_func = getattr(hashlib, hash_func)     # This is generally `sha1`
-            msg_auth_code = hmac.new(self.config.secret, raw_payload, hash_func)
-            hashed = msg_auth_code.hexdigest()
+        return None, payload
 
-            if not compare_digest(signature, hashed):
-                self.logger.debug('Invalid signature!')
-                return 403, None
+    def check_raw_payload(self, x_hub_signature, raw_payload):
+        '''Check the size and signature of a raw payload. Returns the error status (if any).'''
 
-            self.logger.info("Payload's signature has been verified!")
-        else:
-            self.logger.warn("Payload's signature can't be verified without secret key!")
+        if len(raw_payload) > self.max_payload_bytes:
+            self.logger.debug('Payload size (%s bytes) exceeds the limit!', len(raw_payload))
+            return 413
 
-        return None, payload
+        if not self.verify_signature(x_hub_signature, raw_payload):
+            return 403
 
-    def handle_payload(self, x_github_event, payload):
+    def check_event(self, x_github_event):
+        '''
+        Filter the payloads based on the event alone. Since this doesn't need the payload,
+        this can be used to drop the unwanted payloads before verifying or decoding them.
+        '''
+
+        if 'installation_repositories' in x_github_event:
+            return HandlerError.NewInstallation
+
+        if x_github_event not in self.config.enabled_events:
+            return HandlerError.DisabledEvent
+
+    def backlog(self):
+        '''Number of payloads which have been accepted, but not yet passed to the handlers.'''
+
+        if self.pool:
+            return self.pool.pending()
+
+        backlog = self.scheduler.total
+        if self.journal:
+            backlog += self.journal.pending.qsize()
+        return backlog
+
+    def is_overloaded(self):
+        '''Whether the backlog is too long to accept any more payloads.'''
+
+        return self.backlog() >= self.max_backlog
+
+    def is_redelivery(self, delivery_id):
+        '''
+        Check whether we've already accepted a payload with the given 'X-GitHub-Delivery' ID.
+        The ID is remembered only when the payload is accepted (see `accept_delivery`).
+        '''
+
+        if not delivery_id:
+            return False
+
+        if self.deliveries.seen(delivery_id):
+            self.logger.info('Dropping redelivery %s', delivery_id)
+            return True
+        return False
+
+    def accept_delivery(self, delivery_id):
+        '''
+        Remember the 'X-GitHub-Delivery' ID of a payload once it's been journaled (or handled).
+        This should be called only for verified payloads, so that the unverified ones can't
+        mark the IDs as seen.
+        '''
+
+        if delivery_id:
+            self.deliveries.commit(delivery_id)
+
+    def queue_payload(self, x_github_event, raw_payload):
+        '''
+        Append a (verified) raw payload to the journal. The daemon decodes and handles it later.
+        Returns the entry's sequence number in the journal.
+        '''
+
+        seq = self.journal.append(x_github_event, raw_payload)
+        self.scheduler.notify()
+        return seq
+
+    def _installation_from_raw(self, raw_payload):
+        try:
+            return json.loads(raw_payload)['installation']['id']
+        except Exception:
+            return None
+
+    def _consume_journal(self):
+        '''Decode the pending journal entries and pass them over to the managers.'''
+
+        while not self.journal.pending.empty():
+            seq, event, raw_payload = self.journal.pending.get()
+            try:
+                payload = json.loads(raw_payload)
+                inst_id = payload['installation']['id']
+            except Exception as err:
+                self.logger.error('Cannot decode journal entry %s: %s', seq, err)
+                self.journal.ack(None, seq)
+                continue
+
+            self.journal.track(inst_id, seq)
+            # Rejected payloads won't reach the managers - ack them right away.
+            if self.handle_payload(event, payload, seq=seq) is not None:
+                self.journal.ack(inst_id, seq)
+
+    def handle_payload(self, x_github_event, payload, seq=None):
         '''
         Check (and filter) the incoming payloads, initialize managers (if required),
         hook them with the API provider, and finally push them into the managers' queue.
+
+        `seq` is the payload's sequence number in the journal (if it came from one), so that
+        the manager can ack it once it's been handled.
         '''
 
         inst_id = payload['installation']['id']
@@ -99,22 +281,25 @@ class Runner(object):
             self.logger.info('Ignoring installation event.')
             return HandlerError.NewInstallation
 
-        manager = self.installations.get(inst_id)
-        # If the installation doesn't exist, create a new manager for it.
-        if manager is None:
-            store = InstallationStore(self.store, inst_id)
-            manager = InstallationManager(self.config, inst_id, store)
-            self.installations[inst_id] = manager
+        # Only accept payloads from registered repositories. This is checked before creating
+        # the manager, so that rejected repos don't affect the installation.
+        repository = payload.get('repository') or {}
+        repo = '%s/%s' % (repository.get('owner', {}).get('login'), repository.get('name'))
+        if not self.router.matches(repo):
+            self.logger.info('Rejected payload from %s' % repo)
+            return HandlerError.UnregisteredRepo
+
+        # The worker owning this installation takes care of the rest.
+        if self.pool:
+            self.pool.dispatch(inst_id, x_github_event, payload, seq)
+            return
+
+        # If the installation doesn't exist (or if it's been evicted), create a new manager for it.
+        manager = self.installations.get_or_create(inst_id)
 
         # Create an API provider for the payload
         api = manager.create_api_provider_for_payload(payload)
 
-        # Only accept payloads from registered repositories.
-        if not any(re.search(pat, '%s/%s' % (api.owner, api.repo)) for pat in self.config.allowed_repos):
-            self.logger.info('Rejected payload from %s/%s' % (api.owner, api.repo))
-            self.installations.pop(inst_id)
-            return HandlerError.UnregisteredRepo
-
         # If our handlers don't care about this event, then ignore this payload.
         if x_github_event not in self.config.enabled_events:
             self.logger.info("Payload doesn't match any enabled events. Skipping...")
@@ -126,31 +311,174 @@ class Runner(object):
             return HandlerError.PayloadFromSelf
 
         # Queue the API with the payload into the manager's queue
-        manager.queue.put((api, x_github_event))
+        manager.queue.put((api, x_github_event, seq))
+
+    def _timed_handlers(self):
+        return [name for event in self.config.enabled_events
+                for name in event_handlers.get_timed_handlers(event)]
+
+    def _create_manager(self, inst_id):
+        store = InstallationStore(self.store, inst_id)
+        manager = InstallationManager(self.config, inst_id, store, journal=self.journal,
+                                      scheduler=self.scheduler, timers=self.timers,
+                                      cache=self.cache, app_auth=self.app_auth,
+                                      refresher=self.refresher)
+        self.timers.load(inst_id, store if self.store else None, self._timed_handlers())
+        return manager
+
+    def _load_timers(self, owns=lambda inst_id: True):
+        '''
+        Load the persisted timers of the installations in the store, so that they're ticked even
+        before their next payload (the managers are created once their timers are due).
+        '''
+
+        if self.store is None:
+            return
+
+        handlers = self._timed_handlers()
+        for inst_id in self.store.get_installations():
+            if owns(inst_id):
+                self.timers.load(inst_id, InstallationStore(self.store, inst_id), handlers)
+
+    def _evict_idle(self):
+        for inst_id in self.installations.evict_idle():
+            self.scheduler.forget(inst_id)
+        SESSIONS.evict_idle()
 
     def _start_watching(self):
         '''
-        Refresh the managers' queue every second. This is ran by the daemon thread.
-        The actual heavy-lifting is done by the daemon since the payloads are actually
-        passed to the handlers only by this point.
+        Pass the queued payloads to the managers, and produce ticks every second. This is ran
+        by the daemon thread. The actual heavy-lifting is done by the daemon since the payloads
+        are actually passed to the handlers only by this point.
         '''
 
+        next_tick = next_stats = time.time()
         while True:
-            # Clear actual payload queue
-            for manager in self.installations.itervalues():
-                manager.clear_queue()
+            if self.journal and not self.inbox:
+                self._consume_journal()
+
+            if self.inbox:
+                self._consume_inbox()
+
+            now = time.time()
+            if now >= next_stats:
+                self._log_stats()
+                self._evict_idle()
+                next_stats = now + STATS_INTERVAL_SECS
+
+            # Managers live in the workers - check on them.
+            if self.pool:
+                self.pool.supervise()
+                self.scheduler.wait(WORKER_SLEEP_SECS)
+                continue
+
+            self._dispatch_scheduled()
+
+            now = time.time()
+            if now >= next_tick:
+                self._produce_ticks(now)
+                self.timers.flush()
+                next_tick = now + WORKER_SLEEP_SECS
+
+            # Sleep until something's queued (or some handler finishes)
+            self.scheduler.wait(max(0, next_tick - time.time()))
+
+    def _log_stats(self):
+        if self.inbox is None:
+            self.logger.info('Redeliveries: %s', self.deliveries.stats())
+            self.deliveries.save()
+        if self.pool is None:
+            self.logger.info('Scheduler wait times: %s', self.scheduler.wait_times())
+            self.logger.info('Dropped payloads: %s', self.scheduler.dropped_counts())
+            self.logger.info('Queue depths: %s', self.scheduler.depths())
+            usage = self.installations.memory_usage()
+            self.logger.info('%s installation(s) in memory, using about %s bytes: %s',
+                             len(usage), sum(usage.values()), usage)
+            self.logger.info('Connection pool: %s', SESSIONS.stats())
+            self.logger.info('Response cache: %s', self.cache.stats())
+            self.logger.info('Response bodies: %s', BODY_STATS.stats())
+
+    def _on_drop(self, inst_id, item):
+        api, x_github_event, seq = item
+        self.logger.debug('Dropped payload for %s #%s (event: %s, action: %s)', inst_id,
+                          api.number, x_github_event, api.payload.get('action'))
+        self.installations.get_or_create(inst_id).ack(seq)
+
+    def _dispatch_scheduled(self):
+        '''
+        Pass the payloads to the managers in the order decided by the scheduler, for as long as
+        the managers can take them.
+        '''
+
+        def has_capacity(inst_id):
+            manager = self.installations.get(inst_id)
+            return manager is None or manager.has_capacity()
+
+        while True:
+            next_item = self.scheduler.pop(has_capacity)
+            if next_item is None:
+                break
+            inst_id, item = next_item
+            self.installations.get_or_create(inst_id).dispatch(*item)
 
-            # Produce 'tick' event for handlers that depend on time.
-            for manager in self.installations.itervalues():
-                api = manager.create_api_provider_for_payload({ 'action': '__tick' })
-                manager.queue.put(api)
+    def _produce_ticks(self, now):
+        '''
+        Produce 'tick' event for the handlers whose timers are due. The tick carries the keys of
+        the due timers for each of those handlers.
+        '''
+
+        for inst_id, due in self.timers.pop_due(now).iteritems():
+            # Evicted (or not yet seen) installations are brought back for their timers.
+            manager = self.installations.get_or_create(inst_id)
+            for event in self.config.enabled_events:
+                timers = dict((name, due[name]) for name in
+                              event_handlers.get_timed_handlers(event) if name in due)
+                if timers:
+                    payload = { 'action': '__tick', 'timers': timers }
+                    api = manager.create_api_provider_for_payload(payload)
+                    manager.queue.put((api, event, None))
 
-            # Sleep for a bit
-            sleep(WORKER_SLEEP_SECS)
+    def _consume_inbox(self):
+        '''Pass the payloads sent by the parent process over to the managers.'''
+
+        while True:
+            try:
+                inst_id, x_github_event, payload, token = self.inbox.get_nowait()
+            except Empty:
+                break
 
+            # Rejected payloads won't reach the managers - ack them right away.
+            if self.handle_payload(x_github_event, payload, seq=token) is not None:
+                self.journal.ack(inst_id, token)
+
+    def _run_shard(self, shard):
+        '''
+        Run the watcher of a worker process, which owns the managers of the installations
+        belonging to its shard.
+        '''
+
+        processes = self.config['worker_processes']
+        self.cache = self._create_cache(shard)
+        self._load_timers(lambda inst_id: shard_for(inst_id, processes) == shard)
+        self._start_watching()
+
+    def shutdown(self):
+        '''Stop the background renewal of the tokens, and close the managers (and their threads).'''
+
+        self.refresher.stop()
+        self.installations.clear()
 
     def start_daemon(self):
-        '''Launch the watcher in a daemon thread.'''
+        '''Launch the watcher in a daemon thread (and the worker processes, if any).'''
+
+        if self.journal:
+            # Queue the entries which weren't handled before the last shutdown.
+            self.journal.replay(self._installation_from_raw)
+
+        if self.pool:
+            self.pool.start()
+        else:
+            self._load_timers()
 
         self.logger.info('Spawning a new thread for handling payloads...')
         thread = Thread(target=self._start_watching)
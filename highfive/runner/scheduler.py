@@ -0,0 +1,307 @@
+from collections import deque
+from threading import Condition
+
+import time
+
+# Priority classes (in the order in which they're served)
+COMMAND, LIFECYCLE, TIMER = range(3)
+CLASS_NAMES = ['command', 'lifecycle', 'timer']
+# Number of payloads an installation can take in its turn (before we move to the next one).
+QUANTUM = 4
+# Maximum number of pending payloads for an installation (before we start shedding them).
+QUEUE_LIMIT = 1000
+
+
+def classify(x_github_event, payload):
+    '''
+    Get the priority class of a payload. Comments are human-triggered (and people are waiting for
+    a response), so they go first. Then the usual issue/PR lifecycle events, and finally the
+    time-based work.
+    '''
+
+    if payload.get('action') == '__tick':
+        return TIMER
+    if x_github_event == 'issue_comment':
+        return COMMAND
+    return LIFECYCLE
+
+
+def issue_key(api):
+    '''
+    Key of the issue/PR of a payload (or `None` if it's not related to one). An installation
+    can cover several repos, so the numbers are qualified by the repo.
+    '''
+
+    if api.number is None:
+        return None
+    return (api.owner, api.repo, api.number)
+
+
+class _Entry(object):
+    __slots__ = ['key', 'item', 'klass', 'time', 'done']
+
+    def __init__(self, key, item, klass):
+        self.key = key
+        self.item = item
+        self.klass = klass
+        self.time = time.time()
+        self.done = False
+
+
+class _InstallationState(object):
+    def __init__(self):
+        self.classes = [deque() for _ in CLASS_NAMES]
+        self.by_key = {}
+        self.size = 0
+        self.deficit = 0
+
+
+class InstallationQueue(object):
+    '''Queue-like view of an installation's payloads in the scheduler.'''
+
+    def __init__(self, scheduler, inst_id):
+        self.scheduler = scheduler
+        self.inst_id = inst_id
+
+    def put(self, item):
+        self.scheduler.put(self.inst_id, item)
+
+    def get(self):
+        return self.scheduler.pop_from(self.inst_id)
+
+    def qsize(self):
+        return self.scheduler.size_of(self.inst_id)
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+class Scheduler(object):
+    '''
+    Scheduler for the payloads of all installations. Installations are served in deficit round
+    robin - every installation with pending payloads gets to dispatch `quantum` payloads in its turn,
+    so that an installation with a huge backlog can't starve the others.
+
+    Within an installation, payloads are served by their priority class. Payloads for the same
+    issue/PR are never reordered though - if a payload has an older (lower priority) payload for
+    the same issue/PR, then the older one is served first.
+
+    If `coalesce` is given, then it's called with the last pending item for an issue/PR (or the
+    pending tick for the same event) and the new item. It returns 'supersede' if the earlier item
+    should be dropped, 'cancel' if both should be dropped, or `None`.
+
+    Once an installation has more than `limit` pending payloads, the newest lifecycle payloads are
+    shed. Commands are never shed (and ticks don't pile up, since they're coalesced). Collapsed
+    and shed items are passed to `on_drop` along with their installation.
+
+    Items are the usual `(api, event, seq)` tuples from the managers' queues.
+    '''
+
+    def __init__(self, quantum=QUANTUM, coalesce=None, on_drop=None, limit=QUEUE_LIMIT):
+        self.quantum = quantum
+        self.coalesce = coalesce
+        self.on_drop = on_drop
+        self.limit = limit
+        self.condition = Condition()
+        self.states = {}
+        self.active = deque()
+        # Number of pending payloads (for all installations)
+        self.total = 0
+        # Whether something has happened since the last wait
+        self.changed = False
+        # Number of payloads served, total and maximum wait time for each class
+        self.waits = [[0, 0.0, 0.0] for _ in CLASS_NAMES]
+        # Number of collapsed and shed payloads for each (event, action)
+        self.collapsed = {}
+        self.shed = {}
+
+    def queue_for(self, inst_id):
+        return InstallationQueue(self, inst_id)
+
+    def _discard(self, state, entry):
+        entry.done = True
+        pending = state.by_key[entry.key]
+        pending.remove(entry)
+        if not pending:
+            state.by_key.pop(entry.key)
+        state.size -= 1
+        self.total -= 1
+
+    def _count(self, counts, items):
+        for api, x_github_event, _seq in items:
+            key = (x_github_event, api.payload.get('action'))
+            counts[key] = counts.get(key, 0) + 1
+
+    def put(self, inst_id, item):
+        api, x_github_event, _seq = item
+        entry = _Entry(issue_key(api), item, classify(x_github_event, api.payload))
+        collapsed, shed = [], []
+        with self.condition:
+            state = self.states.get(inst_id)
+            if state is None:
+                state = self.states[inst_id] = _InstallationState()
+            was_active = state.size > 0
+
+            earlier = None
+            if entry.klass == TIMER:
+                ticks = filter(lambda e: not e.done and e.item[1] == x_github_event,
+                               state.classes[TIMER])
+                earlier = ticks[-1] if ticks else None
+            elif entry.key is not None and entry.key in state.by_key:
+                earlier = state.by_key[entry.key][-1]
+
+            rule = self.coalesce(earlier.item, item) if earlier and self.coalesce else None
+            if rule is not None:
+                self._discard(state, earlier)
+                collapsed.append(earlier.item)
+                if rule == 'cancel':
+                    collapsed.append(item)
+                    entry = None
+
+            if entry is not None:
+                state.classes[entry.klass].append(entry)
+                state.by_key.setdefault(entry.key, deque()).append(entry)
+                state.size += 1
+                self.total += 1
+
+            # Shed the newest lifecycle payloads if we're over the limit.
+            lifecycle = state.classes[LIFECYCLE]
+            while state.size > self.limit and lifecycle:
+                victim = lifecycle.pop()
+                if not victim.done:
+                    self._discard(state, victim)
+                    shed.append(victim.item)
+
+            if state.size > 0 and not was_active:
+                self.active.append(inst_id)
+            elif state.size == 0 and was_active:
+                self.active.remove(inst_id)
+                state.deficit = 0
+
+            self._count(self.collapsed, collapsed)
+            self._count(self.shed, shed)
+            self.changed = True
+            self.condition.notify_all()
+
+        if self.on_drop:
+            for dropped_item in collapsed + shed:
+                self.on_drop(inst_id, dropped_item)
+
+    def forget(self, inst_id):
+        '''Drop the state of an installation (if it doesn't have any pending payloads).'''
+
+        with self.condition:
+            state = self.states.get(inst_id)
+            if state is not None and state.size == 0:
+                self.states.pop(inst_id)
+
+    def size_of(self, inst_id):
+        with self.condition:
+            state = self.states.get(inst_id)
+            return state.size if state else 0
+
+    def _pop_entry(self, state):
+        head = None
+        for entries in state.classes:
+            while entries and entries[0].done:
+                entries.popleft()
+            if entries:
+                head = entries[0]
+                break
+
+        if head is None:
+            return None
+
+        # Serve the oldest payload for this issue/PR (which could be the head itself).
+        pending = state.by_key[head.key]
+        entry = pending.popleft()
+        if not pending:
+            state.by_key.pop(head.key)
+
+        entry.done = True
+        state.size -= 1
+        self.total -= 1
+        waited = time.time() - entry.time
+        stats = self.waits[entry.klass]
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        return entry.item
+
+    def pop_from(self, inst_id):
+        '''Get the next payload of an installation (regardless of the other installations).'''
+
+        with self.condition:
+            state = self.states.get(inst_id)
+            item = self._pop_entry(state) if state else None
+            if item is not None and state.size == 0:
+                self.active.remove(inst_id)
+                state.deficit = 0
+            return item
+
+    def pop(self, has_capacity=lambda inst_id: True):
+        '''
+        Get the next `(inst_id, item)` pair to be dispatched (or `None` if there's nothing
+        to dispatch). Installations which can't take any more payloads right now (as reported
+        by `has_capacity`) are skipped, and they retain their deficit.
+        '''
+
+        with self.condition:
+            for _ in range(len(self.active)):
+                inst_id = self.active[0]
+                state = self.states[inst_id]
+                if not has_capacity(inst_id):
+                    self.active.rotate(-1)
+                    continue
+
+                if state.deficit <= 0:      # new turn for this installation
+                    state.deficit += self.quantum
+
+                item = self._pop_entry(state)
+                state.deficit -= 1
+                if state.size == 0:
+                    self.active.popleft()
+                    state.deficit = 0
+                elif state.deficit <= 0:
+                    self.active.rotate(-1)
+
+                return inst_id, item
+
+    def notify(self):
+        '''Wake up the thread waiting on the scheduler.'''
+
+        with self.condition:
+            self.changed = True
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        '''Wait for new payloads (or a notification), unless something's happened already.'''
+
+        with self.condition:
+            if not self.changed:
+                self.condition.wait(timeout)
+            self.changed = False
+
+    def depths(self):
+        '''Get the number of pending payloads for each installation (which has some).'''
+
+        with self.condition:
+            return dict((inst_id, state.size) for inst_id, state in self.states.iteritems()
+                        if state.size)
+
+    def dropped_counts(self):
+        '''Get the number of collapsed and shed payloads for each "event.action".'''
+
+        with self.condition:
+            return dict((name, dict(('%s.%s' % key, count) for key, count in counts.iteritems()))
+                        for name, counts in [('collapsed', self.collapsed), ('shed', self.shed)])
+
+    def wait_times(self):
+        '''Get the number of payloads served, and the mean and maximum wait times for each class.'''
+
+        with self.condition:
+            return dict((CLASS_NAMES[klass], {
+                'count': count,
+                'mean': total / count if count else 0.0,
+                'max': max_wait,
+            }) for klass, (count, total, max_wait) in enumerate(self.waits))
@@ -0,0 +1,66 @@
+from threading import Event, Lock
+
+import sys
+
+
+class _Call(object):
+    __slots__ = ['done', 'waiters', 'result', 'error']
+
+    def __init__(self):
+        self.done = Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    Makes sure that there's only one call in flight for a key. Callers who come in while a call
+    for the same key is in flight wait for it, and get its result (or its error) instead of
+    making the call again.
+
+    If `copy` is given, then it's used to give everyone their own copy of a shared result (so
+    that they don't see each other's changes).
+    '''
+
+    def __init__(self, copy=None):
+        self.copy = copy
+        self.lock = Lock()
+        self.calls = {}
+        # Number of callers who got the result of someone else's call
+        self.shared = 0
+
+    def do(self, key, func):
+        '''Call `func` (unless there's a call in flight for `key`). Returns `(result, shared)`.'''
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                exc_type, exc_value, traceback = call.error
+                raise exc_type, exc_value, traceback
+            return (self.copy(call.result) if self.copy else call.result), True
+
+        try:
+            call.result = func()
+        except Exception:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key)
+            call.done.set()
+
+        # Nobody can join the call now. If someone did, then the original is left for them to
+        # copy from (and the leader gets a copy too).
+        if call.waiters and self.copy:
+            return self.copy(call.result), False
+        return call.result, False
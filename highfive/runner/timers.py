@@ -0,0 +1,170 @@
+from threading import Lock
+
+import calendar
+import heapq
+import time
+
+# Store key for the persisted timers of an installation
+TIMERS_KEY = '__timers__'
+# Timer key which asks for the handler to go through all of its data (instead of some keys).
+SCAN_KEY = '__scan__'
+
+
+def to_timestamp(deadline):
+    '''Convert a datetime (naive ones are assumed to be local) to a UNIX timestamp.'''
+
+    if isinstance(deadline, (int, float)):
+        return float(deadline)
+    if deadline.tzinfo is not None:
+        return calendar.timegm(deadline.utctimetuple()) + deadline.microsecond / 1e6
+    return time.mktime(deadline.timetuple()) + deadline.microsecond / 1e6
+
+
+class InstallationTimers(object):
+    '''View of an installation's timers in the timer service (exposed to the handlers).'''
+
+    def __init__(self, service, inst_id):
+        self.service = service
+        self.inst_id = inst_id
+
+    def schedule(self, handler, key, deadline):
+        self.service.schedule(self.inst_id, handler, key, deadline)
+
+    def cancel(self, handler, key):
+        self.service.cancel(self.inst_id, handler, key)
+
+
+class TimerService(object):
+    '''
+    Wake-up deadlines registered by the handlers (say, "PR #42 needs attention tomorrow") for all
+    installations. The deadlines are kept in a heap, so that finding the due timers only costs as
+    much as the number of due timers. Rescheduled (or cancelled) timers are left in the heap, and
+    they're skipped when they come up (the heap is rebuilt once they outnumber the live timers,
+    since the handlers reschedule their long-term timers all the time).
+
+    The timers of an installation are persisted in its store (by `flush`), and loaded when its
+    manager is created. Handlers which haven't registered any timers yet (say, because they've
+    just been introduced) are woken up right away, so that they can go through their data and
+    register their timers.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.heap = []
+        # Number of entries in the heap which are stale (rescheduled or cancelled)
+        self.stale = 0
+        # inst_id -> {handler: {key: deadline}}
+        self.timers = {}
+        self.stores = {}
+        # Installations whose timers have changed since the last flush
+        self.dirty = set()
+        # Handlers which should go through all their data - (inst_id, handler)
+        self.pending_scans = set()
+
+    def view(self, inst_id):
+        return InstallationTimers(self, inst_id)
+
+    def load(self, inst_id, store, handlers):
+        '''
+        Load the persisted timers of an installation, given the handlers which use timers.
+        This does nothing if the installation's timers have already been loaded.
+        '''
+
+        with self.lock:
+            if inst_id in self.stores:
+                return
+
+        data = store.get_object(TIMERS_KEY) if store else {}
+        with self.lock:
+            self.stores[inst_id] = store
+            timers = self.timers[inst_id] = data.get('handlers', {})
+            for handler in handlers:
+                if handler not in timers:
+                    timers[handler] = {}
+                    self.pending_scans.add((inst_id, handler))
+                    self.dirty.add(inst_id)
+
+            for handler, deadlines in timers.iteritems():
+                for key, deadline in deadlines.iteritems():
+                    heapq.heappush(self.heap, (deadline, inst_id, handler, key))
+
+    def schedule(self, inst_id, handler, key, deadline):
+        deadline = to_timestamp(deadline)
+        with self.lock:
+            deadlines = self.timers.setdefault(inst_id, {}).setdefault(handler, {})
+            if deadlines.get(key) == deadline:
+                return
+            if key in deadlines:
+                self.stale += 1
+            deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, inst_id, handler, key))
+            self.dirty.add(inst_id)
+            self._compact()
+
+    def cancel(self, inst_id, handler, key):
+        with self.lock:
+            deadlines = self.timers.get(inst_id, {}).get(handler, {})
+            if deadlines.pop(key, None) is not None:
+                self.stale += 1
+                self.dirty.add(inst_id)
+                self._compact()
+
+    def _compact(self):
+        '''Rebuild the heap from the live timers, if the stale entries outnumber them.'''
+
+        if self.stale <= len(self.heap) - self.stale:
+            return
+        self.heap = [(deadline, inst_id, handler, key)
+                     for inst_id, timers in self.timers.iteritems()
+                     for handler, deadlines in timers.iteritems()
+                     for key, deadline in deadlines.iteritems()]
+        heapq.heapify(self.heap)
+        self.stale = 0
+
+    def pop_due(self, now=None):
+        '''
+        Remove the timers which are due, and get them as `{inst_id: {handler: keys}}`. `keys` is
+        `None` for the handlers which should go through all their data (including the ones whose
+        `SCAN_KEY` is due).
+        '''
+
+        now = time.time() if now is None else now
+        due = {}
+        with self.lock:
+            for inst_id, handler in self.pending_scans:
+                due.setdefault(inst_id, {})[handler] = None
+            self.pending_scans.clear()
+
+            while self.heap and self.heap[0][0] <= now:
+                deadline, inst_id, handler, key = heapq.heappop(self.heap)
+                deadlines = self.timers.get(inst_id, {}).get(handler, {})
+                if deadlines.get(key) != deadline:      # stale entry
+                    self.stale -= 1
+                    continue
+
+                deadlines.pop(key)
+                self.dirty.add(inst_id)
+                if key == SCAN_KEY:
+                    due.setdefault(inst_id, {})[handler] = None
+                    continue
+                keys = due.setdefault(inst_id, {}).setdefault(handler, [])
+                if keys is not None:
+                    keys.append(key)
+
+        return due
+
+    def flush(self):
+        '''Persist the timers of the installations which have changed.'''
+
+        with self.lock:
+            # Copy the timers, so that they can be written outside the lock.
+            dirty = []
+            for inst_id in self.dirty:
+                timers = self.timers.get(inst_id, {})
+                copy = dict((handler, dict(deadlines)) for handler, deadlines in timers.iteritems())
+                dirty.append((self.stores.get(inst_id), copy))
+            self.dirty.clear()
+
+        for store, timers in dirty:
+            if store is not None:
+                store.write_object(TIMERS_KEY, {'handlers': timers})
@@ -0,0 +1,126 @@
+from config import get_logger
+from jose import jwt
+from threading import Condition, Lock, Thread, current_thread
+
+import heapq
+import time
+
+# Lifetime (in seconds) of the JWT we sign (Github allows 10 minutes at most).
+JWT_LIFETIME_SECS = 10 * 60
+# A JWT isn't handed out once it's this close (in seconds) to its expiry.
+JWT_MARGIN_SECS = 60
+# Installation tokens are renewed this long (in seconds) before they expire.
+REFRESH_MARGIN_SECS = 5 * 60
+# Delay (in seconds) before trying again, when a renewal fails.
+REFRESH_RETRY_SECS = 30
+
+
+class AppAuth(object):
+    '''
+    Signs the JWTs for authenticating as the app (which we need for getting the installation
+    tokens). A JWT is reused (by all the installations) for as long as it's valid, so that we
+    don't have to go through the RS256 signature for every token.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = Lock()
+        self.token = None
+        self.expires_at = 0
+
+    def get_jwt(self, now=None):
+        now = int(time.time() if now is None else now)
+        with self.lock:
+            if now < self.expires_at - JWT_MARGIN_SECS:
+                return self.token
+
+            # https://developer.github.com/apps/building-github-apps/authentication-options-for-github-apps/
+            payload = {
+                'iat': now,
+                'exp': now + JWT_LIFETIME_SECS,
+                'iss': self.config.integration_id,
+            }
+            self.token = jwt.encode(payload, self.config.pem_key, 'RS256')
+            self.expires_at = payload['exp']
+            return self.token
+
+
+class TokenRefresher(object):
+    '''
+    Background thread which renews the installation tokens `margin` seconds before they expire,
+    so that the handlers' requests don't have to wait for them. The thread is spawned when the
+    first renewal is scheduled, and it runs until the refresher is stopped.
+    '''
+
+    def __init__(self, margin=REFRESH_MARGIN_SECS):
+        self.logger = get_logger(__name__)
+        self.margin = margin
+        self.condition = Condition()
+        self.heap = []
+        # inst_id -> (manager, time of renewal)
+        self.managers = {}
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, manager, expires_at):
+        '''Schedule the renewal of a manager's token, given its expiry (as a UNIX timestamp).'''
+
+        self.schedule_at(manager, expires_at - self.margin)
+
+    def schedule_at(self, manager, when):
+        inst_id = manager.installation_id
+        with self.condition:
+            self.managers[inst_id] = (manager, when)
+            heapq.heappush(self.heap, (when, inst_id))
+            if self.thread is None and not self.stopped:
+                self.thread = Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def stop(self):
+        '''Stop the background thread (the pending renewals aren't made after this).'''
+
+        with self.condition:
+            self.stopped = True
+            thread = self.thread
+            self.condition.notify_all()
+
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def cancel(self, inst_id):
+        with self.condition:
+            self.managers.pop(inst_id, None)
+
+    def pop_due(self, now=None):
+        '''Get the managers whose tokens are due for renewal (skipping the cancelled ones).'''
+
+        now = time.time() if now is None else now
+        due = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                when, inst_id = heapq.heappop(self.heap)
+                manager, scheduled = self.managers.get(inst_id, (None, None))
+                if scheduled != when:       # stale entry
+                    continue
+                self.managers.pop(inst_id)
+                due.append(manager)
+        return due
+
+    def _run(self):
+        while True:
+            with self.condition:
+                timeout = self.heap[0][0] - time.time() if self.heap else None
+                if not self.stopped and (timeout is None or timeout > 0):
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+
+            for manager in self.pop_due():
+                try:
+                    manager.refresh_token()
+                except Exception as err:
+                    self.logger.error('Cannot renew the token for installation %s: %s',
+                                      manager.installation_id, err)
+                    self.schedule_at(manager, time.time() + REFRESH_RETRY_SECS)
@@ -0,0 +1,138 @@
+from ..api_provider.contributors import CONTRIBUTORS
+from Queue import Empty
+from collections import OrderedDict
+from config import get_logger
+from multiprocessing import Process, Queue
+from request import BODY_STATS, SESSIONS
+from threading import Lock
+
+import logging
+
+
+def shard_for(inst_id, processes):
+    '''Get the worker (shard) which owns an installation.'''
+
+    return hash(inst_id) % processes
+
+
+def reset_after_fork():
+    '''
+    Reset the process-wide state copied over from the parent. The fork copies the locks as they
+    were at that moment (held by the parent's threads, maybe), and the connections which still
+    belong to the parent.
+    '''
+
+    SESSIONS.reset()
+    BODY_STATS.reset()
+    CONTRIBUTORS.reset()
+    for handler in logging.getLogger().handlers:
+        handler.createLock()
+
+
+def run_worker(runner_class, config, inbox, done, shard):
+    '''
+    Entry point of a worker process. Nothing from the parent's runner is used in the worker - it
+    builds a runner of its own (with its own store, managers, locks and threads).
+    '''
+
+    reset_after_fork()
+    runner = runner_class(config, inbox=inbox, done=done)
+    runner._run_shard(shard)
+
+
+class AckForwarder(object):
+    '''
+    Stands in for the journal in a worker process. The managers in the worker "ack" the payloads
+    as usual, and this forwards those acks to the parent process.
+    '''
+
+    def __init__(self, done):
+        self.done = done
+
+    def ack(self, inst_id, token):
+        self.done.put((inst_id, token))
+
+
+class WorkerPool(object):
+    '''
+    Pool of worker processes, each owning a shard of the installations. An installation is always
+    routed to the same worker (based on the hash of its ID), so that its payloads are handled in
+    order, while a slow installation can't stall the installations in other workers.
+
+    Every dispatched payload is kept around in the parent until the worker acks it. If a worker
+    dies, a new one is spawned in its place, and its un-acked payloads are queued again.
+    '''
+
+    def __init__(self, runner, processes):
+        self.logger = get_logger(__name__)
+        self.runner = runner
+        self.processes = processes
+        self.done = Queue()
+        self.lock = Lock()
+        self.next_token = 0
+        self.workers = [None] * processes
+        self.inboxes = [None] * processes
+        # Un-acked payloads for each worker - token -> (item, journal sequence number)
+        self.inflight = [OrderedDict() for _ in range(processes)]
+
+    def shard_for(self, inst_id):
+        return shard_for(inst_id, self.processes)
+
+    def start(self):
+        self.logger.info('Spawning %s worker processes...', self.processes)
+        for shard in range(self.processes):
+            self._spawn(shard)
+
+    def _spawn(self, shard):
+        # New queue for every worker, because a dead worker could've left the old one in a bad state.
+        inbox = Queue()
+        worker = Process(target=run_worker, args=(self.runner.__class__, self.runner.config,
+                                                  inbox, self.done, shard))
+        worker.daemon = True
+        worker.start()
+
+        with self.lock:
+            self.inboxes[shard] = inbox
+            self.workers[shard] = worker
+            for item, _seq in self.inflight[shard].itervalues():
+                inbox.put(item)
+
+    def dispatch(self, inst_id, x_github_event, payload, seq=None):
+        '''
+        Send a payload to the worker owning the installation. `seq` is the payload's sequence number
+        in the journal (if any), which is acked once the worker is done with the payload.
+        '''
+
+        shard = self.shard_for(inst_id)
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            item = (inst_id, x_github_event, payload, token)
+            self.inflight[shard][token] = (item, seq)
+            self.inboxes[shard].put(item)
+
+    def supervise(self):
+        '''Collect the acks from the workers, and replace the workers which have died.'''
+
+        while True:
+            try:
+                inst_id, token = self.done.get_nowait()
+            except Empty:
+                break
+
+            with self.lock:
+                entry = self.inflight[self.shard_for(inst_id)].pop(token, None)
+            if entry is not None and entry[1] is not None and self.runner.journal:
+                self.runner.journal.ack(inst_id, entry[1])
+
+        for shard, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                self.logger.error('Worker %s (pid: %s) exited with code %s. Restarting...',
+                                  shard, worker.pid, worker.exitcode)
+                self._spawn(shard)
+
+    def pending(self):
+        '''Number of payloads which haven't been acked by the workers.'''
+
+        with self.lock:
+            return sum(len(inflight) for inflight in self.inflight)
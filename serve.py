@@ -1,14 +1,16 @@
-from flask import Flask, abort, request
+from flask import Flask, abort, jsonify, request
 
-from highfive import event_handlers
-from highfive.runner.config import init_logger, get_logger
+# The runner has to be imported first (it brings in the handlers along with it).
 from highfive.runner import Configuration, Runner
+from highfive.runner.config import init_logger, get_logger
+from highfive import event_handlers
+from highfive.runner.runner import RETRY_AFTER_SECS
 
 import os
 
-if __name__ == '__main__':
-    init_logger()
-    logger = get_logger(__name__)
+
+def create_runner():
+    '''Load the configuration and the handlers, and create the runner (without starting it).'''
 
     config = Configuration()
     config_path = os.path.join('highfive', 'config.json')
@@ -18,23 +20,80 @@ if __name__ == '__main__':
 
     # Load the handlers into memory
     event_handlers.load_handlers_using(config)
+    return Runner(config)
 
-    # Launch app
-    runner = Runner(config)
-    app = Flask(config.name)
+
+def create_app(runner):
+    '''Create the WSGI app which passes the incoming payloads to the runner.'''
+
+    app = Flask(runner.config.name)
+    app.config['MAX_CONTENT_LENGTH'] = runner.max_payload_bytes
 
     @app.route('/', methods=['POST'])
     def handle_payload():
-        headers, raw_payload = request.headers, request.data
+        # Oversized payloads are rejected before their bodies are read into memory. Bodies without
+        # a length are read only upto the limit (and the runner rejects them if they're over).
+        if request.content_length > runner.max_payload_bytes:
+            abort(413)
+        headers, raw_payload = request.headers, request.stream.read(runner.max_payload_bytes + 1)
         sign = headers['X-Hub-Signature']
+        event = headers['X-GitHub-Event'].lower()
+        delivery_id = headers.get('X-GitHub-Delivery')
+
+        # Drop the payloads we don't care about, before doing anything with their contents.
+        if runner.check_event(event) is not None:
+            return 'Ignored!', 200
+
+        # Push back if we're way behind on the payloads.
+        if runner.is_overloaded():
+            return 'Busy!', 503, {'Retry-After': str(RETRY_AFTER_SECS)}
+
+        # If we have a journal, then the payload is persisted and handled later by the daemon.
+        # Deliveries are remembered only after that (or after they're handled), so that if we
+        # fail, then Github's redelivery isn't dropped.
+        if runner.journal:
+            status = runner.check_raw_payload(sign, raw_payload)
+            if status is not None:
+                abort(status)
+            if runner.is_redelivery(delivery_id):
+                return 'Duplicate!', 200
+            runner.queue_payload(event, raw_payload)
+            runner.accept_delivery(delivery_id)
+            return 'Queued!', 202
+
         status, payload = runner.verify_payload(sign, raw_payload)
         if status is not None:
             abort(status)
 
-        event = headers['X-GitHub-Event'].lower()
-        runner.handle_payload(payload, event)
+        if runner.is_redelivery(delivery_id):
+            return 'Duplicate!', 200
+        runner.handle_payload(event, payload)
+        runner.accept_delivery(delivery_id)
         return 'Yay!', 200
 
+    @app.route('/queue', methods=['GET'])
+    def show_queue():
+        # The queues of the installations live in the worker processes (if any), so only the
+        # backlog is known here.
+        if runner.pool:
+            return jsonify(backlog=runner.backlog(), installations='unavailable')
+        return jsonify(backlog=runner.backlog(),
+                       installations=runner.scheduler.depths())
+
+    return app
+
+
+if __name__ == '__main__':
+    init_logger()
+    logger = get_logger(__name__)
+
+    # Launch app
+    runner = create_runner()
+    runner.start_daemon()
+    app = create_app(runner)
 
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, threaded=True)
+    try:
+        app.run(host='0.0.0.0', port=port, threaded=True)
+    finally:
+        runner.shutdown()
@@ -0,0 +1,39 @@
+# Make the sockets (and threads) cooperative before anything else gets imported, so that the
+# requests to Github (and the daemon) yield to the other greenlets instead of blocking.
+from gevent import monkey
+monkey.patch_all()
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from highfive.runner.config import init_logger, get_logger
+from serve import create_app, create_runner
+
+import os
+import sys
+
+# Maximum number of connections served concurrently
+MAX_CONNECTIONS = 10000
+
+if __name__ == '__main__':
+    init_logger()
+    logger = get_logger(__name__)
+
+    runner = create_runner()
+    # Worker processes are forked with the patched threads and sockets (and their queues' feeder
+    # threads become greenlets), which isn't supported by gevent and could deadlock.
+    if runner.pool is not None:
+        logger.error("`worker_processes` can't be used with serve_async.py (use serve.py instead)")
+        sys.exit(1)
+
+    runner.start_daemon()
+    app = create_app(runner)
+
+    port = int(os.environ.get('PORT', 5000))
+    pool = Pool(runner.config['max_connections'] or MAX_CONNECTIONS)
+    server = WSGIServer(('0.0.0.0', port), app, spawn=pool)
+    logger.info('Serving on port %s...', port)
+    try:
+        server.serve_forever()
+    finally:
+        runner.shutdown()
@@ -13,18 +13,48 @@ if __name__ == '__main__':
     test_suite = TestSuite()
 
     from api_provider_tests import APIProviderTests
+    from cache_tests import ResponseCacheTests
     from config_tests import ConfigurationTests
+    from deliveries_tests import DeliveryFilterTests
+    from dispatcher_tests import DispatcherTests
     from event_handler_tests import EventHandlerTests
+    from graphql_tests import GraphQLTests
     from installation_manager_tests import InstallationManagerTests
+    from journal_tests import JournalTests
     from json_store_tests import JsonStoreTests
+    from ratelimit_tests import RateLimiterTests
+    from registry_tests import InstallationRegistryTests
+    from request_tests import SessionPoolTests
+    from retry_tests import RetryTests
+    from routing_tests import RoutingTests
     from runner_tests import RunnerTests
+    from scheduler_tests import SchedulerTests
+    from singleflight_tests import SingleFlightTests
+    from timers_tests import TimerServiceTests
+    from tokens_tests import TokenTests
+    from workers_tests import WorkerPoolTests
 
     test_suite.addTests(unittest.makeSuite(APIProviderTests))
+    test_suite.addTests(unittest.makeSuite(ResponseCacheTests))
     test_suite.addTests(unittest.makeSuite(ConfigurationTests))
+    test_suite.addTests(unittest.makeSuite(DeliveryFilterTests))
+    test_suite.addTests(unittest.makeSuite(DispatcherTests))
     test_suite.addTests(unittest.makeSuite(EventHandlerTests))
+    test_suite.addTests(unittest.makeSuite(GraphQLTests))
     test_suite.addTests(unittest.makeSuite(InstallationManagerTests))
+    test_suite.addTests(unittest.makeSuite(JournalTests))
     test_suite.addTests(unittest.makeSuite(JsonStoreTests))
+    test_suite.addTests(unittest.makeSuite(RateLimiterTests))
+    test_suite.addTests(unittest.makeSuite(InstallationRegistryTests))
+    test_suite.addTests(unittest.makeSuite(SessionPoolTests))
+    test_suite.addTests(unittest.makeSuite(RetryTests))
+    test_suite.addTests(unittest.makeSuite(RoutingTests))
     test_suite.addTests(unittest.makeSuite(RunnerTests))
+    test_suite.addTests(unittest.makeSuite(SchedulerTests))
+    test_suite.addTests(unittest.makeSuite(SingleFlightTests))
+    test_suite.addTests(unittest.makeSuite(TimerServiceTests))
+    test_suite.addTests(unittest.makeSuite(TokenTests))
+    test_suite.addTests(unittest.makeSuite(WorkerPoolTests))
 
     test_runner = TextTestRunner(resultclass=TextTestResult, verbosity=2)
     unittest_result = test_runner.run(test_suite)
@@ -1,11 +1,20 @@
 from highfive.runner import Configuration, Response
-from highfive.api_provider.interface import APIProvider, CONTRIBUTORS_STORE_KEY, DEFAULTS
+from highfive.api_provider.github_api import GithubAPIProvider
+from highfive.api_provider.contributors import (CONTRIBUTORS_UPDATE_INTERVAL_HOURS,
+                                                ContributorRegistry)
+from highfive.api_provider.interface import APIProvider, DEFAULTS
+from highfive.api_provider.interface import iter_lines
+from highfive.api_provider.mutations import combine_comments
+from highfive.event_handlers import EventHandler, Modifier
+from highfive.runner.retry import PermanentError, TransientError
 from handler_tests import TestStore
 
-from datetime import datetime
-from dateutil.parser import parse as datetime_parse
+from datetime import timedelta
+from threading import Event, current_thread
 from unittest import TestCase
 
+import re
+
 
 def create_config():
     config = Configuration()
@@ -157,57 +166,332 @@ class APIProviderTests(TestCase):
 
     def test_contributors_update(self):
         '''
-        Contributors list (cache) live only for an hour (by default). Once it's outdated,
-        the next call to `get_contributors` calls `fetch_contributors`, writes it to the store
-        and returns the list. Any calls within the next hour will return the existing contributors
-        without calling the API.
+        Contributors are shared by all the providers (for a repo). They're fetched in full the
+        first time, and once they're outdated, only the new contributors are fetched. Users who
+        aren't in the list are looked up individually.
         '''
 
         class TestAPI(APIProvider):
-            fetched = False
+            contributor_registry = ContributorRegistry()
+            fetched = []
 
             def fetch_contributors(self):
-                self.fetched = True
-                return []
+                self.fetched.append('all')
+                return ['Foo', 'bar']
+
+            def fetch_new_contributors(self, since):
+                self.fetched.append(since)
+                return ['baz']
+
+            def has_contributed(self, user):
+                self.fetched.append(user)
+                return user == 'quux'
+
+        payload = {'repository': {'owner': {'login': 'foo'}, 'name': 'bar'}}
+        api = TestAPI(config=create_config(), payload=payload)
+        self.assertEqual(api.get_contributors(), frozenset(['foo', 'bar']))
+        api = TestAPI(config=create_config(), payload=payload)
+        self.assertEqual(api.get_contributors(), frozenset(['foo', 'bar']))
+        self.assertEqual(api.fetched, ['all'])
+
+        # Outdated contributors are refreshed with the new ones.
+        contributors = TestAPI.contributor_registry.get('foo/bar')
+        refreshed_at = contributors.refreshed_at
+        contributors.refreshed_at -= timedelta(hours=CONTRIBUTORS_UPDATE_INTERVAL_HOURS)
+        self.assertEqual(api.get_contributors(), frozenset(['foo', 'bar', 'baz']))
+        self.assertEqual(api.fetched[-1], refreshed_at - timedelta(hours=1))
+        self.assertTrue(contributors.refreshed_at >= refreshed_at)
+
+        api.fetched = []
+        self.assertTrue(api.is_contributor('Baz'))
+        self.assertFalse(api.is_contributor('someone'))
+        self.assertTrue(api.is_contributor('quux'))
+        self.assertTrue(api.is_contributor('quux'))
+        self.assertEqual(api.fetched, ['someone', 'quux'])
+
+    def test_parallel_pages(self):
+        '''Once we know the last page, the rest of the pages are fetched in parallel.'''
+
+        class FnScope(object):
+            requests = []
+
+        scope = FnScope()
+        barrier = Event()
+        page_url = 'https://api.github.com/repos/foo/bar/contributors?per_page=100&page=%s'
+
+        def test_request(method, url, data, auth):
+            match = re.search(r'&page=(\d+)', url)
+            page = int(match.group(1)) if match else 1
+            scope.requests.append(page)
+            headers = {}
+            if page == 1:
+                headers['Link'] = '<%s>; rel="next", <%s>; rel="last"' % (page_url % 2,
+                                                                          page_url % 4)
+            elif page == 2:
+                barrier.wait(1)     # the other pages are being fetched meanwhile
+            elif page == 4:
+                barrier.set()
+            return Response(data=[{'login': 'User%s' % page}], headers=headers)
+
+        payload = {'repository': {'owner': {'login': 'foo'}, 'name': 'bar'}}
+        api = GithubAPIProvider(create_config(), payload, None, test_request)
+        self.assertEqual(api.fetch_contributors(), ['user1', 'user2', 'user3', 'user4'])
+        self.assertTrue(barrier.is_set())
+        self.assertEqual(scope.requests[0], 1)
+        self.assertEqual(sorted(scope.requests), [1, 2, 3, 4])
+
+    def test_parallel_calls(self):
+        '''Calls are made concurrently, and their results (or first error) are returned in order.'''
+
+        api = APIProvider(config=create_config(), payload={})
+        barrier = Event()
+
+        def wait():
+            return barrier.wait(1)
+
+        self.assertEqual(api.run_parallel(wait, barrier.set, lambda: 3), [True, None, 3])
+        self.assertEqual(api.run_parallel(), [])
+
+        # Only a few threads are used, however many calls there are.
+        api.max_parallel = 2
+        calls = [lambda: current_thread().ident] * 10
+        self.assertTrue(len(set(api.run_parallel(*calls))) <= 2)
+        self.assertEqual(api.run_parallel(*[lambda i=i: i for i in range(10)]), range(10))
+
+        def fail(msg):
+            raise ValueError(msg)
+
+        try:
+            api.run_parallel(lambda: 1, lambda: fail('foo'), lambda: fail('bar'))
+            self.assertTrue(False)
+        except ValueError as err:
+            self.assertEqual(str(err), 'foo')
+
+    def test_idempotent_mutations(self):
+        '''
+        Comments (and issues) aren't posted again when a handler is retried - whether they've
+        gone through, or their request failed after reaching Github.
+        '''
+
+        class FnScope(object):
+            requests = []
+            posted = []
+            fail = True
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            scope.requests.append(method)
+            if method == 'GET':
+                return Response(data=[{'body': body} for body in scope.posted])
+            scope.posted.append(data['body'])
+            if data['body'] == 'bar' and scope.fail:
+                scope.fail = False
+                raise TransientError(502)
+            return Response(data={'body': data['body']})
+
+        payload = {
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+            'issue': {'number': 1, 'state': 'open', 'labels': [], 'user': {'login': 'foo'}},
+        }
+        api = GithubAPIProvider(create_config(), payload, None, test_request)
+        for _ in range(2):      # handler (and then, its retry)
+            try:
+                api.post_comment('foo')
+                api.post_comment('bar')
+            except TransientError:
+                pass
+
+        self.assertEqual(scope.posted, ['foo', 'bar'])
+        self.assertEqual(scope.requests, ['POST', 'POST', 'GET'])
+
+    def test_retried_random_comments(self):
+        '''Retried handlers make the same random choices, so their comments aren't posted again.'''
+
+        class FnScope(object):
+            posted = []
+            fail = True
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            if method == 'GET':
+                return Response(data=[{'body': body} for body in scope.posted])
+            scope.posted.append(data['body'])
+            return Response(data={'body': data['body']})
+
+        class Handler(EventHandler):
+            def on_issue_open(self):
+                self.api.post_comment(self.api.rand_choice(map(str, range(100))))
+                if scope.fail:      # say, checking the contributors failed
+                    scope.fail = False
+                    raise TransientError(502)
+
+        payload = {
+            'action': 'opened',
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+            'issue': {'number': 1, 'state': 'open', 'labels': [], 'user': {'login': 'foo'}},
+        }
+        api = GithubAPIProvider(create_config(), payload, None, test_request)
+        self.assertRaises(TransientError, Handler(api, {'active': True}).handle_payload)
+        Handler(api, {'active': True}).handle_payload()
+        self.assertEqual(len(scope.posted), 1)
+
+    def test_buffered_mutations(self):
+        '''
+        Label and assignee changes from all the handlers are merged, and made with as few calls
+        as possible (per issue/PR) when they're flushed.
+        '''
+
+        class FnScope(object):
+            requests = []
+            labels = ['a-foo', 'c-baz']
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            scope.requests.append((method, url.split('/repos/foo/bar/issues/')[1], data))
+            if url.endswith('/labels/c-baz'):
+                raise PermanentError(404)
+            if method == 'GET':
+                return Response(data=[{'name': name} for name in scope.labels])
+            return Response(data=[])
+
+        payload = {
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+            'issue': {'number': 1, 'state': 'open', 'labels': [{'name': 'a-foo'}],
+                      'user': {'login': 'foo'}},
+        }
+        api = GithubAPIProvider(create_config(), payload, None, test_request, buffered=True)
+        api.update_labels(add=['S-awaiting-review'], remove=['A-foo'])
+        api.set_assignees(['alice'])
+        api.update_labels(add=['a-foo', 'b-bar'], remove=['c-baz'])
+        api.set_assignees(['bob', 'alice'])
+        with Modifier(api, number='2'):
+            api.update_labels(remove=['a-foo', 'b-bar', 'c-baz'])
+
+        self.assertEqual(scope.requests, [])
+        self.assertEqual(api.labels, ['s-awaiting-review', 'a-foo', 'b-bar'])
+
+        api.flush_mutations()
+        self.assertEqual(scope.requests, [
+            ('POST', '1/labels', ['a-foo', 'b-bar', 's-awaiting-review']),
+            ('DELETE', '1/labels/c-baz', None),
+            ('POST', '1/assignees', {'assignees': ['alice', 'bob']}),
+            # Removing three labels is costlier than replacing them.
+            ('GET', '2/labels', None),
+            ('PUT', '2/labels', []),
+        ])
 
+        scope.requests = []
+        api.flush_mutations()
+        self.assertEqual(scope.requests, [])
+
+        # Unbuffered changes are made right away.
+        api = GithubAPIProvider(create_config(), payload, None, test_request)
+        api.update_labels(remove=['a-foo'])
+        self.assertEqual(scope.requests, [('DELETE', '1/labels/a-foo', None)])
+
+    def test_merged_comments(self):
+        '''
+        If enabled, comments for the payload's issue/PR are combined (in the order of their
+        priority) and posted when the changes are flushed.
+        '''
+
+        class FnScope(object):
+            posted = []
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            scope.posted.append((url.split('/repos/foo/bar/issues/')[1], data['body']))
+            return Response(data={})
+
+        payload = {
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+            'issue': {'number': 1, 'state': 'open', 'labels': [], 'user': {'login': 'foo'}},
+        }
+        config = create_config()
+        config.merge_comments = True
+        api = GithubAPIProvider(config, payload, None, test_request, buffered=True)
+        api.comment_source = (30, True)
+        api.post_warning('foo')
+        api.comment_source = (10, True)
+        api.post_comment('bar')
+        api.post_comment('baz')
+        with Modifier(api, number='2'):
+            api.post_comment('quux')        # some other issue
+        api.comment_source = (20, False)
+        api.post_comment('logs')
+        self.assertEqual(scope.posted, [('2/comments', 'quux'), ('1/comments', 'logs')])
+
+        scope.posted = []
+        api.flush_mutations()
+        self.assertEqual(scope.posted, [
+            ('1/comments', 'bar\n\n---\n\nbaz\n\n---\n\n:warning: **Warning!** :warning:\n\nfoo'),
+        ])
+
+        self.assertEqual(combine_comments([(1, 0, 'a' * 6), (0, 1, 'b' * 4), (1, 2, 'c' * 5)],
+                                          limit=17), [['b' * 4, 'a' * 6], ['c' * 5]])
+
+    def test_comment_index(self):
+        '''
+        Indexed comments are posted once, edited when their content changes, posted again if
+        they've been deleted, and deleted when they're cleared.
+        '''
+
+        class FnScope(object):
+            requests = []
+            deleted = False
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            body = data['body'] if data else None
+            scope.requests.append((method, url.split('/repos/foo/bar/issues/')[1], body))
+            if method == 'PATCH' and scope.deleted:
+                raise PermanentError(404)
+            return Response(data={'id': 5 if scope.deleted else 3, 'body': body})
+
+        payload = {
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+            'issue': {'number': 1, 'state': 'open', 'labels': [], 'user': {'login': 'foo'}},
+        }
+        store = TestStore({})
         config = create_config()
-        api = TestAPI(config=config, payload={}, store=None)
-        self.assertFalse(api.fetched)
-        api.get_contributors()
-        # No store. This will always call the API.
-        self.assertTrue(api.fetched)
-
-        store = TestStore()
-        api = TestAPI(config=config, payload={}, store=store)
-        self.assertFalse(api.fetched)
-        now = datetime.now()
-        api.get_contributors()
-        data = store.get_object(CONTRIBUTORS_STORE_KEY)
-        updated_time = datetime_parse(data['last_update_time'])
-        # Store doesn't have contributors. It's been updated for the first time.
-        self.assertTrue(updated_time >= now)
-        self.assertTrue(api.fetched)
-
-        store = TestStore()
-        store.write_object(CONTRIBUTORS_STORE_KEY,
-                           { 'last_update_time': str(now), 'list': ['booya'] })
-        api = TestAPI(config=config, payload={}, store=store)
-        self.assertFalse(api.fetched)
-        api.get_contributors()
-        data = store.get_object(CONTRIBUTORS_STORE_KEY)
-        updated_time = datetime_parse(data['last_update_time'])
-        # Called within a cycle - no fetch occurs.
-        self.assertEqual(updated_time, now)
-        self.assertFalse(api.fetched)
-
-        store = TestStore()
-        store.write_object(CONTRIBUTORS_STORE_KEY,
-                           { 'last_update_time': str(now), 'list': ['booya'] })
-        api = TestAPI(config=config, payload={}, store=store)
-        self.assertFalse(api.fetched)
-        api.get_contributors(fetch=True)
-        # When `fetch` is enabled, API is called regardless.
-        self.assertTrue(api.fetched)
-        data = store.get_object(CONTRIBUTORS_STORE_KEY)
-        updated_time = datetime_parse(data['last_update_time'])
-        self.assertTrue(updated_time > now)
+        config.merge_comments = True
+        for comment in ['foo', 'foo', u'bar\u2026', u'bar\u2026']:
+            api = GithubAPIProvider(config, payload, store, test_request, buffered=True)
+            api.comment_source = (10, True)
+            api.sync_comment('Checker:warning', comment)
+            api.flush_mutations()
+
+        self.assertEqual(scope.requests, [
+            ('POST', '1/comments', 'foo'),
+            ('PATCH', 'comments/3', u'bar\u2026'),
+        ])
+
+        scope.requests, scope.deleted = [], True
+        api.sync_comment('Checker:warning', 'baz')
+        self.assertEqual(scope.requests, [
+            ('PATCH', 'comments/3', 'baz'),
+            ('POST', '1/comments', 'baz'),
+        ])
+        self.assertEqual(store.stuff['__comments___foo_bar_1']['Checker:warning']['id'], 5)
+
+        # Comments are deleted when they're cleared, and the index is dropped when it's empty.
+        scope.requests = []
+        api.sync_comment('Checker:warning', None)
+        api.sync_comment('Checker:warning', None)
+        self.assertEqual(scope.requests, [('DELETE', 'comments/5', None)])
+        self.assertFalse('__comments___foo_bar_1' in store.stuff)
+
+        api.sync_comment('Checker:warning', 'baz')
+        api.forget_comments()
+        api.forget_comments()
+        self.assertFalse('__comments___foo_bar_1' in store.stuff)
+
+    def test_iter_lines(self):
+        self.assertEqual(list(iter_lines('foo\r\n\nbar\n')), ['foo', '', 'bar'])
+        self.assertEqual(list(iter_lines(u'foo\nbar')), [u'foo', u'bar'])
+        self.assertEqual(list(iter_lines('')), [])
@@ -0,0 +1,62 @@
+from highfive.runner.cache import ResponseCache
+
+from unittest import TestCase
+
+import os
+import shutil
+import tempfile
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_lru_eviction(self):
+        '''The least recently used responses are evicted once the cache is full.'''
+
+        cache = ResponseCache(size=30)
+        cache.put('1 /foo', '"foo"', None, {'foo': 1})      # 10 bytes each
+        cache.put('1 /bar', '"bar"', None, {'bar': 2})
+        cache.put('1 /baz', None, 'Sat, 01 Jan 2000 00:00:00 GMT', {'baz': 3})
+        self.assertEqual(cache.get('1 /foo').data, {'foo': 1})
+
+        cache.put('1 /qux', '"qux"', None, {'qux': 4})
+        self.assertTrue(cache.get('1 /bar') is None)
+        self.assertEqual(cache.get('1 /foo').validators(), {'If-None-Match': '"foo"'})
+        self.assertEqual(cache.get('1 /baz').validators(),
+                         {'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'})
+        self.assertEqual(cache.stats()['bytes'], 30)
+
+        # Callers can't modify the cached data.
+        cache.get('1 /foo').data['foo'] = 2
+        self.assertEqual(cache.get('1 /foo').data, {'foo': 1})
+
+    def test_disk_tier(self):
+        '''Responses evicted from memory (or from an earlier run) are loaded from disk.'''
+
+        cache = ResponseCache(size=10, path=self.dir)
+        cache.put('1 /foo', '"foo"', None, {'foo': 1})
+        cache.put('1 /bar', '"bar"', None, {'bar': 2})
+        self.assertEqual(cache.stats()['cached'], 1)
+        self.assertEqual(cache.get('1 /foo').data, {'foo': 1})
+
+        cache = ResponseCache(size=10, path=self.dir)
+        self.assertEqual(cache.get('1 /bar').etag, '"bar"')
+        self.assertTrue(cache.get('2 /bar') is None)
+
+        # Only the headers we need later are cached (along with the body).
+        cache.put('1 /baz', '"baz"', None, [], {'Link': '<foo>; rel="next"', 'Server': 'GitHub'})
+        cache = ResponseCache(size=10, path=self.dir)
+        self.assertEqual(cache.get('1 /baz').headers, {'Link': '<foo>; rel="next"'})
+
+    def test_disk_limit(self):
+        '''The oldest files are removed once the disk tier is full.'''
+
+        cache = ResponseCache(path=self.dir, disk_size=300)
+        for i in range(10):
+            cache.put('1 /%s' % i, '"%s"' % i, None, {'foo': i})
+            self.assertTrue(cache.disk_used <= 300)
+        self.assertTrue(len(os.listdir(self.dir)) < 10)
@@ -0,0 +1,61 @@
+from highfive.runner.deliveries import BloomFilter, DeliveryFilter
+
+from unittest import TestCase
+
+import os.path as path
+import shutil
+import tempfile
+
+
+class DeliveryFilterTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 1e-3)
+        for i in range(1000):
+            bloom.add('delivery-%s' % i)
+        self.assertTrue(all('delivery-%s' % i in bloom for i in range(1000)))
+        false_positives = sum('other-%s' % i in bloom for i in range(1000))
+        self.assertTrue(false_positives < 10)
+
+    def test_lru_cache(self):
+        '''Recent deliveries are remembered, while the oldest ones are evicted.'''
+
+        deliveries = DeliveryFilter(cache_size=2)
+        self.assertFalse(deliveries.seen('a'))
+        self.assertFalse(deliveries.seen('a'))     # not remembered until it's committed
+        deliveries.commit('a')
+        deliveries.commit('b')
+        self.assertTrue(deliveries.seen('a'))
+        deliveries.commit('c')                      # 'b' is the least recently used
+        self.assertFalse(deliveries.seen('b'))
+        self.assertTrue(deliveries.seen('c'))
+        self.assertEqual(deliveries.stats(), {'hits': 2, 'misses': 3, 'cached': 2})
+
+    def test_persisted_filter(self):
+        '''
+        The Bloom filter catches the deliveries evicted from the cache, and it survives
+        restarts. Once a generation is full, the oldest one is dropped.
+        '''
+
+        filter_path = path.join(self.dir, 'deliveries')
+        deliveries = DeliveryFilter(cache_size=1, filter_path=filter_path, filter_capacity=2)
+        deliveries.commit('a')
+        deliveries.commit(u'b')
+        self.assertTrue(deliveries.seen('a'))
+        deliveries.save()
+        self.assertFalse(deliveries.dirty)
+
+        deliveries = DeliveryFilter(cache_size=1, filter_path=filter_path, filter_capacity=2)
+        self.assertTrue(deliveries.seen('a'))
+        self.assertTrue(deliveries.seen('b'))
+
+        for key in ['c', 'd', 'e']:
+            self.assertFalse(deliveries.seen(key))
+            deliveries.commit(key)
+        self.assertEqual([bloom.count for bloom in deliveries.filters], [2, 1])
+        self.assertFalse(deliveries.seen('a'))
@@ -0,0 +1,70 @@
+from highfive.runner.dispatcher import Defer, Dispatcher
+
+from threading import Event
+from unittest import TestCase
+
+import time
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class DispatcherTests(TestCase):
+    def test_lane_ordering(self):
+        '''Tasks in the same lane are run in order.'''
+
+        dispatcher = Dispatcher(4)
+        results = []
+        for i in range(20):
+            dispatcher.submit('lane', lambda i=i: time.sleep(0.001) or results.append(i))
+
+        self.assertTrue(wait_until(dispatcher.is_idle))
+        self.assertEqual(results, range(20))
+        # Only one thread is spawned for a single lane.
+        self.assertEqual(len(dispatcher.threads), 1)
+
+    def test_lanes_run_concurrently(self):
+        '''A blocked lane doesn't stop the other lanes.'''
+
+        dispatcher = Dispatcher(2)
+        unblock, results = Event(), []
+        dispatcher.submit(1, lambda: unblock.wait(5) and results.append('slow'))
+        dispatcher.submit(1, lambda: results.append('after slow'))
+        dispatcher.submit(2, lambda: results.append('fast'))
+
+        self.assertTrue(wait_until(lambda: results == ['fast']))
+        self.assertFalse(dispatcher.is_idle())
+        unblock.set()
+        self.assertTrue(wait_until(dispatcher.is_idle))
+        self.assertEqual(results, ['fast', 'slow', 'after slow'])
+
+    def test_failing_task(self):
+        '''Failing tasks don't affect the lane (or the thread).'''
+
+        dispatcher = Dispatcher(1)
+        results = []
+        dispatcher.submit('lane', lambda: 1 / 0)
+        dispatcher.submit('lane', lambda: results.append(1))
+        self.assertTrue(wait_until(dispatcher.is_idle))
+        self.assertEqual(results, [1])
+
+    def test_deferred_task(self):
+        '''
+        A deferred task runs before the rest of its lane (once it's due), without holding
+        a thread in the meantime.
+        '''
+
+        dispatcher = Dispatcher(1)
+        results = []
+        dispatcher.submit(1, lambda: Defer(0.1, lambda: results.append('deferred')))
+        dispatcher.submit(1, lambda: results.append('next'))
+        dispatcher.submit(2, lambda: results.append('other'))
+
+        self.assertTrue(wait_until(lambda: results == ['other']))
+        self.assertFalse(dispatcher.is_idle())
+        self.assertTrue(wait_until(dispatcher.is_idle))
+        self.assertEqual(results, ['other', 'deferred', 'next'])
@@ -1,15 +1,23 @@
 from highfive.api_provider.interface import APIProvider
-from highfive.event_handlers import EventHandler
+from highfive import event_handlers
+from highfive.event_handlers import EventHandler, Modifier
+from highfive.event_handlers.event_handler import TICK_RETRY_SECS
+from highfive.runner.timers import TimerService
 
 from api_provider_tests import create_config
 from unittest import TestCase
 
+import time
+
 
 class TestHandler(EventHandler):
     called = False
     def on_issue_open(self):
         self.called = True
 
+    def on_next_tick(self):
+        self.called = True
+
 
 class EventHandlerTests(TestCase):
     def test_handler_ignore_inactive(self):
@@ -52,3 +60,88 @@ class EventHandlerTests(TestCase):
         handler = TestHandler(api, config)
         handler.handle_payload()
         self.assertTrue(handler.called)
+
+    def test_handler_timers(self):
+        '''Ticks from the timer service reach only the handlers with due timers.'''
+
+        config = { 'active': True }
+        api = APIProvider(config=create_config(), payload={
+            'action': '__tick', 'timers': { 'OtherHandler': ['5'] }
+        })
+        handler = TestHandler(api, config)
+        handler.handle_payload()
+        self.assertFalse(handler.called)
+
+        api.payload['timers']['TestHandler'] = ['5', '7']
+        handler.handle_payload()
+        self.assertTrue(handler.called)
+        self.assertEqual(handler.due, ['5', '7'])
+
+        class Timers(object):
+            scheduled = []
+            def schedule(self, *args):
+                self.scheduled.append(args)
+
+        api.timers = Timers()
+        handler.wake_at(100, key='5')
+        self.assertEqual(api.timers.scheduled, [('TestHandler', '5', 100)])
+
+    def test_failed_tick(self):
+        '''Due timers are armed again (after a while) if the tick fails.'''
+
+        class FailingHandler(EventHandler):
+            def on_next_tick(self):
+                raise IOError('boom')
+
+        class FailingCleanup(EventHandler):
+            def cleanup(self):
+                raise IOError('boom')
+
+        config = { 'active': True, 'allowed_repos': ['foo/.*'] }
+        service = TimerService()
+        for cls in [FailingHandler, FailingCleanup]:
+            for due, expected in [(['5', '7'], ['5', '7']), (None, None)]:
+                api = APIProvider(config=create_config(), payload={
+                    'action': '__tick', 'timers': { cls.__name__: due }
+                })
+                api.owner, api.repo = 'foo', 'bar'
+                api.timers = service.view(1)
+                self.assertRaises(IOError, cls(api, config).handle_payload)
+
+                now = time.time()
+                self.assertEqual(service.pop_due(now), {})
+                self.assertEqual(service.pop_due(now + TICK_RETRY_SECS + 1),
+                                 {1: {cls.__name__: expected}})
+
+    def test_shared_api_after_modifier(self):
+        '''Handlers sharing an API provider still see its attributes after a `Modifier`.'''
+
+        class ModifyingHandler(EventHandler):
+            def on_next_tick(self):
+                with Modifier(self.api, owner='foo', repo='bar', number='3'):
+                    pass
+
+        config = { 'active': True, 'allowed_repos': ['foo/.*'] }
+        api = APIProvider(config=create_config(), payload={ 'action': '__tick' })
+        ModifyingHandler(api, { 'active': True }).handle_payload()
+        self.assertEqual((api.owner, api.repo, api.number), (None, None, None))
+
+        handler = TestHandler(api, config)
+        handler.handle_payload()
+        self.assertFalse(handler.called)
+
+    def test_coalescing_rules(self):
+        '''Payloads are coalesced only if all the handlers reacting to the actions agree.'''
+
+        config = create_config()
+        config.enabled_events = ['issues', 'pull_request']
+        event_handlers.load_handlers_using(config)
+        get_coalescing = event_handlers.get_coalescing
+        self.assertEqual(get_coalescing('pull_request', 'servo/servo', 'synchronize', 'synchronize'),
+                         'supersede')
+        self.assertEqual(get_coalescing('pull_request', 'servo/servo', 'labeled', 'unlabeled'),
+                         'cancel')
+        self.assertEqual(get_coalescing('pull_request', 'servo/servo', 'opened', 'synchronize'),
+                         None)
+        # 'EasyIssueAssigner' reacts to label changes, but it doesn't allow coalescing them.
+        self.assertEqual(get_coalescing('issues', 'servo/servo', 'labeled', 'unlabeled'), None)
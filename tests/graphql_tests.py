@@ -0,0 +1,152 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+from highfive.api_provider.graphql import build_issues_query, parse_issue_states
+from highfive.api_provider.github_api import GithubAPIProvider
+from highfive.runner import InstallationManager, Response
+from installation_manager_tests import create_config
+from threading import Thread
+from unittest import TestCase
+
+import json
+import re
+
+
+def create_node(number):
+    node = {
+        'number': number,
+        'state': 'OPEN',
+        'updatedAt': '2017-01-01T00:00:00Z',
+        'labels': {'nodes': [{'name': 'S-awaiting-review'}]},
+        'assignees': {'nodes': [{'login': 'Foo'}]},
+        'comments': {'nodes': [{'createdAt': '2017-01-02T00:00:00Z'}]},
+    }
+    if number % 2:
+        node['headRefOid'] = 'deadbeef'
+        node['state'] = 'MERGED'
+    return node
+
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    '''
+    Stand-in for Github's GraphQL endpoint. It knows about the issues/PRs upto #200 (odd ones
+    are merged PRs), and it records the numbers in each query.
+    '''
+
+    queries = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        numbers = map(int, re.findall(r'issueOrPullRequest\(number: (\d+)\)', body['query']))
+        self.queries.append((body['variables'], numbers))
+
+        repository = dict(('i%s' % n, create_node(n) if n <= 200 else None) for n in numbers)
+        data = {'data': {'rateLimit': {'cost': 1, 'remaining': 4999},
+                         'repository': repository}}
+        if any(n > 200 for n in numbers):
+            data['errors'] = [{'type': 'NOT_FOUND', 'message': 'Could not resolve to an issue'}]
+
+        resp = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(resp)))
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', str(5000 - len(self.queries)))
+        self.send_header('X-RateLimit-Reset', '2000000000')
+        self.end_headers()
+        self.wfile.write(resp)
+
+    def log_message(self, *args):
+        pass
+
+
+class GraphQLTests(TestCase):
+    def setUp(self):
+        GraphQLHandler.queries = []
+        self.server = HTTPServer(('127.0.0.1', 0), GraphQLHandler)
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_query(self):
+        query = build_issues_query(['1', '2'])
+        self.assertTrue('i1: issueOrPullRequest(number: 1)' in query)
+        self.assertTrue('i2: issueOrPullRequest(number: 2)' in query)
+
+        states = parse_issue_states({'data': {'repository': {
+            'i1': create_node(1), 'i2': create_node(2), 'i3': None,
+        }}})
+        self.assertEqual(sorted(states), ['1', '2'])
+        self.assertEqual(states['1'], {
+            'number': '1',
+            'is_pull': True,
+            'state': 'merged',
+            'updated_at': '2017-01-01T00:00:00Z',
+            'labels': ['s-awaiting-review'],
+            'assignees': ['foo'],
+            'last_comment_at': '2017-01-02T00:00:00Z',
+            'head_sha': 'deadbeef',
+        })
+        self.assertEqual((states['2']['is_pull'], states['2']['head_sha']), (False, None))
+
+    def test_batched_states(self):
+        '''States are fetched in batches of 100, on the GraphQL budget, and reused for a payload.'''
+
+        config = create_config()
+        config.name = 'test_app'
+        manager = InstallationManager(config=config, installation_id=255, store=None)
+        manager.token = 'booya'
+        manager.next_token_sync = datetime.now() + timedelta(hours=1)
+        api = manager.create_api_provider_for_payload({
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+        })
+        api.graphql_url = 'http://127.0.0.1:%s/graphql' % self.server.server_port
+
+        numbers = map(str, range(1, 151)) + ['300', 'foo']
+        states = api.get_issue_states(numbers)
+        self.assertEqual(sorted(states, key=int), map(str, range(1, 151)))
+        self.assertEqual(states['42']['state'], 'open')
+
+        queries = GraphQLHandler.queries
+        self.assertEqual(map(lambda (variables, numbers): len(numbers), queries), [100, 51])
+        self.assertEqual(queries[0][0], {'owner': 'foo', 'repo': 'bar'})
+        self.assertEqual(manager.rate_limiter.stats(), {
+            'graphql': {'remaining': 4998, 'reset': 2000000000},
+        })
+
+        # Fetched (and missing) issues/PRs aren't fetched again.
+        states = api.get_issue_states(['2', '300', '151'])
+        self.assertEqual(sorted(states), ['151', '2'])
+        self.assertEqual(queries[-1][1], [151])
+        self.assertEqual(len(queries), 3)
+
+    def test_truncated_labels(self):
+        '''Labels which don't fit in the query are fetched with REST.'''
+
+        class FnScope(object):
+            requests = []
+
+        scope = FnScope()
+
+        def test_request(method, url, data, auth):
+            scope.requests.append((method, url))
+            if method == 'GET':
+                return Response(data=[{'name': 'C-assigned'}, {'name': 'E-easy'}])
+            node = create_node(2)
+            node['labels']['pageInfo'] = {'hasNextPage': True}
+            return Response(data={'data': {'repository': {'i1': create_node(1), 'i2': node}}})
+
+        config = create_config()
+        config.name = 'test_app'
+        api = GithubAPIProvider(config, {
+            'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+        }, None, test_request)
+        states = api.get_issue_states(['1', '2'])
+        self.assertEqual(states['1']['labels'], ['s-awaiting-review'])
+        self.assertEqual(states['2']['labels'], ['c-assigned', 'e-easy'])
+        self.assertEqual(scope.requests[1:], [
+            ('GET', 'https://api.github.com/repos/foo/bar/issues/2/labels?per_page=100'),
+        ])
@@ -57,6 +57,9 @@ class TestAPIProvider(APIProvider):
     def edit_comment(self, id_, comment):
         self.comments[str(id_)] = comment
 
+    def delete_comment(self, id_):
+        self.comments.pop(str(id_))
+
     def set_assignees(self, assignees=[]):
         self.assignees = assignees
 
@@ -93,6 +96,10 @@ class TestAPIProvider(APIProvider):
     def close_issue(self):
         self.closed = True
 
+    def get_issue_states(self, numbers):
+        states = getattr(self, 'issue_states', None) or {}
+        return dict((n, states[n]) for n in numbers if n in states)
+
     def create_issue(self, title, body, labels=[], assignees=[]):
         self.new_issue = {
             "repo": "%s/%s" % (self.owner, self.repo),
@@ -1,8 +1,14 @@
+from highfive import event_handlers
+from highfive.event_handlers import Modifier
 from highfive.runner.config import Configuration
-from highfive.runner import InstallationManager, Response
+from highfive.runner import InstallationManager, Response, installation_manager
+from highfive.runner.cache import ResponseCache
+from highfive.runner.retry import PermanentError, TransientError
 
 from datetime import datetime, timedelta
+from handler_tests import TestStore
 from jose import jwt
+from threading import Lock, Thread
 from unittest import TestCase
 
 import time
@@ -42,8 +48,8 @@ class InstallationManagerTests(TestCase):
                                       installation_id=255,
                                       store=None)
         self.assertEqual(manager.token, None)
-        # This triggers the manager to get the rate limit for the given window.
-        self.assertTrue(manager.reset_time < time.time())
+        # The rate limits are unknown until we get the first response.
+        self.assertEqual(manager.rate_limiter.stats(), {})
         # This flag triggers the manager to get the token during the first request
         self.assertTrue(manager.next_token_sync < datetime.now())
         self.assertTrue(manager.token is None)
@@ -93,48 +99,37 @@ class InstallationManagerTests(TestCase):
         self.assertEqual(scope.requested, 1)
 
 
-    def test_wait_time(self):
+    def test_rate_limit_headers(self):
         '''
-        Wait time returns the waiting period (in seconds) for making a request.
-        For this to work, it should get the remaining requests (that can be made
-        in the window) from the API.
+        The rate limits are obtained from the headers of the responses to our requests
+        (authenticated with the installation token), and there's no waiting until the
+        budget reaches its reserve.
         '''
 
-        class FnScope(object):
-            reset = int(time.time()) + 3600
-
-        scope = FnScope()
+        reset = int(time.time()) + 3600
 
         def test_request(method, url, data, headers):
-            self.check_default_headers(headers)
-            self.assertEqual(headers['Authorization'], 'token booya')
-            self.assertEqual(method, 'GET')
-            self.assertEqual(url, 'https://api.github.com/rate_limit')
-            return Response(data={      # Actual data from Github
-                "rate": {
-                    "limit": 5000,
-                    "remaining": 4999,
-                    "reset": scope.reset
-                }
+            return Response(data={}, headers={
+                'X-RateLimit-Limit': '5000',
+                'X-RateLimit-Remaining': '4999' if 'search' not in url else '29',
+                'X-RateLimit-Reset': str(reset),
             })
 
         manager = InstallationManager(config=create_config(),
                                       installation_id=255,
                                       store=None,
                                       json_request=test_request)
-        # assume that we've obtained the token through `sync_token`
         manager.token = 'booya'
-        self.assertTrue(manager.reset_time < time.time())
-        wait_secs = manager.wait_time()
-        self.assertTrue(wait_secs > 0.7 and wait_secs <= 0.75)  # 3600 / 5000 = 0.72
-        self.assertEqual(manager.remaining, 4999)
-        self.assertEqual(manager.reset_time, scope.reset)
+        manager._request('GET', 'https://api.github.com/repos/foo/bar', auth='Some token')
+        self.assertEqual(manager.rate_limiter.stats(), {})
 
-        # assume that the bot hasn't made any requests for half an hour
-        manager.reset_time -= 1800
-        wait_secs = manager.wait_time()
-        # wait time is now reduced by half
-        self.assertTrue(wait_secs > 0.35 and wait_secs <= 0.38)
+        manager._request('GET', 'https://api.github.com/repos/foo/bar')
+        manager._request('GET', 'https://api.github.com/search/issues?q=foo')
+        self.assertEqual(manager.rate_limiter.stats(), {
+            'core': {'remaining': 4999, 'reset': reset},
+            'search': {'remaining': 29, 'reset': reset},
+        })
+        self.assertEqual(manager.rate_limiter.acquire('https://api.github.com/issues'), 0)
 
 
     def test_raw_request(self):
@@ -178,8 +173,8 @@ class InstallationManagerTests(TestCase):
         try:
             manager._request('SOME-METHOD', 'https://some.url')
             self.assertTrue(False)      # just to make this fail
-        except Exception as err:
-            self.assertEqual(str(err), 'Invalid response')
+        except PermanentError as err:
+            self.assertEqual(str(err), 'Invalid response (400)')
 
         test_cases = [
             (test_request_default, {}),
@@ -193,6 +188,93 @@ class InstallationManagerTests(TestCase):
             manager._request('SOME-METHOD', 'https://some.url', **kwargs)
 
 
+    def test_conditional_requests(self):
+        '''
+        GET requests are made conditional once we have a cached response, and the cached
+        response is used if the resource hasn't been modified.
+        '''
+
+        class FnScope(object):
+            requests = []
+
+        scope = FnScope()
+
+        def test_request(method, url, data, headers):
+            scope.requests.append(headers.get('If-None-Match'))
+            if headers.get('If-None-Match') == '"foo"':
+                return Response(data='', code=304, headers={'X-RateLimit-Remaining': '10'})
+            return Response(data={'foo': 'bar'},
+                            headers={'ETag': '"foo"', 'Link': '<https://next>; rel="next"'})
+
+        cache = ResponseCache()
+        manager = InstallationManager(config=create_config(),
+                                      installation_id=255,
+                                      store=None,
+                                      json_request=test_request,
+                                      cache=cache)
+        manager.token = 'booya'
+        for _ in range(2):
+            resp = manager._request('GET', 'https://api.github.com/repos/foo/bar')
+            self.assertEqual((resp.code, resp.data), (200, {'foo': 'bar'}))
+            # The `Link` header (for the next pages) is restored from the cache.
+            self.assertEqual(resp.headers['Link'], '<https://next>; rel="next"')
+        self.assertEqual(resp.headers['X-RateLimit-Remaining'], '10')
+
+        # Other methods (and other auth) are never cached.
+        manager._request('POST', 'https://api.github.com/repos/foo/bar')
+        manager._request('GET', 'https://api.github.com/repos/foo/bar', auth=False)
+        self.assertEqual(scope.requests, [None, '"foo"', None, None])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertTrue('If-None-Match' not in manager.headers)
+
+
+    def test_concurrent_requests(self):
+        '''
+        Requests from multiple threads (and managers) don't share their headers, and only a few
+        requests of an installation are in flight at any time.
+        '''
+
+        class FnScope(object):
+            lock = Lock()
+            in_flight = 0
+            max_in_flight = 0
+            leaked = []
+
+        scope = FnScope()
+
+        def test_request(method, url, data, headers):
+            with scope.lock:
+                scope.in_flight += 1
+                scope.max_in_flight = max(scope.max_in_flight, scope.in_flight)
+            time.sleep(0.01)
+            if headers['Authorization'] != 'token %s' % url:
+                scope.leaked.append(url)
+            with scope.lock:
+                scope.in_flight -= 1
+            return Response(data={})
+
+        config = create_config()
+        config.max_inflight_requests = 2
+        managers = []
+        for token in ['foo', 'bar']:
+            manager = InstallationManager(config=config, installation_id=token, store=None,
+                                          json_request=test_request)
+            manager.token = token
+            manager.sync_token = lambda: None
+            managers.append(manager)
+
+        threads = [Thread(target=managers[0].request, args=('GET', 'foo')) for _ in range(6)]
+        threads.append(Thread(target=managers[1].request, args=('GET', 'bar')))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(scope.leaked, [])
+        self.assertTrue(scope.max_in_flight <= 3)
+        self.assertTrue('Authorization' not in InstallationManager.headers)
+
+
     def test_actual_request(self):
         '''
         This checks that the functions in the actual `request` are called
@@ -204,11 +286,210 @@ class InstallationManagerTests(TestCase):
         steps = []
         resp = Response(data={})
 
-        manager.remaining = 10
         manager.sync_token = lambda: steps.append(0) or ()
-        manager.wait_time = lambda: steps.append(1) or 0.001
+        manager.rate_limiter.acquire = lambda url: steps.append(1) or 0.001
         manager._request = lambda method, url, data, auth: steps.append(2) or resp
 
         self.assertEqual(manager.request('METHOD', 'URL'), resp)
-        self.assertEqual(manager.remaining, 9)
         self.assertEqual(steps, [0, 1, 2])
+
+
+    def test_clear_queue_lanes(self):
+        '''
+        All the handlers for a payload are run in the lane of its issue/PR (with the same API
+        provider), and the ones which aren't related to an issue/PR are run in the installation's
+        lane. `serial` handlers hold the installation's lock while they're run.
+        '''
+
+        class FnScope(object):
+            handled = []
+            acked = []
+            locked = []
+            apis = set()
+
+        scope = FnScope()
+
+        class Handler(object):
+            serial = False
+            def __init__(self, api, config):
+                self.api, self.config = api, config
+            def handle_payload(self):
+                scope.handled.append((self.config, self.api.number))
+                scope.apis.add((self.api.number, id(self.api)))
+
+        class SerialHandler(Handler):
+            serial = True
+            def handle_payload(self):
+                scope.locked.append(manager.serial_lock.acquire(False))
+                Handler.handle_payload(self)
+
+        class Journal(object):
+            def ack(self, inst_id, seq):
+                scope.acked.append((inst_id, seq))
+
+        handlers = [('foo', 'serial', SerialHandler), ('bar', 'other', Handler)]
+        get_handlers_for = event_handlers.get_handlers_for
+        event_handlers.get_handlers_for = lambda *args, **kwargs: iter(handlers)
+        submitted = []
+
+        try:
+            config = create_config()
+            config.name = 'test_app'
+            manager = InstallationManager(config=config, installation_id=255,
+                                          store=None, journal=Journal())
+            submit = manager.dispatcher.submit
+            manager.dispatcher.submit = lambda key, task: submitted.append(key) or submit(key, task)
+            # Issues in different repos (with the same number) go to different lanes.
+            for repo, seq in [('bar', 7), ('baz', 8)]:
+                api = manager.create_api_provider_for_payload({
+                    'repository': {'owner': {'login': 'foo'}, 'name': repo},
+                    'issue': {'number': 5, 'state': 'open', 'labels': [],
+                              'user': {'login': 'foo'}},
+                })
+                manager.queue.put((api, 'issues', seq))
+            tick = manager.create_api_provider_for_payload({'action': '__tick'})
+            manager.queue.put((tick, 'issues', None))
+            manager.clear_queue()
+
+            deadline = time.time() + 5
+            while manager.is_busy() and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            event_handlers.get_handlers_for = get_handlers_for
+
+        self.assertEqual(submitted, [('foo', 'bar', '5'), ('foo', 'baz', '5'), '__installation__'])
+        self.assertEqual(sorted(scope.handled),
+                         [('other', None), ('other', '5'), ('other', '5'),
+                          ('serial', None), ('serial', '5'), ('serial', '5')])
+        self.assertEqual(len(scope.apis), 3)
+        self.assertEqual(scope.locked, [False, False, False])
+        self.assertEqual(sorted(scope.acked), [(255, 7), (255, 8)])
+
+
+    def test_closed_comments(self):
+        '''The index of the comments posted to an issue/PR is dropped once it's closed.'''
+
+        class Handler(object):
+            def __init__(self, api, config):
+                pass
+            def handle_payload(self):
+                pass
+
+        get_handlers_for = event_handlers.get_handlers_for
+        event_handlers.get_handlers_for = lambda *args, **kwargs: iter([('foo', 'bar', Handler)])
+        store = TestStore({
+            '__comments___foo_bar_5': {'Checker:warning': {'id': 3, 'digest': 'baz'}},
+            '__comments___foo_bar_6': {'Checker:warning': {'id': 4, 'digest': 'baz'}},
+        })
+
+        try:
+            config = create_config()
+            config.name = 'test_app'
+            manager = InstallationManager(config=config, installation_id=255, store=store)
+            for number, action in [(5, 'closed'), (6, 'synchronize'), (7, 'closed')]:
+                api = manager.create_api_provider_for_payload({
+                    'action': action,
+                    'repository': {'owner': {'login': 'foo'}, 'name': 'bar'},
+                    'issue': {'number': number, 'state': 'open', 'labels': [],
+                              'user': {'login': 'foo'}},
+                })
+                manager.queue.put((api, 'issues', None))
+            manager.clear_queue()
+
+            deadline = time.time() + 5
+            while manager.is_busy() and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            event_handlers.get_handlers_for = get_handlers_for
+
+        self.assertEqual(sorted(store.stuff), ['__comments___foo_bar_6'])
+
+
+    def test_tick_with_modifier(self):
+        '''Ticks are acked even if a handler has modified the number of the API provider.'''
+
+        class FnScope(object):
+            acked = []
+
+        scope = FnScope()
+
+        class Handler(object):
+            def __init__(self, api, config):
+                self.api = api
+            def handle_payload(self):
+                with Modifier(self.api, number='3'):
+                    pass
+
+        class Journal(object):
+            def ack(self, inst_id, seq):
+                scope.acked.append(seq)
+
+        get_handlers_for = event_handlers.get_handlers_for
+        event_handlers.get_handlers_for = lambda *args, **kwargs: iter([('foo', 'bar', Handler)])
+
+        try:
+            config = create_config()
+            config.name = 'test_app'
+            manager = InstallationManager(config=config, installation_id=255,
+                                          store=None, journal=Journal())
+            api = manager.create_api_provider_for_payload({'action': '__tick'})
+            manager.dispatch(api, 'issues', 4)
+            deadline = time.time() + 5
+            while manager.is_busy() and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            event_handlers.get_handlers_for = get_handlers_for
+
+        self.assertEqual(scope.acked, [4])
+
+
+    def test_handler_retries(self):
+        '''
+        Handlers which fail because of transient errors are retried (along with the handlers
+        after them), while the ones which fail otherwise are skipped.
+        '''
+
+        class FnScope(object):
+            handled = []
+            acked = []
+            failures = 2
+
+        scope = FnScope()
+
+        class Handler(object):
+            def __init__(self, api, config):
+                self.config = config
+            def handle_payload(self):
+                if self.config == 'flaky' and scope.failures:
+                    scope.failures -= 1
+                    raise TransientError(502)
+                if self.config == 'broken':
+                    raise PermanentError(422)
+                scope.handled.append(self.config)
+
+        class Journal(object):
+            def ack(self, inst_id, seq):
+                scope.acked.append(seq)
+
+        handlers = [(None, 'broken', Handler), (None, 'flaky', Handler), (None, 'fine', Handler)]
+        get_handlers_for = event_handlers.get_handlers_for
+        event_handlers.get_handlers_for = lambda *args, **kwargs: iter(handlers)
+        backoff = installation_manager.backoff
+        installation_manager.backoff = lambda err, attempt: 0.01
+
+        try:
+            config = create_config()
+            config.name = 'test_app'
+            manager = InstallationManager(config=config, installation_id=255,
+                                          store=None, journal=Journal())
+            api = manager.create_api_provider_for_payload({'action': '__tick'})
+            manager.dispatch(api, 'issues', 3)
+            deadline = time.time() + 5
+            while manager.is_busy() and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            event_handlers.get_handlers_for = get_handlers_for
+            installation_manager.backoff = backoff
+
+        self.assertEqual(scope.handled, ['flaky', 'fine'])
+        self.assertEqual(scope.acked, [3])
@@ -0,0 +1,88 @@
+from highfive.runner.journal import Journal
+
+from unittest import TestCase
+
+import json
+import os.path as path
+import shutil
+import tempfile
+
+
+def drain(journal):
+    entries = []
+    while not journal.pending.empty():
+        entries.append(journal.pending.get())
+    return entries
+
+
+def get_installation(raw_payload):
+    return json.loads(raw_payload)['installation']['id']
+
+
+class JournalTests(TestCase):
+    def setUp(self):
+        self.journal_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.journal_path)
+
+    def test_append_and_consume(self):
+        '''Appended payloads are persisted and queued (in order) for the daemon.'''
+
+        journal = Journal(self.journal_path)
+        first = journal.append('issues', json.dumps({'installation': {'id': 1}}))
+        second = journal.append('pull_request', json.dumps({'installation': {'id': 2}}))
+        self.assertEqual((first, second), (0, 1))
+
+        entries = drain(journal)
+        self.assertEqual(map(lambda e: e[:2], entries), [(0, 'issues'), (1, 'pull_request')])
+        self.assertEqual(journal.segments, [0])
+        self.assertTrue(path.isfile(journal._segment_path(0)))
+        journal.close()
+
+    def test_replay_unacked_entries(self):
+        '''
+        Entries which haven't been acked for their installation are queued again when the journal
+        is reopened (say, after a restart), and the sequence numbers continue from there.
+        '''
+
+        journal = Journal(self.journal_path)
+        for inst_id in [1, 2, 1]:
+            journal.append('issues', json.dumps({'installation': {'id': inst_id}}))
+        drain(journal)
+        journal.ack(1, 0)
+        journal.ack(2, 1)
+        journal.close()
+
+        journal = Journal(self.journal_path)
+        journal.replay(get_installation)
+        entries = drain(journal)
+        self.assertEqual(map(lambda e: e[0], entries), [2])
+        self.assertEqual(json.loads(entries[0][2]), {'installation': {'id': 1}})
+        self.assertEqual(journal.append('issues', '{}'), 3)
+        journal.close()
+
+    def test_segment_rotation_and_removal(self):
+        '''Segments are rotated once they're full, and removed once all their entries are acked.'''
+
+        journal = Journal(self.journal_path, segment_max_bytes=1)
+        for _ in range(3):
+            journal.append('issues', json.dumps({'installation': {'id': 7}}))
+        self.assertEqual(journal.segments, [0, 1, 2])
+
+        journal.ack(7, 0)
+        journal.ack(7, 1)
+        self.assertEqual(journal.segments, [2])
+        self.assertFalse(path.isfile(journal._segment_path(0)))
+
+        # The segment being written to is kept around.
+        journal.ack(7, 2)
+        self.assertEqual(journal.segments, [2])
+        journal.close()
+
+        journal = Journal(self.journal_path)
+        journal.replay(get_installation)
+        self.assertTrue(journal.pending.empty())
+        self.assertEqual(journal.segments, [])
+        self.assertEqual(journal.append('issues', '{}'), 3)
+        journal.close()
@@ -0,0 +1,67 @@
+from highfive.runner.ratelimit import RateLimiter, resource_for
+
+from unittest import TestCase
+
+
+def rate_headers(limit, remaining, reset, resource=None):
+    headers = {
+        'X-RateLimit-Limit': str(limit),
+        'X-RateLimit-Remaining': str(remaining),
+        'X-RateLimit-Reset': str(reset),
+    }
+    if resource:
+        headers['X-RateLimit-Resource'] = resource
+    return headers
+
+
+class RateLimiterTests(TestCase):
+    def test_resources(self):
+        self.assertEqual(resource_for('https://api.github.com/repos/foo/bar/issues'), 'core')
+        self.assertEqual(resource_for('https://api.github.com/search/issues?q=foo'), 'search')
+        self.assertEqual(resource_for('https://api.github.com/graphql'), 'graphql')
+
+    def test_pacing(self):
+        '''
+        Requests go through right away until the budget reaches its reserve. After that, the
+        remaining requests are spread over the window, and once the budget is exhausted,
+        we wait for the window to reset.
+        '''
+
+        limiter = RateLimiter(reserve=0.1)
+        url = 'https://api.github.com/repos/foo/bar'
+        # Nothing's known yet.
+        self.assertEqual(limiter.acquire(url, now=1000), 0)
+
+        limiter.update(url, rate_headers(100, 12, 2000))
+        self.assertEqual(limiter.acquire(url, now=1000), 0)
+        self.assertEqual(limiter.acquire(url, now=1000), 0)
+        self.assertEqual(limiter.acquire(url, now=1000), 1000 / 10.0)
+        for _ in range(9):
+            limiter.acquire(url, now=1000)
+        self.assertEqual(limiter.acquire(url, now=1500), 500)
+
+        # The other budgets aren't affected.
+        self.assertEqual(limiter.acquire('https://api.github.com/search/issues', now=1000), 0)
+        # Once the window's over, we start afresh.
+        self.assertEqual(limiter.acquire(url, now=2000), 0)
+
+    def test_updates(self):
+        '''
+        Headers from an older window are ignored. For the same window, Github's count is taken
+        as it is (conditional requests which don't modify anything don't count).
+        '''
+
+        limiter = RateLimiter()
+        url = 'https://api.github.com/graphql'
+        limiter.update(url, {})
+        self.assertEqual(limiter.stats(), {})
+
+        limiter.update(url, rate_headers(5000, 4000, 2000))
+        limiter.acquire(url, now=1000)
+        limiter.update(url, rate_headers(5000, 4000, 2000))
+        limiter.update(url, rate_headers(5000, 100, 1000))
+        self.assertEqual(limiter.stats(), {'graphql': {'remaining': 4000, 'reset': 2000}})
+
+        # Github's own resource name takes precedence.
+        limiter.update(url, rate_headers(30, 29, 3000, resource='search'))
+        self.assertEqual(limiter.stats()['search'], {'remaining': 29, 'reset': 3000})
@@ -0,0 +1,43 @@
+from highfive.runner.registry import InstallationRegistry
+
+from unittest import TestCase
+
+
+class FakeManager(object):
+    def __init__(self, inst_id):
+        self.installation_id = inst_id
+        self.busy = False
+        self.closed = False
+
+    def is_busy(self):
+        return self.busy
+
+    def close(self):
+        self.closed = True
+
+    def memory_usage(self):
+        return 42
+
+
+class InstallationRegistryTests(TestCase):
+    def test_registry(self):
+        '''Managers are created on demand, and evicted once they've been idle for too long.'''
+
+        registry = InstallationRegistry(FakeManager, ttl=60)
+        self.assertTrue(registry.get(1) is None)
+        manager = registry.get_or_create(1)
+        self.assertTrue(registry.get_or_create(1) is manager)
+        self.assertTrue(registry[1] is manager)
+        self.assertRaises(KeyError, lambda: registry[2])
+        registry.get_or_create(2).busy = True
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.memory_usage(), {1: 42, 2: 42})
+
+        now = registry.last_used[1]
+        self.assertEqual(registry.evict_idle(now=now + 30), [])
+        self.assertEqual(registry.evict_idle(now=now + 90), [1])
+        self.assertTrue(manager.closed)
+        self.assertFalse(1 in registry)
+        self.assertTrue(2 in registry)       # busy managers are never evicted
+
+        self.assertTrue(registry.get_or_create(1) is not manager)
@@ -0,0 +1,77 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from highfive.runner.request import BodyStats, SessionPool, decode_body
+from threading import Thread
+from unittest import TestCase
+
+import time
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = '{"foo": "bar"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTests(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        '''Requests to a host reuse its connection, even after the other hosts are evicted.'''
+
+        sessions = SessionPool(idle_ttl=60)
+        for _ in range(3):
+            resp = sessions.request('GET', self.url)
+            self.assertEqual(resp.json(), {'foo': 'bar'})
+
+        self.assertEqual(sessions.stats(), {'hits': 2, 'misses': 1, 'hosts': 1})
+        self.assertEqual(sessions.evict_idle(), [])
+
+        # Evicted sessions still count towards the stats.
+        host = '127.0.0.1:%s' % self.server.server_port
+        self.assertEqual(sessions.evict_idle(now=time.time() + 60), [host])
+        self.assertEqual(sessions.stats(), {'hits': 2, 'misses': 1, 'hosts': 0})
+
+        sessions.request('GET', self.url)
+        self.assertEqual(sessions.stats(), {'hits': 2, 'misses': 2, 'hosts': 1})
+
+    def test_body_decoding(self):
+        '''Only JSON bodies are parsed, and text is decoded without guessing its encoding.'''
+
+        self.assertEqual(decode_body('{"foo": 1}', 'application/json; charset=utf-8'),
+                         ('json', {'foo': 1}))
+        self.assertEqual(decode_body('[1]', 'application/vnd.github.v3+json'), ('json', [1]))
+        self.assertEqual(decode_body('{"foo": 1}', 'text/plain'), ('text', u'{"foo": 1}'))
+        self.assertEqual(decode_body('{"foo": 1}', 'application/json', parse_json=False),
+                         ('text', u'{"foo": 1}'))
+        self.assertEqual(decode_body('caf\xc3\xa9', 'text/x-diff'), ('text', u'caf\xe9'))
+        self.assertEqual(decode_body('caf\xe9', 'text/html', 'iso-8859-1'), ('text', u'caf\xe9'))
+        self.assertEqual(decode_body('\x89PNG', 'image/png'), ('bytes', '\x89PNG'))
+        # Without a content type, we try JSON first.
+        self.assertEqual(decode_body('{"foo": 1}', ''), ('json', {'foo': 1}))
+        self.assertEqual(decode_body('foo', ''), ('text', u'foo'))
+
+        stats = BodyStats()
+        stats.record('text', 2 * 1024 * 1024, 0.5)
+        stats.record('text', 10, 0.25)
+        self.assertEqual(stats.stats()['text'], {
+            'count': 2, 'large': 1, 'bytes': 2 * 1024 * 1024 + 10,
+            'max_bytes': 2 * 1024 * 1024, 'secs': 0.75,
+        })
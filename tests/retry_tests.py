@@ -0,0 +1,37 @@
+from highfive.runner import Response
+from highfive.runner.retry import (BACKOFF_BASE_SECS, BACKOFF_CAP_SECS, PermanentError,
+                                   RateLimitedError, TransientError, backoff, error_for)
+
+from unittest import TestCase
+
+
+class RetryTests(TestCase):
+    def test_error_classes(self):
+        '''Server errors and rate limits can be retried, but the other client errors can't.'''
+
+        err = error_for(Response(data={}, code=502))
+        self.assertTrue(isinstance(err, TransientError) and err.retryable)
+
+        err = error_for(Response(data={}, code=403, headers={'Retry-After': '30'}))
+        self.assertTrue(isinstance(err, RateLimitedError) and err.retryable)
+        self.assertEqual(err.retry_after, 30)
+
+        err = error_for(Response(data={}, code=403, headers={
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '1100',
+        }), now=1000)
+        self.assertTrue(isinstance(err, RateLimitedError))
+        self.assertEqual(err.retry_after, 100)
+
+        for code in [403, 404, 422]:
+            err = error_for(Response(data={'message': 'Nope'}, code=code))
+            self.assertTrue(isinstance(err, PermanentError) and not err.retryable)
+            self.assertEqual((err.code, err.data), (code, {'message': 'Nope'}))
+
+    def test_backoff(self):
+        for attempt in range(10):
+            delay = backoff(TransientError(502), attempt)
+            self.assertTrue(0 <= delay <= min(BACKOFF_CAP_SECS, BACKOFF_BASE_SECS * 2 ** attempt))
+
+        delay = backoff(RateLimitedError(429, retry_after=60), 0)
+        self.assertTrue(60 <= delay <= 60 + BACKOFF_BASE_SECS)
@@ -0,0 +1,46 @@
+from highfive.runner.routing import get_config_router, get_router
+
+from unittest import TestCase
+
+
+class RoutingTests(TestCase):
+    def test_router_decisions(self):
+        '''Routers are shared for the same patterns, and they remember their decisions.'''
+
+        router = get_router(['servo/.*', 'foo/bar$'])
+        self.assertTrue(router is get_router(['servo/.*', 'foo/bar$']))
+        self.assertTrue(router.matches('servo/servo'))
+        self.assertTrue(router.matches('foo/bar'))
+        self.assertFalse(router.matches('foo/baz'))
+        self.assertEqual(router.decisions,
+                         {'servo/servo': True, 'foo/bar': True, 'foo/baz': False})
+
+        # Decisions are served from the cache.
+        router.decisions['foo/baz'] = True
+        self.assertTrue(router.matches('foo/baz'))
+
+    def test_subconfig_merging(self):
+        '''
+        Values for all the matching patterns are merged (in order). Patterns are matched
+        in lowercase, and the callers get a copy of the (cached) merged value.
+        '''
+
+        config = {
+            'Servo/.*': ['foo'],
+            'servo/servo': ['bar'],
+            'rust-lang/.*': ['baz'],
+        }
+
+        router = get_config_router(config)
+        merged = router.subconfig(config, 'servo/servo')
+        self.assertEqual(sorted(merged), ['bar', 'foo'])
+        self.assertEqual(router.subconfig(config, 'rust-lang/rust'), ['baz'])
+        self.assertEqual(router.subconfig(config, 'foo/bar'), None)
+
+        merged.append('booya')
+        self.assertEqual(sorted(router.subconfig(config, 'servo/servo')), ['bar', 'foo'])
+
+        config = {'servo/.*': {'foo': 1}, 'servo/servo': {'bar': 2}}
+        router = get_config_router(config)
+        self.assertEqual(router.subconfig(config, 'servo/servo'), {'foo': 1, 'bar': 2})
+        self.assertEqual(router.subconfig(config, 'servo/rust'), {'foo': 1})
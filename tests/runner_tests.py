@@ -1,9 +1,19 @@
+from highfive import event_handlers
 from highfive.runner import Configuration, Runner
+from highfive.runner.cache import DISK_CACHE_BYTES
 from highfive.runner.runner import HandlerError
+from highfive.runner.timers import TIMERS_KEY
 
 from unittest import TestCase
 
+import hashlib
+import hmac
+import imp
 import json
+import os
+import shutil
+import tempfile
+import time
 
 
 def create_runner():
@@ -21,9 +31,32 @@ def create_runner():
 class RunnerTests(TestCase):
     def test_runner_init(self):
         runner = create_runner()
-        self.assertEqual(runner.installations, {})
+        self.assertEqual(len(runner.installations), 0)
         getattr(runner, 'config')
 
+        runner.installations.get_or_create(1)
+        runner.shutdown()
+        self.assertTrue(runner.refresher.stopped)
+        self.assertEqual(len(runner.installations), 0)
+
+    def test_worker_caches(self):
+        '''Each worker has its own directory (and its share of the limit) for the disk cache.'''
+
+        path = tempfile.mkdtemp()
+        try:
+            runner = create_runner()
+            runner.config.response_cache_path = path
+            runner.config.worker_processes = 4
+            self.assertTrue(runner._create_cache().path is None)
+            cache = runner._create_cache(shard=1)
+            self.assertEqual(cache.path, os.path.join(path, 'worker-1'))
+            self.assertEqual(cache.disk_size, DISK_CACHE_BYTES / 4)
+
+            runner.config.worker_processes = 0
+            self.assertEqual(runner._create_cache().path, path)
+        finally:
+            shutil.rmtree(path)
+
     def test_runner_payload_verify(self):
         runner = create_runner()
         raw_data = json.dumps({'foo': 'bar'})
@@ -34,10 +67,86 @@ class RunnerTests(TestCase):
 
     def test_runner_invalid_payload(self):
         runner = create_runner()
+        # Signature is checked before decoding the payload.
         code, payload = runner.verify_payload('', '')
         self.assertTrue(payload is None)
+        self.assertEqual(code, 403)
+
+        signature = 'sha1=' + hmac.new('foobar', 'booya', hashlib.sha1).hexdigest()
+        code, payload = runner.verify_payload(signature, 'booya')
+        self.assertTrue(payload is None)
         self.assertEqual(code, 400)
 
+    def test_runner_oversized_payload(self):
+        runner = create_runner()
+        runner.max_payload_bytes = 10
+        raw_data = json.dumps({'foo': 'bar'})
+        signature = 'sha1=08511d260b8322ad739a3f34665855ba6044366e'
+        code, payload = runner.verify_payload(signature, raw_data)
+        self.assertTrue(payload is None)
+        self.assertEqual(code, 413)
+
+        # The server rejects them before reading the body (even for the events we'd ignore).
+        serve = imp.load_source('serve', 'serve.py')
+        resp = serve.create_app(runner).test_client().post('/', data=raw_data, headers={
+            'X-Hub-Signature': signature, 'X-GitHub-Event': 'push',
+        })
+        self.assertEqual(resp.status_code, 413)
+
+    def test_runner_event_check(self):
+        runner = create_runner()
+        self.assertTrue(runner.check_event('issues') is None)
+        self.assertTrue(runner.check_event('status') is HandlerError.DisabledEvent)
+        self.assertTrue(runner.check_event('installation_repositories')
+                        is HandlerError.NewInstallation)
+
+    def test_runner_redelivery(self):
+        runner = create_runner()
+        self.assertFalse(runner.is_redelivery('72d3162e-cc78-11e3-81ab-4c9367dc0958'))
+        runner.accept_delivery('72d3162e-cc78-11e3-81ab-4c9367dc0958')
+        self.assertTrue(runner.is_redelivery('72d3162e-cc78-11e3-81ab-4c9367dc0958'))
+        self.assertFalse(runner.is_redelivery(None))
+        runner.accept_delivery(None)
+
+    def test_redelivery_after_failure(self):
+        '''A delivery which fails to be handled isn't dropped when Github redelivers it.'''
+
+        serve = imp.load_source('serve', 'serve.py')
+        runner = create_runner()
+        handled = []
+
+        def handle_payload(event, payload):
+            if not handled:
+                handled.append(None)
+                raise IOError('boom')
+            handled.append((event, payload))
+
+        runner.handle_payload = handle_payload
+        app = serve.create_app(runner)
+        client = app.test_client()
+        raw_data = json.dumps({'foo': 'bar'})
+        headers = {
+            'X-Hub-Signature': 'sha1=08511d260b8322ad739a3f34665855ba6044366e',
+            'X-GitHub-Event': 'issues',
+            'X-GitHub-Delivery': '72d3162e-cc78-11e3-81ab-4c9367dc0958',
+        }
+
+        resp = client.post('/', data=raw_data, headers=headers)
+        self.assertEqual(resp.status_code, 500)
+        resp = client.post('/', data=raw_data, headers=headers)
+        self.assertEqual((resp.status_code, resp.data), (200, 'Yay!'))
+        self.assertEqual(handled, [None, ('issues', {'foo': 'bar'})])
+        resp = client.post('/', data=raw_data, headers=headers)
+        self.assertEqual((resp.status_code, resp.data), (200, 'Duplicate!'))
+
+    def test_runner_backlog(self):
+        runner = create_runner()
+        runner.max_backlog = 2
+        self.assertFalse(runner.is_overloaded())
+        runner.scheduler.total = 2
+        self.assertEqual(runner.backlog(), 2)
+        self.assertTrue(runner.is_overloaded())
+
     def test_runner_invalid_sign(self):
         runner = create_runner()
         raw_data = json.dumps({'foo': 'bar'})
@@ -88,8 +197,89 @@ class RunnerTests(TestCase):
         self.assertEqual(len(runner.installations), 1)
         runner.installations.clear()
 
-        # However, payload from unregistered repo should remove installation (if it exists)
+        # Payload from unregistered repo shouldn't create an installation.
         payload['repository']['owner']['login'] = 'foobar'
         r = runner.handle_payload('issues', payload)
         self.assertEqual(len(runner.installations), 0)
         self.assertTrue(r is HandlerError.UnregisteredRepo)
+        self.assertEqual(runner.router.decisions, {'foobar/highfive': False, 'servo/highfive': True})
+
+        # ... nor should it affect an existing installation (which could have other repos).
+        payload['repository']['owner']['login'] = 'servo'
+        payload['sender'] = {'login': 'foo'}
+        runner.handle_payload('issues', payload)
+        payload['repository']['owner']['login'] = 'foobar'
+        r = runner.handle_payload('issues', payload)
+        self.assertTrue(r is HandlerError.UnregisteredRepo)
+        self.assertFalse(runner.installations[0].queue.empty())
+
+    def test_runner_journal(self):
+        '''
+        If a journal has been configured, the payloads are persisted first, and the daemon
+        passes them over to the managers. Rejected payloads are acked immediately.
+        '''
+
+        journal_path = tempfile.mkdtemp()
+        runner = create_runner()
+        runner.config.journal_path = journal_path
+        runner = Runner(runner.config)
+        payload = {
+            'installation': {
+                'id': 0
+            },
+            'repository': {
+                'owner': {
+                    'login': 'servo'
+                },
+                'name': 'highfive',
+            },
+            'sender': {
+                'login': 'foo'
+            }
+        }
+
+        runner.queue_payload('issues', json.dumps(payload))
+        runner.queue_payload('status', json.dumps(payload))
+        runner._consume_journal()
+        (_api, event, seq) = runner.installations[0].queue.get()
+        self.assertEqual((event, seq), ('issues', 0))
+        # Disabled event has been acked, but the cursor can't move past the queued payload.
+        self.assertEqual(runner.journal.cursors, {})
+        runner.journal.ack(0, seq)
+        self.assertEqual(runner.journal.cursors, {'0': 1})
+        shutil.rmtree(journal_path)
+
+    def test_runner_rehydration(self):
+        '''
+        Installations in the store are brought back when their timers are due, and they're
+        evicted once they've been idle for a while.
+        '''
+
+        dump_path = tempfile.mkdtemp()
+        runner = create_runner()
+        runner.config.dump_path = dump_path
+        runner = Runner(runner.config)
+        event_handlers.load_handlers_using(runner.config)
+        runner.store.write_object(3, TIMERS_KEY, {
+            'handlers': {'EasyIssueAssigner': {'5': 10}}
+        })
+
+        try:
+            runner._load_timers()
+            self.assertEqual(len(runner.installations), 0)
+            runner._produce_ticks(time.time())
+            self.assertEqual(len(runner.installations), 1)
+            self.assertTrue(runner.installations.memory_usage()[3] > 0)
+
+            runner.installations.ttl = 0
+            runner._evict_idle()        # still has a pending tick
+            self.assertEqual(len(runner.installations), 1)
+            (api, event, seq) = runner.installations[3].queue.get()
+            self.assertEqual((api.payload, event, seq),
+                             ({'action': '__tick', 'timers': {'EasyIssueAssigner': ['5']}},
+                              'issues', None))
+            runner._evict_idle()
+            self.assertEqual(len(runner.installations), 0)
+            self.assertEqual(runner.scheduler.states, {})
+        finally:
+            shutil.rmtree(dump_path)
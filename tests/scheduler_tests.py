@@ -0,0 +1,153 @@
+from highfive.runner.installation_manager import coalesce_payloads
+from highfive.runner.scheduler import Scheduler
+
+from unittest import TestCase
+
+
+class FakeAPI(object):
+    def __init__(self, number, action=None, label=None, repo='servo'):
+        self.number = number
+        self.owner = 'servo'
+        self.repo = repo
+        self.payload = {'action': action}
+        self.current_label = label
+
+
+class SchedulerTests(TestCase):
+    def drain(self, scheduler, has_capacity=lambda inst_id: True):
+        items = []
+        while True:
+            next_item = scheduler.pop(has_capacity)
+            if next_item is None:
+                return items
+            inst_id, (api, event, seq) = next_item
+            items.append((inst_id, seq))
+
+    def test_fairness(self):
+        '''An installation with a huge backlog can't starve the others.'''
+
+        scheduler = Scheduler(quantum=2)
+        for seq in range(6):
+            scheduler.put(1, (FakeAPI(seq), 'issues', seq))
+        scheduler.put(2, (FakeAPI(0), 'issues', 6))
+        scheduler.put(3, (FakeAPI(0), 'issues', 7))
+
+        self.assertEqual(self.drain(scheduler),
+                         [(1, 0), (1, 1), (2, 6), (3, 7), (1, 2), (1, 3), (1, 4), (1, 5)])
+        self.assertEqual(list(scheduler.active), [])
+
+        # Installations which can't take payloads are skipped.
+        scheduler.put(1, (FakeAPI(0), 'issues', 0))
+        scheduler.put(2, (FakeAPI(0), 'issues', 1))
+        self.assertEqual(self.drain(scheduler, lambda inst_id: inst_id != 1), [(2, 1)])
+        self.assertEqual(self.drain(scheduler), [(1, 0)])
+
+    def test_priority(self):
+        '''
+        Comments go before lifecycle events, which go before ticks. Payloads for the same
+        issue/PR are never reordered.
+        '''
+
+        scheduler = Scheduler()
+        queue = scheduler.queue_for(1)
+        queue.put((FakeAPI(None, '__tick'), 'issues', 0))
+        queue.put((FakeAPI(5, 'opened'), 'pull_request', 1))
+        queue.put((FakeAPI(6, 'opened'), 'pull_request', 2))
+        queue.put((FakeAPI(6, 'created'), 'issue_comment', 3))
+        queue.put((FakeAPI(7, 'created'), 'issue_comment', 4))
+        self.assertEqual(queue.qsize(), 5)
+
+        seqs = []
+        while not queue.empty():
+            seqs.append(queue.get()[2])
+        self.assertEqual(seqs, [2, 3, 4, 1, 0])
+        self.assertTrue(queue.get() is None)
+
+    def test_wait_times(self):
+        scheduler = Scheduler()
+        scheduler.put(1, (FakeAPI(None, '__tick'), 'issues', 0))
+        scheduler.put(1, (FakeAPI(1, 'created'), 'issue_comment', 1))
+        self.drain(scheduler)
+
+        stats = scheduler.wait_times()
+        self.assertEqual(sorted(stats), ['command', 'lifecycle', 'timer'])
+        self.assertEqual(stats['command']['count'], 1)
+        self.assertEqual(stats['lifecycle'], {'count': 0, 'mean': 0.0, 'max': 0.0})
+        self.assertTrue(stats['timer']['max'] >= stats['timer']['mean'] >= 0)
+
+    def test_coalescing(self):
+        '''
+        Payloads superseded by a later payload for the same issue/PR are dropped (along with
+        the later one, if they cancel each other out).
+        '''
+
+        rules = {('synchronize', 'synchronize'): 'supersede', ('labeled', 'unlabeled'): 'cancel'}
+        def coalesce(earlier, later):
+            if earlier[0].current_label != later[0].current_label:
+                return None
+            return rules.get((earlier[0].payload['action'], later[0].payload['action']))
+
+        collapsed = []
+        scheduler = Scheduler(coalesce=coalesce,
+                              on_drop=lambda inst_id, item: collapsed.append((inst_id, item[2])))
+        scheduler.put(1, (FakeAPI(5, 'synchronize'), 'pull_request', 0))
+        scheduler.put(1, (FakeAPI(6, 'synchronize'), 'pull_request', 1))
+        scheduler.put(1, (FakeAPI(5, 'synchronize'), 'pull_request', 2))
+        scheduler.put(1, (FakeAPI(5, 'synchronize'), 'pull_request', 3))
+        scheduler.put(1, (FakeAPI(5, 'labeled', 'foo'), 'pull_request', 4))
+        scheduler.put(1, (FakeAPI(5, 'unlabeled', 'bar'), 'pull_request', 5))
+        scheduler.put(2, (FakeAPI(5, 'labeled', 'foo'), 'pull_request', 6))
+        scheduler.put(2, (FakeAPI(5, 'unlabeled', 'foo'), 'pull_request', 7))
+
+        self.assertEqual(collapsed, [(1, 0), (1, 2), (2, 6), (2, 7)])
+        self.assertEqual(scheduler.size_of(2), 0)
+        self.assertEqual(self.drain(scheduler), [(1, 1), (1, 3), (1, 4), (1, 5)])
+        self.assertEqual(scheduler.dropped_counts()['collapsed'],
+                         {'pull_request.synchronize': 2, 'pull_request.labeled': 1,
+                          'pull_request.unlabeled': 1})
+
+    def test_coalescing_across_repos(self):
+        '''Payloads for different repos are never coalesced, even if they have the same number.'''
+
+        dropped = []
+        scheduler = Scheduler(coalesce=lambda earlier, later: 'supersede',
+                              on_drop=lambda inst_id, item: dropped.append(item[2]))
+        scheduler.put(1, (FakeAPI(5, 'synchronize'), 'pull_request', 0))
+        scheduler.put(1, (FakeAPI(5, 'synchronize', repo='saltfs'), 'pull_request', 1))
+        self.assertEqual(dropped, [])
+        self.assertEqual(scheduler.size_of(1), 2)
+
+        earlier = (FakeAPI(5, 'synchronize'), 'pull_request', 0)
+        later = (FakeAPI(5, 'synchronize', repo='saltfs'), 'pull_request', 1)
+        self.assertTrue(coalesce_payloads(earlier, later) is None)
+        self.assertEqual(self.drain(scheduler), [(1, 0), (1, 1)])
+
+    def test_shedding(self):
+        '''
+        Ticks for the same event are merged. Once an installation is over its limit, the newest
+        lifecycle payloads are shed, but the commands are never shed.
+        '''
+
+        dropped = []
+        scheduler = Scheduler(coalesce=coalesce_payloads, limit=3,
+                              on_drop=lambda inst_id, item: dropped.append(item[2]))
+        tick = FakeAPI(None, '__tick')
+        tick.payload['timers'] = {'Foo': ['1']}
+        scheduler.put(1, (tick, 'issues', 0))
+        later_tick = FakeAPI(None, '__tick')
+        later_tick.payload['timers'] = {'Foo': ['2', '1'], 'Bar': None}
+        scheduler.put(1, (later_tick, 'issues', 1))
+        scheduler.put(1, (FakeAPI(None, '__tick'), 'pull_request', 2))
+        self.assertEqual(dropped, [0])
+        self.assertEqual(later_tick.payload['timers'], {'Foo': ['1', '2'], 'Bar': None})
+
+        scheduler.put(1, (FakeAPI(5, 'opened'), 'issues', 3))
+        scheduler.put(1, (FakeAPI(6, 'opened'), 'issues', 4))
+        scheduler.put(1, (FakeAPI(6, 'created'), 'issue_comment', 5))
+        scheduler.put(1, (FakeAPI(7, 'created'), 'issue_comment', 6))
+        self.assertEqual(dropped, [0, 4, 3])
+        self.assertEqual(scheduler.depths(), {1: 4})
+        self.assertEqual(scheduler.total, 4)
+        self.assertEqual(scheduler.dropped_counts()['shed'], {'issues.opened': 2})
+        self.assertEqual(self.drain(scheduler), [(1, 5), (1, 6), (1, 1), (1, 2)])
+        self.assertEqual(scheduler.total, 0)
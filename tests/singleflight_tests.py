@@ -0,0 +1,68 @@
+from highfive.runner.singleflight import SingleFlight
+
+from threading import Event, Thread
+from unittest import TestCase
+
+import time
+
+
+class SingleFlightTests(TestCase):
+    def test_shared_calls(self):
+        '''Callers coming in while a call is in flight share its result.'''
+
+        flight = SingleFlight(copy=list)
+        release, calls, results = Event(), [], []
+
+        def call():
+            calls.append(1)
+            release.wait(5)
+            return ['foo']
+
+        def run():
+            results.append(flight.do('key', call))
+
+        threads = [Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while flight.shared < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _result, shared in results), [False, True, True])
+        # Everyone gets their own copy.
+        self.assertEqual(len(set(id(result) for result, _shared in results)), 3)
+
+        # Once it's done, the next call is made again.
+        self.assertEqual(flight.do('key', call), (['foo'], False))
+        self.assertEqual(len(calls), 2)
+
+    def test_shared_errors(self):
+        flight = SingleFlight()
+        release, errors = Event(), []
+
+        def call():
+            release.wait(5)
+            raise ValueError('foo')
+
+        def run():
+            try:
+                flight.do('key', call)
+            except ValueError as err:
+                errors.append(str(err))
+
+        threads = [Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while flight.shared < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, ['foo', 'foo'])
+        self.assertEqual(flight.calls, {})
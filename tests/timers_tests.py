@@ -0,0 +1,84 @@
+from highfive.runner.timers import SCAN_KEY, TIMERS_KEY, TimerService, to_timestamp
+
+from datetime import datetime
+from dateutil.parser import parse as datetime_parse
+from unittest import TestCase
+
+
+class TestStore(object):
+    def __init__(self, data=None):
+        self.data = data or {}
+
+    def get_object(self, key):
+        return self.data.get(key, {})
+
+    def write_object(self, key, data):
+        self.data[key] = data
+
+
+class TimerServiceTests(TestCase):
+    def test_timestamps(self):
+        self.assertEqual(to_timestamp(datetime_parse('1970-01-02T00:00:00Z')), 86400)
+        self.assertEqual(to_timestamp(42), 42.0)
+        now = datetime.now()
+        self.assertEqual(datetime.fromtimestamp(to_timestamp(now)), now)
+
+    def test_due_timers(self):
+        '''Only the due timers are fired. Rescheduled and cancelled timers are skipped.'''
+
+        service = TimerService()
+        timers = service.view(1)
+        timers.schedule('Foo', '5', 10)
+        timers.schedule('Foo', '6', 20)
+        timers.schedule('Bar', '', 15)
+        service.schedule(2, 'Foo', '5', 5)
+        timers.schedule('Foo', '6', 12)     # rescheduled
+        timers.cancel('Bar', '')
+
+        self.assertEqual(service.pop_due(now=1), {})
+        self.assertEqual(service.pop_due(now=12), {1: {'Foo': ['5', '6']}, 2: {'Foo': ['5']}})
+        self.assertEqual(service.pop_due(now=100), {})
+        self.assertEqual(service.heap, [])
+
+        # Handlers can ask to go through all their data later.
+        timers.schedule('Foo', '5', 110)
+        timers.schedule('Foo', SCAN_KEY, 120)
+        self.assertEqual(service.pop_due(now=130), {1: {'Foo': None}})
+
+    def test_stale_entries(self):
+        '''Stale entries are dropped from the heap once they outnumber the live timers.'''
+
+        service = TimerService()
+        timers = service.view(1)
+        timers.schedule('Foo', '5', 10)
+        for deadline in range(1000, 1100):      # rescheduled on every tick
+            timers.schedule('Foo', '6', deadline)
+            self.assertTrue(len(service.heap) <= 4)
+        timers.cancel('Foo', '6')
+        self.assertTrue(len(service.heap) <= 2)
+        self.assertEqual(service.pop_due(now=2000), {1: {'Foo': ['5']}})
+        self.assertEqual((service.heap, service.stale), ([], 0))
+
+    def test_persistence(self):
+        '''
+        Timers are loaded from the store, and written back when they change. Handlers without
+        any persisted timers go through all their data once.
+        '''
+
+        store = TestStore({TIMERS_KEY: {'handlers': {'Foo': {'5': 10}}}})
+        service = TimerService()
+        service.load(1, store, ['Foo', 'Bar'])
+        self.assertEqual(service.pop_due(now=1), {1: {'Bar': None}})
+        self.assertEqual(service.pop_due(now=1), {})
+
+        service.flush()
+        self.assertEqual(store.data[TIMERS_KEY], {'handlers': {'Foo': {'5': 10}, 'Bar': {}}})
+
+        service.schedule(1, 'Bar', '7', 20)
+        self.assertEqual(service.pop_due(now=15), {1: {'Foo': ['5']}})
+        service.flush()
+        self.assertEqual(store.data[TIMERS_KEY], {'handlers': {'Foo': {}, 'Bar': {'7': 20.0}}})
+
+        service = TimerService()
+        service.load(1, store, ['Foo', 'Bar'])
+        self.assertEqual(service.pop_due(now=20), {1: {'Bar': ['7']}})
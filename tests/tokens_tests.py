@@ -0,0 +1,113 @@
+from highfive.runner import InstallationManager, Response
+from highfive.runner.tokens import AppAuth, TokenRefresher
+from installation_manager_tests import SAMPLE_KEY, create_config
+
+from datetime import datetime, timedelta
+from jose import jwt
+from threading import Event, Thread
+from unittest import TestCase
+
+import time
+
+
+class TestManager(object):
+    def __init__(self, inst_id):
+        self.installation_id = inst_id
+        self.refreshed = Event()
+
+    def refresh_token(self):
+        self.refreshed.set()
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        self.refreshers = []
+
+    def tearDown(self):
+        for refresher in self.refreshers:
+            refresher.stop()
+
+    def create_refresher(self, **kwargs):
+        refresher = TokenRefresher(**kwargs)
+        self.refreshers.append(refresher)
+        return refresher
+
+    def test_jwt_reuse(self):
+        '''JWTs are reused until they're about to expire.'''
+
+        auth = AppAuth(create_config())
+        token = auth.get_jwt(now=1000)
+        payload = jwt.decode(token, SAMPLE_KEY, options={'verify_exp': False})
+        self.assertEqual((payload['iat'], payload['exp'], payload['iss']), (1000, 1600, 666))
+        self.assertEqual(auth.get_jwt(now=1500), token)
+        self.assertNotEqual(auth.get_jwt(now=1560), token)
+
+    def test_refresher(self):
+        '''Renewals are done in the background, ahead of the expiry (unless they're cancelled).'''
+
+        refresher = self.create_refresher(margin=300)
+        # (far enough in the future that the background thread doesn't get to them)
+        base = time.time() + 3600
+        managers = [TestManager(1), TestManager(2), TestManager(3)]
+        refresher.schedule(managers[0], base + 2000)
+        refresher.schedule(managers[1], base + 2500)
+        refresher.schedule(managers[2], base + 1500)
+        refresher.cancel(3)
+        refresher.schedule(managers[0], base + 2100)       # rescheduled
+
+        self.assertEqual(refresher.pop_due(now=base + 1700), [])
+        self.assertEqual(refresher.pop_due(now=base + 1900), [managers[0]])
+        self.assertEqual(refresher.pop_due(now=base + 2300), [managers[1]])
+        self.assertEqual(refresher.pop_due(now=base + 2300), [])
+
+        manager = TestManager(4)
+        refresher.schedule(manager, time.time() + 300)
+        self.assertTrue(manager.refreshed.wait(5))
+
+        # Once it's stopped, the thread is gone (and renewals aren't made anymore).
+        refresher.stop()
+        self.assertFalse(refresher.thread.is_alive())
+        manager = TestManager(5)
+        refresher.schedule(manager, time.time() + 300)
+        self.assertFalse(manager.refreshed.wait(0.1))
+
+    def test_single_renewal(self):
+        '''
+        Concurrent requests share a single renewal. Tokens of active installations are renewed
+        by the refresher, and the ones of idle installations are left to expire.
+        '''
+
+        class FnScope(object):
+            renewals = 0
+
+        scope = FnScope()
+
+        def test_request(method, url, data, headers):
+            if method == 'POST':
+                time.sleep(0.05)
+                scope.renewals += 1
+                expiry = datetime.now() + timedelta(seconds=3600)
+                return Response(data={'token': 'booya', 'expires_at': '%sZ' % expiry})
+            self.assertEqual(headers['Authorization'], 'token booya')
+            return Response(data={})
+
+        refresher = self.create_refresher()
+        manager = InstallationManager(config=create_config(), installation_id=255, store=None,
+                                      json_request=test_request, refresher=refresher)
+        threads = [Thread(target=manager.request, args=('GET', 'https://some.url/%s' % i))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(scope.renewals, 1)
+        self.assertEqual(refresher.managers.keys(), [255])
+
+        manager.refresh_token()
+        self.assertEqual(scope.renewals, 2)
+        manager.refresh_token()     # no requests since the last renewal
+        self.assertEqual(scope.renewals, 2)
+
+        manager.close()
+        self.assertEqual(refresher.managers, {})
@@ -0,0 +1,107 @@
+from highfive.api_provider.contributors import CONTRIBUTORS
+from highfive.runner import Runner
+from highfive.runner.request import SESSIONS
+
+from runner_tests import create_runner
+from unittest import TestCase
+
+import imp
+import json
+import time
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+class WorkerPoolTests(TestCase):
+    def create_runner(self, processes, runner_class=Runner):
+        runner = create_runner()
+        runner.config.worker_processes = processes
+        return runner_class(runner.config)
+
+    def create_payload(self, inst_id):
+        return {
+            'installation': {
+                'id': inst_id
+            },
+            'repository': {
+                'owner': {
+                    'login': 'servo'
+                },
+                'name': 'highfive',
+            },
+            'sender': {
+                'login': 'foo'
+            }
+        }
+
+    def test_sharding(self):
+        '''Installations are always routed to the same worker.'''
+
+        runner = self.create_runner(3)
+        self.assertEqual(runner.pool.shard_for(4), runner.pool.shard_for(4))
+        self.assertEqual(set(runner.pool.shard_for(i) for i in range(30)), set([0, 1, 2]))
+
+    def test_dispatch_and_restart(self):
+        '''
+        Payloads are handled by the workers, which ack them back to the parent. If a worker dies,
+        it's replaced, and the payloads it hasn't acked are sent to the new worker.
+        '''
+
+        runner = self.create_runner(2)
+        pool = runner.pool
+        pool.start()
+
+        try:
+            r = runner.handle_payload('issues', self.create_payload(0))
+            self.assertTrue(r is None)
+            self.assertEqual(len(runner.installations), 0)      # parent doesn't own any managers
+            self.assertTrue(wait_until(lambda: pool.supervise() or pool.pending() == 0))
+
+            shard = pool.shard_for(1)
+            worker = pool.workers[shard]
+            worker.terminate()
+            worker.join()
+            pool.dispatch(1, 'issues', self.create_payload(1))
+            self.assertEqual(pool.pending(), 1)
+
+            self.assertTrue(wait_until(lambda: pool.supervise() or pool.pending() == 0))
+            self.assertTrue(pool.workers[shard] is not worker)
+            self.assertTrue(pool.workers[shard].is_alive())
+        finally:
+            for worker in pool.workers:
+                worker.terminate()
+
+    def test_fresh_worker(self):
+        '''
+        Workers build their own runner (and process-wide state) instead of using the parent's.
+        Objects copied by the fork have the same IDs as the parent's objects.
+        '''
+
+        class WorkerRunner(Runner):
+            def _run_shard(self, shard):
+                ids = [id(self), id(self.scheduler), id(self.installations), id(self.app_auth),
+                       id(SESSIONS.lock), id(CONTRIBUTORS.lock)]
+                self.journal.done.put((shard, ids))
+
+        runner = self.create_runner(2, WorkerRunner)
+        parent_ids = set([id(runner), id(runner.scheduler), id(runner.installations),
+                          id(runner.app_auth), id(SESSIONS.lock), id(CONTRIBUTORS.lock)])
+        runner.pool.start()
+
+        try:
+            for _ in range(2):
+                shard, ids = runner.pool.done.get(timeout=10)
+                self.assertEqual(parent_ids & set(ids), set())
+        finally:
+            for worker in runner.pool.workers:
+                worker.terminate()
+
+        # The queues are in the workers, so the parent doesn't know their depths.
+        serve = imp.load_source('serve', 'serve.py')
+        resp = serve.create_app(runner).test_client().get('/queue')
+        self.assertEqual(json.loads(resp.data), {'backlog': 0, 'installations': 'unavailable'})